@@ -1,52 +1,514 @@
-from ..api.schemas import AgentRunRequest, SuccessResponse, Usage
+from ..api.schemas import (AgentRunRequest, SuccessResponse, Usage, Billing, ChunkResult, ErrorDetail, Message, PromptStats,
+                           Result, StreamDelta, StreamDone, StreamProgress, Timing, Warning)
 from ..providers.factory import get_provider
+from . import chunking
 from .prompts import construct_prompt
-from ..billing.pricing import PricingService
-from ..utils.token_estimator import estimate_tokens
+from .cache import response_cache, request_cache_key
+from ..core.circuit_breaker import circuit_breakers
+from ..core.concurrency import admission, chunk_limiter
+from ..core.config import settings
+from ..core.errors import BaseGatewayException, JsonInvalidException, ProviderException
+from ..core.metrics import metrics
+from ..core.rate_limit import rate_limiter
+from ..core.singleflight import singleflight
+from ..providers.client_pool import credential_fingerprint
+from ..providers.policy import call_policy
+from ..providers.base import BaseProvider
+from ..providers.structured import enforce_json, request_schema
+from ..billing.ledger import usage_ledger
+from ..billing.models import UsageEvent
+from ..billing.pricing import PricingService, total_billing, total_usage
+from ..utils.json_schema import SchemaViolation, StreamValidator
+from ..utils.json_tools import dumps
+from ..utils.token_estimator import classify, token_estimator
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+import asyncio
+import time
 import uuid
 
 class AgentService:
     @staticmethod
-    async def run_agent(request: AgentRunRequest) -> SuccessResponse:
-        pricing_service = PricingService()
-
-        # 1. Get the provider
-        provider = get_provider(request.provider)
-
-        # 2. Construct the prompt if not in message format
+    def _prepare(request: AgentRunRequest) -> Optional[PromptStats]:
+        # Construct the prompt if not in message format
+        stats = None
         if not request.input.messages:
-            request.input.messages = construct_prompt(
+            messages, stats = construct_prompt(
                 instruction=request.input.instruction,
                 data=request.input.data,
                 provider=request.provider,
                 response_format=request.response_format,
-                json_schema=request.json_schema
+                json_schema=request.json_schema,
+                model=request.model,
+                data_encoding=request.input.data_encoding,
+                max_field_chars=request.input.max_field_chars,
             )
-        
-        # 3. Add trace_id to the request
+            request.input.messages = [Message.model_construct(**message) for message in messages]
+
+        # Reject schemas that don't compile before going upstream
+        request_schema(request)
+
+        # Add trace_id to the request
         if not request.trace_id:
             request.trace_id = str(uuid.uuid4())
+        return stats
 
-        # 4. Invoke the provider
-        response = await provider.invoke(request)
-
-        # 5. Estimate tokens if necessary
-        if response.usage.is_estimated:
-            # A more robust implementation would estimate input and output separately
-            input_tokens = estimate_tokens(request.input)
-            output_tokens = estimate_tokens(response.result.text or response.result.json)
-            response.usage = Usage(
-                input_tokens=input_tokens,
-                output_tokens=output_tokens,
-                total_tokens=input_tokens + output_tokens,
-                is_estimated=True
-            )
+    @staticmethod
+    def _cache_hit(request: AgentRunRequest, response: SuccessResponse) -> SuccessResponse:
+        response.trace_id = request.trace_id
+        response.usage.cached = True
+        response.billing = AgentService._not_billed(response.billing, "Served from the response cache; not billed.")
+        response.timing.provider_duration_ms = 0
+        response.warnings.append(Warning(code="CACHE_HIT", message="Served from the response cache."))
+        return response
+
+    @staticmethod
+    def _not_billed(billing: Billing, note: str) -> Billing:
+        """
+        What a response that cost no upstream call of its own bills, matching its zero-cost ledger entry.
+        """
+        return Billing.model_construct(
+            currency=billing.currency,
+            estimated_cost=0.0,
+            pricing_source=billing.pricing_source,
+            pricing_version=billing.pricing_version,
+            note=note,
+        )
+
+    @staticmethod
+    def _account_usage(request: AgentRunRequest, provider: str, model: str, usage: Optional[Usage],
+                       output_chars: int, output_type: str) -> Usage:
+        """
+        Exact usage calibrates the token estimator; missing or estimated usage is filled in from it.
+        """
+        messages = request.input.messages
+        if usage is not None and not usage.is_estimated:
+            token_estimator.observe_messages(provider, model, messages, usage.input_tokens)
+            token_estimator.observe_output(provider, model, output_chars, output_type, usage.output_tokens)
+            return usage
+
+        input_tokens = token_estimator.estimate_messages(messages, provider, model)
+        output_tokens = token_estimator.estimate_chars(output_chars, output_type, provider, model)
+        return Usage.model_construct(
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            total_tokens=input_tokens + output_tokens,
+            is_estimated=True
+        )
+
+    @staticmethod
+    async def _invoke(request: AgentRunRequest, cache_key: Optional[str], prompt: Optional[PromptStats] = None) -> SuccessResponse:
+        pricing_service = PricingService()
+
+        # Retries, hedging and fallbacks; the response names the provider/model that answered.
+        response = await call_policy.invoke(request)
+        response.prompt = prompt
+
+        # Estimate tokens if necessary, or learn from the exact counts
+        if response.result.json is not None:
+            output_chars, output_type = len(dumps(response.result.json)), "json"
+        else:
+            text = response.result.text or ""
+            output_chars, output_type = len(text), classify(text)
+        response.usage = AgentService._account_usage(
+            request, response.provider, response.model, response.usage, output_chars, output_type
+        )
 
-        # 6. Calculate billing
+        # Calculate billing
         response.billing = pricing_service.calculate_cost(
-            provider=request.provider,
-            model=request.model,
+            provider=response.provider,
+            model=response.model,
             usage=response.usage
         )
-        
+
+        # Answers from a fallback target are not what the request asked for; don't cache them.
+        if cache_key is not None and (response.provider, response.model) == (request.provider, request.model):
+            await response_cache.set(cache_key, response)
+
         return response
+
+    @staticmethod
+    def _record(request: AgentRunRequest, tenant_id: str, provider: str, model: str, usage: Usage,
+                billing: Billing, upstream: bool = True):
+        if upstream:
+            metrics.observe_usage(provider, model, usage.input_tokens, usage.output_tokens, billing.estimated_cost)
+        if not settings.LEDGER_ENABLED:
+            return
+        usage_ledger.record(UsageEvent(
+            ts=time.time(),
+            tenant=tenant_id,
+            provider=provider,
+            model=model,
+            trace_id=request.trace_id,
+            input_tokens=usage.input_tokens,
+            output_tokens=usage.output_tokens,
+            cached_input_tokens=usage.cached_input_tokens,
+            cost=billing.estimated_cost if upstream else 0.0,
+            is_estimated=usage.is_estimated,
+            upstream=upstream,
+            pricing_version=billing.pricing_version,
+        ))
+
+    @staticmethod
+    async def run_agent(request: AgentRunRequest, tenant_id: str = "anonymous") -> SuccessResponse:
+        chunks = AgentService._chunks(request)
+        if chunks is not None:
+            return await AgentService._map_reduce(request, tenant_id, chunks)
+        response, upstream = await AgentService._run(request, tenant_id)
+        AgentService._record(request, tenant_id, response.provider, response.model, response.usage, response.billing, upstream)
+        return response
+
+    @staticmethod
+    def _chunks(request: AgentRunRequest) -> Optional[List[Union[Dict, str]]]:
+        """
+        The data of each chunk when a request with `chunking` has data too large for the context
+        window, otherwise None.
+        """
+        if request.chunking is None or request.input.messages:
+            return None
+        get_provider(request.provider)
+        request_schema(request)
+        chunks = chunking.plan(request)
+        if len(chunks) < 2:
+            return None
+        if not request.trace_id:
+            request.trace_id = str(uuid.uuid4())
+        return chunks
+
+    @staticmethod
+    async def _run_chunk(request: AgentRunRequest, tenant_id: str, index: int, stage: str = "map",
+                         depth: int = 0) -> Tuple[ChunkResult, Union[SuccessResponse, BaseGatewayException]]:
+        """
+        Runs one chunk as its own request (cached, coalesced and recorded in the ledger like any
+        other) under the chunk caps. Errors are returned, not raised.
+        """
+        try:
+            nested = AgentService._chunks(request)
+            if nested is not None:
+                # Only the leaf calls hold a slot, or a reduce could wait on its own chunks.
+                response = await AgentService._map_reduce(request, tenant_id, nested, depth)
+            else:
+                async with chunk_limiter.get(request.provider, request.model):
+                    response, upstream = await AgentService._run(request, tenant_id)
+                AgentService._record(request, tenant_id, response.provider, response.model, response.usage, response.billing, upstream)
+        except Exception as e:
+            if not isinstance(e, BaseGatewayException):
+                e = ProviderException(str(e))
+            e.details = {**e.details, "chunk": index, "stage": stage}
+            error = ErrorDetail(code=e.code, message=e.message, details=e.details)
+            return ChunkResult.model_construct(index=index, stage=stage, ok=False, usage=None, billing=None,
+                                               provider_duration_ms=0, error=error), e
+        return AgentService._chunk_result(index, stage, response.usage, response.billing,
+                                          response.timing.provider_duration_ms), response
+
+    @staticmethod
+    def _chunk_result(index: int, stage: str, usage: Usage, billing: Billing, provider_duration_ms: int) -> ChunkResult:
+        return ChunkResult.model_construct(index=index, stage=stage, ok=True, usage=usage, billing=billing,
+                                           provider_duration_ms=provider_duration_ms, error=None)
+
+    @staticmethod
+    async def _map(request: AgentRunRequest, tenant_id: str,
+                   chunks: List[Union[Dict, str]]) -> AsyncIterator[Tuple[ChunkResult, Optional[SuccessResponse]]]:
+        """
+        Runs the chunks concurrently and yields them in completion order. Unless `allow_partial`,
+        the first failure cancels the others and is raised; so is the last one when all fail.
+        """
+        tasks = [
+            asyncio.create_task(AgentService._run_chunk(chunking.chunk_request(request, data, index, len(chunks)), tenant_id, index))
+            for index, data in enumerate(chunks)
+        ]
+        error = None
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                chunk, outcome = await next_done
+                if chunk.ok:
+                    yield chunk, outcome
+                    continue
+                if not request.chunking.allow_partial:
+                    raise outcome
+                error = outcome
+                yield chunk, None
+            if error is not None and all(not task.result()[0].ok for task in tasks):
+                raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    def _chunked(request: AgentRunRequest, chunks: List[ChunkResult], map_count: int, wall_ms: int) -> dict:
+        """
+        The usage, billing, timing and warnings shared by chunked responses and stream ends.
+        """
+        succeeded = [chunk for chunk in chunks if chunk.ok]
+        failed = len(chunks) - len(succeeded)
+        message = f"The data was split into {map_count} chunks"
+        message += f"; {failed} failed and were left out." if failed else "."
+        return {
+            "trace_id": request.trace_id,
+            "provider": request.provider,
+            "model": request.model,
+            "usage": total_usage([chunk.usage for chunk in succeeded]),
+            "billing": total_billing([chunk.billing for chunk in succeeded], "chunks"),
+            # Chunks overlap, so upstream time is wall-clock time of the map and reduce steps.
+            "timing": Timing.model_construct(started_at="", ended_at="", duration_ms=0, provider_duration_ms=wall_ms,
+                                             time_to_first_token_ms=None, queue_wait_ms=0),
+            "warnings": [Warning(code="CHUNKED", message=message)],
+            "echo": None,
+            "prompt": None,
+            "chunks": sorted(chunks, key=lambda chunk: (chunk.stage == "reduce", chunk.index)),
+        }
+
+    @staticmethod
+    async def _map_reduce(request: AgentRunRequest, tenant_id: str, chunks: List[Union[Dict, str]], depth: int = 0) -> SuccessResponse:
+        """
+        Map-reduce over data too large for the context window. Chunk calls are recorded in the
+        ledger one by one; the combined response carries their totals.
+        """
+        start_time = time.time()
+        results: List[ChunkResult] = []
+        responses: Dict[int, SuccessResponse] = {}
+        async for chunk, response in AgentService._map(request, tenant_id, chunks):
+            results.append(chunk)
+            if response is not None:
+                responses[chunk.index] = response
+        partials = [responses[index].result for index in sorted(responses)]
+
+        if request.chunking.reduce == "summarize":
+            reduce_request = chunking.reduce_request(request, partials, depth)
+            chunk, outcome = await AgentService._run_chunk(reduce_request, tenant_id, len(chunks), "reduce", depth + 1)
+            if not chunk.ok:
+                raise outcome
+            results.append(chunk)
+            result = outcome.result
+        else:
+            result = chunking.combine(partials, request.chunking.reduce)
+
+        return SuccessResponse.model_construct(
+            ok=True,
+            result=result,
+            **AgentService._chunked(request, results, len(chunks), int((time.time() - start_time) * 1000)),
+        )
+
+    @staticmethod
+    async def _stream_map_reduce(request: AgentRunRequest, tenant_id: str,
+                                 chunks: List[Union[Dict, str]]) -> AsyncIterator[Union[StreamProgress, StreamDelta, StreamDone]]:
+        """
+        Yields a `progress` event per finished chunk, then the combined result as deltas (a
+        summarizing reduce is streamed as it is generated) and a StreamDone with the totals.
+        """
+        start_time = time.time()
+        results: List[ChunkResult] = []
+        responses: Dict[int, SuccessResponse] = {}
+        async for chunk, response in AgentService._map(request, tenant_id, chunks):
+            results.append(chunk)
+            if response is not None:
+                responses[chunk.index] = response
+            yield StreamProgress.model_construct(trace_id=request.trace_id, completed=len(results), total=len(chunks), chunk=chunk)
+        partials = [responses[index].result for index in sorted(responses)]
+
+        if request.chunking.reduce == "summarize":
+            reduce_request = chunking.reduce_request(request, partials, 0)
+            nested = AgentService._chunks(reduce_request)
+            if nested is not None:
+                # Partial results too large to summarize in one call are reduced in full first.
+                chunk, outcome = await AgentService._run_chunk(reduce_request, tenant_id, len(chunks), "reduce", 1)
+                if not chunk.ok:
+                    raise outcome
+                results.append(chunk)
+                yield StreamDelta.model_construct(trace_id=request.trace_id, delta=AgentService._result_text(outcome.result))
+            else:
+                async with chunk_limiter.get(reduce_request.provider, reduce_request.model):
+                    async with aclosing(AgentService.stream_agent(reduce_request, tenant_id)) as stream:
+                        async for event in stream:
+                            if isinstance(event, StreamDone):
+                                results.append(AgentService._chunk_result(len(chunks), "reduce", event.usage, event.billing,
+                                                                          event.timing.provider_duration_ms))
+                            else:
+                                yield StreamDelta.model_construct(trace_id=request.trace_id, delta=event.delta)
+        else:
+            result = chunking.combine(partials, request.chunking.reduce)
+            yield StreamDelta.model_construct(trace_id=request.trace_id, delta=AgentService._result_text(result))
+
+        yield StreamDone.model_construct(
+            ok=True,
+            **AgentService._chunked(request, results, len(chunks), int((time.time() - start_time) * 1000)),
+        )
+
+    @staticmethod
+    def _result_text(result: Result) -> str:
+        return dumps(result.json).decode() if result.json is not None else result.text or ""
+
+    @staticmethod
+    async def _run(request: AgentRunRequest, tenant_id: str) -> Tuple[SuccessResponse, bool]:
+        """
+        Returns the response and whether it cost an upstream call of its own.
+        """
+        # 1. Fail fast on unknown providers
+        get_provider(request.provider)
+
+        # 2. Construct the prompt and trace_id
+        prompt = AgentService._prepare(request)
+
+        # 3. Charge the tenant's rate limits one request and the estimated input tokens, then
+        # settle with what the call really used (nothing, for cache hits and shared calls)
+        charged = rate_limiter.admit(tenant_id, lambda: AgentService._estimate_input(request))
+        used = 0
+        try:
+            response, upstream = await AgentService._serve(request, prompt)
+            used = response.usage.total_tokens if upstream else 0
+        finally:
+            # Also when the caller goes away (CancelledError), or the charge would never be refunded.
+            rate_limiter.true_up(tenant_id, charged, used)
+        return response, upstream
+
+    @staticmethod
+    def _estimate_input(request: AgentRunRequest) -> int:
+        return token_estimator.estimate_messages(request.input.messages, request.provider, request.model)
+
+    @staticmethod
+    async def _serve(request: AgentRunRequest, prompt: Optional[PromptStats]) -> Tuple[SuccessResponse, bool]:
+        cacheable = response_cache.is_cacheable(request)
+        coalesce = settings.COALESCE_ENABLED and request.coalesce
+        request_key = request_cache_key(request) if cacheable or coalesce else None
+
+        # 4. Serve identical deterministic requests from the cache
+        if cacheable:
+            cached = await response_cache.get(request_key)
+            metrics.observe_cache(hit=cached is not None)
+            if cached is not None:
+                return AgentService._cache_hit(request, cached), False
+
+        # 5. Invoke the provider, estimate usage, bill and store in the cache
+        cache_key = request_key if cacheable else None
+        if not coalesce:
+            return await AgentService._invoke(request, cache_key, prompt), True
+
+        # Identical concurrent requests share one upstream call. The credential is part of the key
+        # so nobody is answered with (or billed to) another caller's key.
+        flight_key = f"{request_key}:{credential_fingerprint(request.auth.key)}"
+        response, shared = await singleflight.do(flight_key, lambda: AgentService._invoke(request, cache_key, prompt))
+        if shared:
+            metrics.observe_coalesced()
+            # The result is shared read-only; only the parts each caller mutates are copied. Like a
+            # cache hit, a follower is marked cached and billed nothing: the leader pays for the call.
+            response = response.model_copy(update={
+                "trace_id": request.trace_id,
+                "usage": response.usage.model_copy(update={"cached": True}),
+                "billing": AgentService._not_billed(response.billing, "Shared an identical in-flight request; not billed."),
+                "timing": response.timing.model_copy(),
+                "warnings": [*response.warnings, Warning(code="COALESCED", message="Shared the result of an identical in-flight request.")],
+            })
+        return response, not shared
+
+    @staticmethod
+    def _check_stream_json(request: AgentRunRequest, schema, validator: Optional[StreamValidator], output: List[str]) -> List[Warning]:
+        """
+        Checks a streamed JSON output as a whole, the way a run's result is checked: raises
+        JsonInvalidException under strict_json, otherwise returns the warnings.
+        """
+        if validator is not None:
+            try:
+                validator.close()
+            except SchemaViolation as e:
+                raise JsonInvalidException("Output does not match json_schema.", details={"errors": [str(e)]}) from None
+        response = SuccessResponse.model_construct(result=BaseProvider.json_result("".join(output)), warnings=[])
+        return enforce_json(request, response, schema).warnings
+
+    @staticmethod
+    async def stream_agent(request: AgentRunRequest, tenant_id: str = "anonymous") -> AsyncIterator[Union[StreamDelta, StreamDone]]:
+        """
+        Streams deltas as they arrive and finishes with a StreamDone carrying usage, billing and timing.
+        Only the output length is kept, not the output itself, except for JSON-format requests:
+        their output is checked like a run's once the stream ends.
+        """
+        chunks = AgentService._chunks(request)
+        if chunks is not None:
+            async for event in AgentService._stream_map_reduce(request, tenant_id, chunks):
+                yield event
+            return
+
+        pricing_service = PricingService()
+        provider = get_provider(request.provider)
+        prompt = AgentService._prepare(request)
+        schema = request_schema(request)
+        validator = StreamValidator(schema) if schema is not None and request.strict_json and settings.JSON_STREAM_VALIDATION else None
+
+        time_to_first_token_ms = None
+        output_chars = 0
+        output_head = ""
+        output: Optional[List[str]] = [] if request.response_format == "json" else None
+        usage = None
+
+        breaker = circuit_breakers.get(request.provider, request.model, getattr(provider, "breaker_backend", "default"))
+        breaker.check()
+        charged = rate_limiter.admit(tenant_id, lambda: AgentService._estimate_input(request))
+        try:
+            async with admission.upstream(request.provider, request.model) as waited:
+                provider_start_time = time.time()
+                with breaker.call(timed=False):
+                    # aclosing: an early exit (schema violation, client gone) closes the upstream stream now.
+                    async with aclosing(provider.stream(request)) as stream:
+                        async for chunk in stream:
+                            if chunk.delta:
+                                if time_to_first_token_ms is None:
+                                    time_to_first_token_ms = int((time.time() - provider_start_time) * 1000)
+                                output_chars += len(chunk.delta)
+                                if len(output_head) < 256:
+                                    output_head += chunk.delta
+                                if output is not None:
+                                    output.append(chunk.delta)
+                                if validator is not None:
+                                    try:
+                                        validator.feed(chunk.delta)
+                                    except SchemaViolation as e:
+                                        raise JsonInvalidException(
+                                            "Output stopped matching json_schema; the stream was cut off.",
+                                            details={"errors": [str(e)], "aborted_after_chars": validator.chars},
+                                        ) from None
+                                yield StreamDelta.model_construct(trace_id=request.trace_id, delta=chunk.delta)
+                            if chunk.usage is not None:
+                                usage = Usage(**chunk.usage)
+
+            provider_duration_ms = int((time.time() - provider_start_time) * 1000)
+            usage = AgentService._account_usage(
+                request, request.provider, request.model, usage, output_chars, classify(output_head)
+            )
+        finally:
+            # Settled even when the client goes away mid-stream (GeneratorExit, CancelledError),
+            # with what the tokens streamed so far cost.
+            if usage is not None:
+                used = usage.total_tokens
+            elif output_chars:
+                used = AgentService._estimate_input(request) + token_estimator.estimate_chars(
+                    output_chars, classify(output_head), request.provider, request.model
+                )
+            else:
+                used = 0
+            rate_limiter.true_up(tenant_id, charged, used)
+
+        billing = pricing_service.calculate_cost(
+            provider=request.provider,
+            model=request.model,
+            usage=usage
+        )
+        AgentService._record(request, tenant_id, request.provider, request.model, usage, billing)
+        # The tokens were spent either way, so the output is checked after it is accounted.
+        warnings = AgentService._check_stream_json(request, schema, validator, output) if output is not None else []
+
+        yield StreamDone.model_construct(
+            trace_id=request.trace_id,
+            provider=request.provider,
+            model=request.model,
+            usage=usage,
+            billing=billing,
+            warnings=warnings,
+            prompt=prompt,
+            timing=Timing.model_construct(
+                started_at="",
+                ended_at="",
+                duration_ms=0,
+                provider_duration_ms=provider_duration_ms,
+                time_to_first_token_ms=time_to_first_token_ms,
+                queue_wait_ms=int(waited * 1000)
+            )
+        )
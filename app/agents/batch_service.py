@@ -0,0 +1,74 @@
+from ..api.schemas import AgentRunRequest, BatchItemResult, BatchSummary, ErrorDetail
+from ..billing.pricing import total_billing, total_usage
+from ..core.concurrency import batch_limiter
+from ..core.metrics import metrics
+from ..core.errors import BaseGatewayException, ProviderException, ValidationException
+from .agent_service import AgentService
+from typing import AsyncIterator, List, Optional
+import asyncio
+import datetime
+import time
+
+class BatchService:
+    @staticmethod
+    async def run_item(index: int, request: AgentRunRequest, trace_id: str, tenant_id: str = "anonymous") -> BatchItemResult:
+        """
+        Runs one batch item under its provider/model cap. Errors are captured in the result, never raised.
+        """
+        request.trace_id = f"{trace_id}-{index}"
+        item_start_time = time.time()
+        try:
+            if not request.input.messages and not request.input.instruction:
+                raise ValidationException("Either 'messages' or 'instruction' must be provided.")
+
+            async with batch_limiter.get(request.provider, request.model):
+                start_time = time.time()
+                started_at = datetime.datetime.utcnow().isoformat()
+                response = await AgentService.run_agent(request, tenant_id)
+
+            response.timing.started_at = started_at
+            response.timing.ended_at = datetime.datetime.utcnow().isoformat()
+            response.timing.duration_ms = int((time.time() - start_time) * 1000)
+            metrics.observe_request(
+                response.provider, response.model, "ok",
+                duration_ms=response.timing.duration_ms,
+                provider_duration_ms=response.timing.provider_duration_ms,
+                queue_wait_ms=response.timing.queue_wait_ms,
+            )
+            return BatchItemResult.model_construct(index=index, ok=True, response=response)
+        except Exception as e:
+            if not isinstance(e, BaseGatewayException):
+                e = ProviderException(str(e))
+            metrics.observe_request(request.provider, request.model, e.code, duration_ms=(time.time() - item_start_time) * 1000)
+            return BatchItemResult(index=index, ok=False, error=ErrorDetail(code=e.code, message=e.message, details=e.details))
+
+    @staticmethod
+    async def run_batch(items: List[AgentRunRequest], trace_id: str,
+                        tenant_ids: Optional[List[str]] = None) -> AsyncIterator[BatchItemResult]:
+        """
+        Runs all items concurrently and yields results in completion order. Each item is charged to
+        its tenant in `tenant_ids` (default "anonymous").
+        Pending items are cancelled if the consumer stops early (e.g. the client disconnects).
+        """
+        tenant_ids = tenant_ids or ["anonymous"] * len(items)
+        tasks = [
+            asyncio.create_task(BatchService.run_item(index, item, trace_id, tenant))
+            for index, (item, tenant) in enumerate(zip(items, tenant_ids))
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    def summarize(results: List[BatchItemResult]) -> BatchSummary:
+        succeeded = [result.response for result in results if result.ok]
+        return BatchSummary(
+            total=len(results),
+            succeeded=len(succeeded),
+            failed=len(results) - len(succeeded),
+            usage=total_usage([response.usage for response in succeeded]),
+            billing=total_billing([response.billing for response in succeeded]),
+        )
@@ -0,0 +1,170 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from ..api.schemas import AgentRunRequest, SuccessResponse
+from ..core.config import settings
+from ..utils.json_tools import canonical_hash
+
+
+def request_cache_key(request: AgentRunRequest) -> str:
+    """
+    Canonical hash of everything that determines the completion. Must be called after the prompt is
+    constructed. Auth, trace_id and metadata are deliberately not part of the key.
+    """
+    return canonical_hash({
+        "provider": request.provider,
+        "model": request.model,
+        "messages": [msg.model_dump() for msg in request.input.messages],
+        "response_format": request.response_format,
+        "json_schema": request.json_schema,
+        "strict_json": request.strict_json,
+        "temperature": request.temperature,
+        "max_output_tokens": request.max_output_tokens,
+        "top_p": request.top_p,
+        "stop": request.stop,
+        "seed": request.seed,
+    })
+
+
+class MemoryCache:
+    """
+    Bounded LRU of serialized responses with a per-entry TTL.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, payload = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return payload
+
+    def set(self, key: str, payload: str, expires_at: Optional[float] = None):
+        if expires_at is None:
+            expires_at = time.time() + self.ttl_seconds
+        self._entries[key] = (expires_at, payload)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SqliteCache:
+    """
+    Persistent tier that survives restarts. Queries run in a worker thread so the event loop never
+    waits on disk.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, expires_at REAL NOT NULL, payload TEXT NOT NULL)"
+        )
+        self._conn.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+        self._conn.commit()
+
+    def _get(self, key: str) -> Optional[Tuple[float, str]]:
+        with self._lock:
+            row = self._conn.execute("SELECT expires_at, payload FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] < time.time():
+            return None
+        return row
+
+    def _set(self, key: str, payload: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, expires_at, payload) VALUES (?, ?, ?)",
+                (key, time.time() + self.ttl_seconds, payload),
+            )
+            self._conn.commit()
+
+    async def get(self, key: str) -> Optional[Tuple[float, str]]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, payload: str):
+        await asyncio.to_thread(self._set, key, payload)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """
+    Exact-match response cache in front of the providers: an in-memory LRU backed by an optional
+    SQLite tier (enabled by CACHE_SQLITE_PATH).
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttl_seconds: Optional[float] = None, sqlite_path: Optional[str] = None):
+        self.ttl_seconds = ttl_seconds or settings.CACHE_TTL_SECONDS
+        self.memory = MemoryCache(max_entries or settings.CACHE_MAX_ENTRIES, self.ttl_seconds)
+        self.sqlite_path = sqlite_path if sqlite_path is not None else settings.CACHE_SQLITE_PATH
+        self._disk: Optional[SqliteCache] = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def disk(self) -> Optional[SqliteCache]:
+        if self._disk is None and self.sqlite_path:
+            self._disk = SqliteCache(self.sqlite_path, self.ttl_seconds)
+        return self._disk
+
+    @staticmethod
+    def is_cacheable(request: AgentRunRequest) -> bool:
+        if not settings.CACHE_ENABLED or not request.cache:
+            return False
+        if settings.CACHE_DETERMINISTIC_ONLY:
+            return request.temperature == 0 or request.seed is not None
+        return True
+
+    async def get(self, key: str) -> Optional[SuccessResponse]:
+        payload = self.memory.get(key)
+        if payload is None and self.disk is not None:
+            row = await self.disk.get(key)
+            if row is not None:
+                expires_at, payload = row
+                self.memory.set(key, payload, expires_at=expires_at)
+        if payload is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return SuccessResponse.model_validate_json(payload)
+
+    async def set(self, key: str, response: SuccessResponse):
+        payload = response.model_dump_json()
+        self.memory.set(key, payload)
+        if self.disk is not None:
+            await self.disk.set(key, payload)
+
+    def close(self):
+        self.memory.clear()
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.memory)}
+
+
+response_cache = ResponseCache()
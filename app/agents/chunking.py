@@ -0,0 +1,221 @@
+from typing import Any, Dict, List, Optional, Union
+from .prompts import construct_prompt
+from ..api.schemas import AgentRunRequest, Input, Result
+from ..core.config import settings
+from ..core.errors import ValidationException
+from ..utils.json_tools import dumps
+from ..utils.token_estimator import classify, token_estimator
+
+# Text is split on the coarsest boundary that makes the pieces fit.
+TEXT_SEPARATORS = ("\n\n", "\n", ". ", " ")
+# Room for the part note added to each chunk's instruction and for estimation error.
+SAFETY_MARGIN = 0.9
+PART_NOTE_TOKENS = 32
+# Summarizing reduces whose partial results don't fit are chunked again, this many times at most.
+MAX_REDUCE_DEPTH = 3
+
+
+def context_window(provider: str, model: str) -> int:
+    """
+    Looked up as "provider:model", then "provider", then CONTEXT_WINDOW_TOKENS.
+    """
+    windows = settings.CONTEXT_WINDOWS
+    return windows.get(f"{provider}:{model}", windows.get(provider, settings.CONTEXT_WINDOW_TOKENS))
+
+
+def size(value: Any) -> int:
+    return len(value) if isinstance(value, str) else len(dumps(value))
+
+
+def data_budget(request: AgentRunRequest) -> int:
+    """
+    The characters of data one chunk may hold: the context window minus the system prompt,
+    the instruction and the room reserved for the answer, or `chunking.max_chunk_tokens`.
+    """
+    data = request.input.data
+    content_type = classify(data) if isinstance(data, str) else "json"
+    tokens = request.chunking.max_chunk_tokens
+    if tokens is None:
+        messages, _ = construct_prompt(
+            request.input.instruction, None, request.provider, request.response_format, request.json_schema, request.model
+        )
+        overhead = token_estimator.estimate_messages(messages, request.provider, request.model) + PART_NOTE_TOKENS
+        reserve = request.max_output_tokens or settings.CHUNK_OUTPUT_RESERVE_TOKENS
+        tokens = int((context_window(request.provider, request.model) - overhead - reserve) * SAFETY_MARGIN)
+    if tokens <= 0:
+        raise ValidationException(
+            "The instruction and output reserve leave no room for data in the context window.",
+            details={"context_window": context_window(request.provider, request.model)},
+        )
+    return max(1, int(tokens * token_estimator.ratio(request.provider, request.model, content_type)))
+
+
+def split_text(text: str, budget: int, separators=TEXT_SEPARATORS) -> List[str]:
+    if len(text) <= budget:
+        return [text]
+    if not separators:
+        return [text[start:start + budget] for start in range(0, len(text), budget)]
+    separator, rest = separators[0], separators[1:]
+    pieces: List[str] = []
+    current = ""
+    for part in text.split(separator):
+        candidate = f"{current}{separator}{part}" if current else part
+        if len(candidate) <= budget:
+            current = candidate
+            continue
+        if current:
+            pieces.append(current)
+        if len(part) <= budget:
+            current = part
+        else:
+            pieces.extend(split_text(part, budget, rest))
+            current = ""
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_list(items: List[Any], budget: int) -> List[List[Any]]:
+    """
+    Packs items greedily into lists that fit the budget. An item too large on its own is split too.
+    """
+    pieces: List[List[Any]] = []
+    current: List[Any] = []
+    used = 2  # the brackets
+    for item in items:
+        item_size = size(item) + 1
+        if used + item_size <= budget:
+            current.append(item)
+            used += item_size
+            continue
+        if current:
+            pieces.append(current)
+        current, used = [], 2
+        if item_size + 2 <= budget:
+            current, used = [item], 2 + item_size
+        else:
+            pieces.extend([piece] for piece in split(item, budget - 2))
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_dict(data: Dict[str, Any], budget: int) -> List[Dict[str, Any]]:
+    """
+    Splits the largest field and repeats the other fields in every chunk, so each chunk keeps its
+    context (e.g. a document's title next to a slice of its records). When the other fields alone
+    don't leave enough room, the top-level fields are packed into groups instead.
+    """
+    key = max(data, key=lambda name: size(data[name]))
+    envelope = {name: value for name, value in data.items() if name != key}
+    room = budget - size(envelope) - size(key) - 2
+    if room >= budget // 2 and isinstance(data[key], (list, dict, str)):
+        return [{name: piece if name == key else value for name, value in data.items()} for piece in split(data[key], room)]
+
+    pieces: List[Dict[str, Any]] = []
+    current: Dict[str, Any] = {}
+    for name, value in data.items():
+        if current and size({**current, name: value}) > budget:
+            pieces.append(current)
+            current = {}
+        if size({name: value}) > budget:
+            pieces.extend({name: piece} for piece in split(value, budget - size(name) - 4))
+        else:
+            current[name] = value
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split(value: Any, budget: int) -> List[Any]:
+    """
+    Splits `value` on its structure (list items, object fields, paragraphs, lines, sentences,
+    words) into pieces of at most `budget` serialized characters where possible.
+    """
+    if size(value) <= budget:
+        return [value]
+    if isinstance(value, str):
+        return split_text(value, budget)
+    if isinstance(value, list):
+        return split_list(value, budget)
+    if isinstance(value, dict) and value:
+        return split_dict(value, budget)
+    return [value]  # an oversized scalar can't be split
+
+
+def plan(request: AgentRunRequest) -> List[Union[Dict, str]]:
+    """
+    The data of each chunk; a single chunk when the data fits. Raises ValidationException when
+    the data needs more than CHUNK_MAX_CHUNKS chunks.
+    """
+    data = request.input.data
+    if not data:
+        return [data]
+    chunks = split(data, data_budget(request))
+    if len(chunks) > settings.CHUNK_MAX_CHUNKS:
+        raise ValidationException(
+            f"The data needs {len(chunks)} chunks; at most {settings.CHUNK_MAX_CHUNKS} are allowed.",
+            details={"chunks": len(chunks), "max_chunks": settings.CHUNK_MAX_CHUNKS},
+        )
+    return chunks
+
+
+def chunk_request(request: AgentRunRequest, data: Union[Dict, str], index: int, total: int) -> AgentRunRequest:
+    instruction = (
+        f"{request.input.instruction}\n\n"
+        f"The data is part {index + 1} of {total} of a larger input; answer for this part only."
+    )
+    return request.model_copy(update={
+        "input": request.input.model_copy(update={"instruction": instruction, "data": data}),
+        "trace_id": f"{request.trace_id}-{index}",
+        "chunking": None,
+    })
+
+
+def reduce_request(request: AgentRunRequest, results: List[Result], depth: int) -> AgentRunRequest:
+    """
+    The summarizing call over the partial results. It may be chunked again, up to MAX_REDUCE_DEPTH.
+    """
+    instruction = request.chunking.reduce_instruction or (
+        "The data holds partial results, in order, each produced for one part of a larger input "
+        f"by this task:\n\n{request.input.instruction}\n\n"
+        "Combine them into a single answer to the task for the whole input."
+    )
+    partial_results = [result.json if result.json is not None else result.text for result in results]
+    return request.model_copy(update={
+        "input": Input(instruction=instruction, data={"partial_results": partial_results},
+                       data_encoding=request.input.data_encoding, max_field_chars=request.input.max_field_chars),
+        "trace_id": f"{request.trace_id}-reduce",
+        "chunking": request.chunking if depth + 1 < MAX_REDUCE_DEPTH else None,
+    })
+
+
+def merge(target: Dict[str, Any], other: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Merges JSON objects: arrays are concatenated, objects merged, and the first scalar wins.
+    """
+    for key, value in other.items():
+        current = target.get(key)
+        if key not in target or current is None:
+            target[key] = value
+        elif isinstance(current, list) and isinstance(value, list):
+            target[key] = current + value
+        elif isinstance(current, dict) and isinstance(value, dict):
+            target[key] = merge(dict(current), value)
+    return target
+
+
+def combine(results: List[Result], mode: str) -> Result:
+    """
+    Combines the chunk results without another model call. "merge_arrays" merges JSON objects;
+    "concat" joins texts with blank lines and collects JSON objects under "results".
+    """
+    if results and all(result.json is not None for result in results):
+        if mode == "merge_arrays":
+            merged: Dict[str, Any] = {}
+            for result in results:
+                merge(merged, result.json)
+            return Result.model_construct(type="json", json=merged, text=None)
+        return Result.model_construct(type="json", json={"results": [result.json for result in results]}, text=None)
+    texts = [result.text if result.json is None else dumps(result.json).decode() for result in results]
+    return Result.model_construct(type="text", text="\n\n".join(text for text in texts if text), json=None)
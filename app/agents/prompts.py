@@ -1,36 +1,159 @@
-from typing import List, Dict, Any, Optional
-import json
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Union
+import orjson
+from ..api.schemas import PromptStats
+from ..core.config import settings
+from ..utils.json_tools import canonical_json, dumps
+from ..utils.token_estimator import token_estimator
+
+BASE_SYSTEM_PROMPT = "You are a helpful assistant. Follow the user's instructions carefully."
+TABLE_HINT = 'Lists of objects with the same keys are given as {"columns": [...], "rows": [[...], ...]}.'
+
+# System prompts by (response_format, canonical schema). They are byte-identical for equal schemas,
+# whatever the key order, so upstream prefix caches (OpenAI prompt caching, Ollama's KV cache) hit.
+_system_prompts: "OrderedDict[Tuple[str, bytes], str]" = OrderedDict()
+
+
+def system_prompt(response_format: str, json_schema: Optional[Dict[str, Any]] = None) -> str:
+    key = (response_format, canonical_json(json_schema) if response_format == "json" and json_schema else b"")
+    content = _system_prompts.get(key)
+    if content is not None:
+        _system_prompts.move_to_end(key)
+        return content
+
+    content = BASE_SYSTEM_PROMPT
+    if response_format == 'json':
+        content += "\nYour response MUST be a valid JSON object."
+        if key[1]:
+            content += f"\nAdhere to the following JSON schema:\n{key[1].decode()}"
+    _system_prompts[key] = content
+    while len(_system_prompts) > settings.JSON_SCHEMA_CACHE_SIZE:
+        _system_prompts.popitem(last=False)
+    return content
+
+
+def truncate_strings(value: Any, max_chars: int, counter: List[int]) -> Any:
+    """
+    Cuts string fields longer than `max_chars`, noting how much was dropped. `counter[0]` counts the cut fields.
+    """
+    if isinstance(value, str):
+        if len(value) <= max_chars:
+            return value
+        counter[0] += 1
+        return f"{value[:max_chars]}…[{len(value) - max_chars} more chars]"
+    if isinstance(value, dict):
+        return {key: truncate_strings(item, max_chars, counter) for key, item in value.items()}
+    if isinstance(value, list):
+        return [truncate_strings(item, max_chars, counter) for item in value]
+    return value
+
+
+def tabulate(value: Any, counter: List[int]) -> Any:
+    """
+    Rewrites lists of two or more objects with the same keys into columns and rows, so each key
+    is written once instead of once per item. `counter[0]` counts the rewritten lists.
+    """
+    if isinstance(value, dict):
+        return {key: tabulate(item, counter) for key, item in value.items()}
+    if not isinstance(value, list):
+        return value
+    items = [tabulate(item, counter) for item in value]
+    if len(items) < 2 or not all(isinstance(item, dict) for item in items):
+        return items
+    columns = list(items[0])
+    keys = items[0].keys()
+    if not columns or any(item.keys() != keys for item in items):
+        return items
+    counter[0] += 1
+    return {"columns": columns, "rows": [[item[column] for column in columns] for item in items]}
+
+
+def line_breaks(minified: bytes) -> int:
+    """
+    The line breaks `minified` JSON gains when indented: one per item and one per closing bracket
+    of a non-empty container. Brackets and commas inside strings count too, so this is an estimate.
+    """
+    opened = minified.count(b"{") + minified.count(b"[")
+    empty = minified.count(b"{}") + minified.count(b"[]")
+    return minified.count(b",") + 2 * (opened - empty)
+
+
+def encode_data(data: Dict, encoding: str, max_field_chars: int, provider: str = "*", model: str = "*") -> Tuple[str, PromptStats]:
+    """
+    Serializes `data` for the prompt. "pretty" is indented JSON, "minified" drops the whitespace,
+    "table" also writes uniform lists of objects as columns and rows, and "auto" picks the
+    smaller of "minified" and "table". Savings are estimated against "pretty", which is only
+    serialized when chosen: otherwise its tokens are the minified tokens plus one per line break,
+    as a line break and its indentation make about one token.
+    """
+    truncated = [0]
+    if max_field_chars:
+        data = truncate_strings(data, max_field_chars, truncated)
+
+    def tokens(text: bytes) -> int:
+        return token_estimator.estimate_chars(len(text), "json", provider, model)
+
+    if encoding == "pretty":
+        candidates = {"pretty": orjson.dumps(data, default=str, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)}
+    else:
+        minified = dumps(data)
+        candidates = {"minified": minified} if encoding in ("minified", "auto") else {}
+    tables = [0]
+    if encoding in ("table", "auto"):
+        tabulated = tabulate(data, tables)
+        if tables[0]:
+            candidates["table"] = TABLE_HINT.encode() + b"\n" + dumps(tabulated)
+        elif encoding == "table":
+            candidates["table"] = minified
+
+    chosen = encoding if encoding != "auto" else min(("minified", "table"), key=lambda name: len(candidates.get(name, minified)))
+    estimates = {name: tokens(text) for name, text in candidates.items()}
+    if "pretty" not in estimates:
+        estimates["pretty"] = tokens(minified) + line_breaks(minified)
+    stats = PromptStats.model_construct(
+        data_encoding=chosen,
+        data_tokens=estimates[chosen],
+        baseline_tokens=estimates["pretty"],
+        saved_tokens=estimates["pretty"] - estimates[chosen],
+        truncated_fields=truncated[0],
+        estimates=estimates,
+    )
+    return candidates[chosen].decode(), stats
+
 
 def construct_prompt(
     instruction: str,
     data: Optional[Union[Dict, str]],
     provider: str,
     response_format: str,
-    json_schema: Optional[Dict[str, Any]] = None
-) -> List[Dict[str, str]]:
+    json_schema: Optional[Dict[str, Any]] = None,
+    model: str = "*",
+    data_encoding: Optional[str] = None,
+    max_field_chars: Optional[int] = None,
+) -> Tuple[List[Dict[str, str]], Optional[PromptStats]]:
     """
-    Constructs a list of messages for the LLM based on the input.
+    Constructs a list of messages for the LLM based on the input, most stable first: the system
+    prompt (with the schema), the instruction, then the data. Returns the messages and, for
+    object data, the encoding stats.
     """
-    messages = []
-    
-    # System Prompt
-    system_content = "You are a helpful assistant. Follow the user's instructions carefully."
-    if response_format == 'json':
-        system_content += "\nYour response MUST be a valid JSON object."
-        if json_schema:
-            system_content += f"\nAdhere to the following JSON schema:\n{json.dumps(json_schema)}"
-            
-    messages.append({"role": "system", "content": system_content})
-
-    # User Prompt - Instruction
-    messages.append({"role": "user", "content": instruction})
+    messages = [
+        {"role": "system", "content": system_prompt(response_format, json_schema)},
+        {"role": "user", "content": instruction},
+    ]
 
-    # User Prompt - Data
+    stats = None
     if data:
         if isinstance(data, dict):
-            data_content = f"Here is the data to process:\n```json\n{json.dumps(data, indent=2)}\n```"
+            encoded, stats = encode_data(
+                data,
+                data_encoding or settings.PROMPT_DATA_ENCODING,
+                settings.PROMPT_MAX_FIELD_CHARS if max_field_chars is None else max_field_chars,
+                provider,
+                model,
+            )
+            data_content = f"Here is the data to process:\n```json\n{encoded}\n```"
         else:
             data_content = f"Here is the data to process:\n{data}"
         messages.append({"role": "user", "content": data_content})
-        
-    return messages
+
+    return messages, stats
@@ -1,22 +1,150 @@
+import asyncio
 import time
 import uuid
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-
-class TimingAndTraceMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
-        trace_id = request.headers.get("X-Trace-ID") or str(uuid.uuid4())
-        
-        start_time = time.time()
-        
-        # Add trace_id to request state so it can be accessed in endpoints
-        request.state.trace_id = trace_id
-
-        response = await call_next(request)
-        
-        process_time = (time.time() - start_time) * 1000  # in milliseconds
-        
-        response.headers["X-Trace-ID"] = trace_id
-        response.headers["X-Process-Time-Ms"] = str(process_time)
-        
-        return response
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from ..core.concurrency import admission
+from ..core.config import settings
+from ..core.diagnostics import profiler
+from ..core.errors import BaseGatewayException, PayloadTooLargeException, RateLimitException, gateway_error_response
+from ..core.security import is_admin
+
+PROFILE_HEADER = "X-Profile"
+
+
+class GatewayMiddleware:
+    """
+    Trace ids, timing headers, the request size limit and global admission in one pure-ASGI layer.
+
+    Nothing is buffered: headers are added to `http.response.start` as it passes, and the body
+    is counted as the app reads it, so chunked bodies are held to MAX_REQUEST_BYTES too. Once the
+    body is in (at once for requests without one, such as GETs), the client connection is watched
+    and the request is cancelled if it goes away before its response is complete, which frees its
+    admission slot and closes any upstream call.
+    A disconnect after the response (servers send one for every request) leaves background
+    tasks running.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        headers = Headers(scope=scope)
+        trace_id = headers.get("x-trace-id") or str(uuid.uuid4())
+        state = scope.setdefault("state", {})
+        state["trace_id"] = trace_id
+
+        profile = None
+        if settings.PROFILING_ENABLED and headers.get(PROFILE_HEADER, "").lower() in ("1", "true") and is_admin(Request(scope)):
+            profile = profiler.begin(trace_id)
+
+        response_started = False
+        response_complete = False
+        too_large = False
+
+        async def send_wrapper(message: Message):
+            nonlocal response_started, response_complete
+            if too_large:
+                return  # the app's answer to a cut-off body is replaced by the 413 below
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+            elif message["type"] == "http.response.start":
+                response_started = True
+                response_headers = MutableHeaders(scope=message)
+                response_headers["X-Trace-ID"] = trace_id
+                response_headers["X-Process-Time-Ms"] = str((time.perf_counter() - start_time) * 1000)
+                if profile is not None:
+                    response_headers["X-Profile-Id"] = trace_id
+            await send(message)
+
+        async def reject(e: BaseGatewayException):
+            await gateway_error_response(e, trace_id)(scope, receive, send_wrapper)
+
+        try:
+            content_length = headers.get("content-length")
+            if content_length and content_length.isdigit() and int(content_length) > settings.MAX_REQUEST_BYTES:
+                await reject(self.too_large())
+                return
+            try:
+                waited = await admission.global_limiter.acquire()
+            except RateLimitException as e:
+                await reject(e)
+                return
+            state["queue_wait_ms"] = int(waited * 1000)
+
+            try:
+                received = 0
+                body_done = asyncio.Event()
+                disconnected = asyncio.Event()
+                # An HTTP/1 request without a length or chunked encoding has no body, so the
+                # watcher can start at once; the app is handed the empty body itself.
+                bodyless = (
+                    scope.get("http_version", "1.1") in ("1.0", "1.1")
+                    and content_length is None and "transfer-encoding" not in headers
+                )
+                empty_body_pending = bodyless
+                if bodyless:
+                    body_done.set()
+
+                async def receive_wrapper() -> Message:
+                    nonlocal received, too_large, empty_body_pending
+                    if empty_body_pending:
+                        empty_body_pending = False
+                        return {"type": "http.request", "body": b"", "more_body": False}
+                    if body_done.is_set():
+                        # The watcher owns the connection now; report its disconnect.
+                        await disconnected.wait()
+                        return {"type": "http.disconnect"}
+                    message = await receive()
+                    if message["type"] == "http.request":
+                        received += len(message.get("body", b""))
+                        if received > settings.MAX_REQUEST_BYTES:
+                            too_large = True
+                            raise self.too_large()
+                        if not message.get("more_body", False):
+                            body_done.set()
+                    elif message["type"] == "http.disconnect":
+                        disconnected.set()
+                    return message
+
+                app_task = asyncio.create_task(self.app(scope, receive_wrapper, send_wrapper))
+
+                async def watch_disconnect():
+                    await body_done.wait()
+                    while (await receive())["type"] != "http.disconnect":
+                        pass  # including the server's empty body message for a bodyless request
+                    disconnected.set()
+                    if not response_complete:
+                        app_task.cancel()
+
+                watcher = asyncio.create_task(watch_disconnect())
+                try:
+                    await app_task
+                except PayloadTooLargeException:
+                    pass
+                except asyncio.CancelledError:
+                    if not disconnected.is_set():
+                        raise  # we are being cancelled ourselves
+                finally:
+                    watcher.cancel()
+                    if not app_task.done():
+                        app_task.cancel()
+            finally:
+                admission.global_limiter.release()
+
+            if too_large and not response_started:
+                too_large = False
+                await reject(self.too_large())
+        finally:
+            if profile is not None:
+                profiler.end(profile)
+
+    @staticmethod
+    def too_large() -> PayloadTooLargeException:
+        return PayloadTooLargeException(f"Request payload exceeds the limit of {settings.MAX_REQUEST_BYTES} bytes.")
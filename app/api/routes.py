@@ -1,14 +1,32 @@
 from fastapi import APIRouter, Request, HTTPException
-from ..api.schemas import AgentRunRequest, SuccessResponse, ErrorResponse
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel
+from ..api.schemas import AgentRunRequest, SuccessResponse, ErrorResponse, ErrorDetail, StreamDone, StreamProgress, BatchRunRequest, BatchRunResponse, BatchStreamEnd, Timing, UsageReport
 from ..agents.agent_service import AgentService
-from ..core.errors import ValidationException, ProviderException
+from ..agents.batch_service import BatchService
+from ..core.errors import BaseGatewayException, ValidationException, ProviderException
+from ..core.circuit_breaker import circuit_breakers
 from ..core.config import settings
-from ..providers.factory import get_provider
-from typing import Union, List
+from ..core.concurrency import admission
+from ..core.diagnostics import loop_monitor, profiler
+from ..core.metrics import metrics
+from ..providers.factory import provider_registry
+from ..billing.ledger import usage_ledger
+from ..billing.pricing import pricing_registry
+from ..core.security import require_admin, tenant_id
+from ..utils.json_tools import FastJSONRoute, ModelResponse, model_json
+from typing import Literal, Optional, Union, List
 import time
 import datetime
 
-router = APIRouter()
+router = APIRouter(route_class=FastJSONRoute)
+
+def _validate_input(request: AgentRunRequest):
+    if not request.input.messages and not request.input.instruction:
+        raise ValidationException("Either 'messages' or 'instruction' must be provided.")
+
+def _sse(event: str, payload: BaseModel) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + model_json(payload) + b"\n\n"
 
 @router.post("/v1/agent:run", response_model=Union[SuccessResponse, ErrorResponse])
 async def agent_run(request: AgentRunRequest, http_request: Request):
@@ -20,22 +38,148 @@ async def agent_run(request: AgentRunRequest, http_request: Request):
     started_at = datetime.datetime.utcnow().isoformat()
 
     try:
-        if not request.input.messages and not request.input.instruction:
-            raise ValidationException("Either 'messages' or 'instruction' must be provided.")
+        _validate_input(request)
 
-        response = await AgentService.run_agent(request)
+        response = await AgentService.run_agent(request, tenant_id(http_request, request.auth.key, request.provider))
         
         duration_ms = int((time.time() - start_time) * 1000)
         response.timing.started_at = started_at
         response.timing.ended_at = datetime.datetime.utcnow().isoformat()
         response.timing.duration_ms = duration_ms
+        response.timing.queue_wait_ms += getattr(http_request.state, "queue_wait_ms", 0)
 
-        return response
+        metrics.observe_request(
+            response.provider, response.model, "ok",
+            duration_ms=duration_ms + getattr(http_request.state, "queue_wait_ms", 0),
+            provider_duration_ms=response.timing.provider_duration_ms,
+            queue_wait_ms=response.timing.queue_wait_ms,
+        )
+        return ModelResponse(response)
 
-    except (ValidationException, ProviderException) as e:
+    except Exception as e:
+        if not isinstance(e, BaseGatewayException):
+            e = ProviderException(str(e))
+        metrics.observe_request(request.provider, request.model, e.code, duration_ms=(time.time() - start_time) * 1000)
         raise e
+
+
+@router.post("/v1/agent:stream")
+async def agent_stream(request: AgentRunRequest, http_request: Request):
+    """
+    Streams the completion as server-sent events: `delta` events, then a final `done` event
+    with usage, billing and timing (including time to first token), or an `error` event.
+    Chunked requests send a `progress` event as each chunk finishes, before the deltas.
+
+    The first event is awaited before the response starts, so a request that fails before it
+    (rate limits, an open breaker, a bad schema) gets its error status and Retry-After header.
+    """
+    trace_id = http_request.state.trace_id
+    request.trace_id = trace_id
+    _validate_input(request)
+    tenant = tenant_id(http_request, request.auth.key, request.provider)
+
+    start_time = time.time()
+    started_at = datetime.datetime.utcnow().isoformat()
+
+    def failed(e: Exception) -> BaseGatewayException:
+        if not isinstance(e, BaseGatewayException):
+            e = ProviderException(str(e))
+        metrics.observe_request(request.provider, request.model, e.code, duration_ms=(time.time() - start_time) * 1000)
+        return e
+
+    stream = AgentService.stream_agent(request, tenant)
+    try:
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        first = None
     except Exception as e:
-        raise ProviderException(str(e))
+        raise failed(e)
+
+    async def rest():
+        if first is not None:
+            yield first
+            async for event in stream:
+                yield event
+
+    async def events():
+        try:
+            async for event in rest():
+                if isinstance(event, StreamDone):
+                    event.timing.started_at = started_at
+                    event.timing.ended_at = datetime.datetime.utcnow().isoformat()
+                    event.timing.duration_ms = int((time.time() - start_time) * 1000)
+                    event.timing.queue_wait_ms += getattr(http_request.state, "queue_wait_ms", 0)
+                    metrics.observe_request(
+                        event.provider, event.model, "ok",
+                        duration_ms=event.timing.duration_ms + getattr(http_request.state, "queue_wait_ms", 0),
+                        provider_duration_ms=event.timing.provider_duration_ms,
+                        queue_wait_ms=event.timing.queue_wait_ms,
+                        time_to_first_token_ms=event.timing.time_to_first_token_ms,
+                    )
+                    yield _sse("done", event)
+                elif isinstance(event, StreamProgress):
+                    yield _sse("progress", event)
+                else:
+                    yield _sse("delta", event)
+        except Exception as e:
+            # Headers are already sent, so errors are reported in-band.
+            e = failed(e)
+            error = ErrorResponse(trace_id=trace_id, error=ErrorDetail(code=e.code, message=e.message, details=e.details))
+            yield _sse("error", error)
+        finally:
+            await stream.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/v1/agent:batch")
+async def agent_batch(request: BatchRunRequest, http_request: Request):
+    """
+    Runs many agent requests concurrently, capped per provider/model. Results come back in input order,
+    or as NDJSON lines in completion order when `stream` is true, followed by a summary line.
+    Item failures are reported per item and never fail the batch.
+    """
+    trace_id = http_request.state.trace_id
+    if len(request.items) > settings.BATCH_MAX_ITEMS:
+        raise ValidationException(f"A batch accepts at most {settings.BATCH_MAX_ITEMS} items.")
+
+    # Each item is admitted and charged to its own tenant: the header's, or the item's credential.
+    tenants = [tenant_id(http_request, item.auth.key, item.provider) for item in request.items]
+    start_time = time.time()
+    started_at = datetime.datetime.utcnow().isoformat()
+
+    def timing(results) -> Timing:
+        # provider_duration_ms is the total upstream time across items, which overlaps in wall-clock time.
+        return Timing(
+            started_at=started_at,
+            ended_at=datetime.datetime.utcnow().isoformat(),
+            duration_ms=int((time.time() - start_time) * 1000),
+            provider_duration_ms=sum(result.response.timing.provider_duration_ms for result in results if result.ok),
+        )
+
+    if request.stream:
+        async def lines():
+            results = []
+            async for result in BatchService.run_batch(request.items, trace_id, tenants):
+                results.append(result)
+                yield model_json(result) + b"\n"
+            end = BatchStreamEnd(trace_id=trace_id, summary=BatchService.summarize(results), timing=timing(results))
+            yield model_json(end) + b"\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    results = [result async for result in BatchService.run_batch(request.items, trace_id, tenants)]
+    results.sort(key=lambda result: result.index)
+    return ModelResponse(BatchRunResponse.model_construct(
+        trace_id=trace_id,
+        results=results,
+        summary=BatchService.summarize(results),
+        timing=timing(results),
+    ))
 
 
 @router.get("/health")
@@ -47,34 +191,87 @@ async def ready():
     """
     Readiness probe. Checks if critical configurations are loaded.
     """
-    if not settings.PRICING_JSON or settings.PRICING_DATA is None:
+    if pricing_registry.current().error:
         raise HTTPException(status_code=503, detail="Pricing configuration not loaded.")
     
-    # Optionally, add a check for Ollama connection if it's a hard dependency
-    # ...
-
-    return {"status": "ready"}
+    # Open circuit breakers are reported but don't fail readiness: every replica sees the same
+    # upstreams, so taking this one out of rotation wouldn't help.
+    return {"status": "ready", "circuit_breakers": circuit_breakers.not_closed()}
 
 @router.get("/v1/providers")
 async def list_providers():
     """
-    Dynamically lists available providers and their capabilities.
+    The enabled providers and their declared capabilities. Listing them doesn't import them.
     """
-    # This is a bit of a hack. A better way would be to register providers.
-    provider_names = ["openai", "gemini", "ollama"]
-    providers_info = []
-    for name in provider_names:
-        try:
-            provider = get_provider(name)
-            capabilities = []
-            if provider.supports_json_mode:
-                capabilities.append("json_mode")
-            
-            # This is a simplification, we assume all support chat completions for now
-            capabilities.append("chat_completions")
-
-            providers_info.append({"name": name, "capabilities": capabilities})
-        except ValueError:
-            # Provider not implemented or misconfigured
-            pass
-    return {"providers": providers_info}
+    return {
+        "providers": [
+            {
+                "name": name,
+                "capabilities": provider_registry.spec(name).capabilities,
+                "loaded": name in provider_registry.loaded(),
+                "circuit_breakers": circuit_breakers.stats(name),
+            }
+            for name in provider_registry.names()
+        ]
+    }
+
+@router.get("/v1/limits")
+async def list_limits():
+    """
+    Current admission limits: the global limiter and each provider/model limiter, including adaptive state.
+    """
+    return admission.stats()
+
+@router.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """
+    Prometheus exposition of latency histograms, admission gauges and token, cost and cache counters.
+    """
+    content, media_type = metrics.render()
+    return Response(content=content, media_type=media_type)
+
+@router.get("/v1/profiles/{trace_id}")
+async def get_profile(trace_id: str, http_request: Request):
+    """
+    A request profile recorded with `X-Profile: true`, as folded stacks with sample counts.
+    """
+    require_admin(http_request)
+    profile = profiler.get(trace_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="No profile recorded for this trace id.")
+    return {"ok": True, "profile": profile, "loop": loop_monitor.stats()}
+
+@router.get("/v1/backends")
+async def list_backends():
+    """
+    Ollama backends with their availability, outstanding requests and loaded models, when Ollama is enabled.
+    """
+    if "ollama" not in provider_registry.names():
+        return {}
+    from ..providers.ollama_pool import ollama_pool
+    return {"ollama": ollama_pool.stats()}
+
+@router.get("/v1/usage", response_model=UsageReport)
+async def usage_report(
+    http_request: Request,
+    tenant: Optional[str] = None,
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    granularity: Literal["hour", "day", "total"] = "hour",
+):
+    """
+    Usage and cost rolled up by tenant, provider and model, per hour, per day (UTC) or in total.
+    Requires the gateway API key.
+    """
+    require_admin(http_request)
+    rows = await usage_ledger.query(
+        tenant=tenant,
+        provider=provider,
+        model=model,
+        start=int(start.timestamp()) if start else None,
+        end=int(end.timestamp()) if end else None,
+        granularity=granularity,
+    )
+    return UsageReport(granularity=granularity, rows=rows)
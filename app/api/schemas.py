@@ -1,5 +1,6 @@
-from pydantic import BaseModel, Field, conlist
-from typing import Literal, Union, Optional, List, Dict, Any
+from pydantic import AfterValidator, BaseModel, Field, conlist
+from typing import Annotated, Literal, Union, Optional, List, Dict, Any
+from ..providers.factory import provider_registry
 
 # Generic Models
 class Auth(BaseModel):
@@ -14,9 +15,33 @@ class Input(BaseModel):
     instruction: Optional[str] = None
     data: Optional[Union[Dict, str]] = None
     messages: Optional[conlist(Message, min_length=1)] = None
+    # How object `data` is written into the prompt; defaults to PROMPT_DATA_ENCODING
+    data_encoding: Optional[Literal["auto", "pretty", "minified", "table"]] = None
+    max_field_chars: Optional[int] = Field(None, ge=0)  # cut longer string fields; 0 disables, defaults to PROMPT_MAX_FIELD_CHARS
+
+def enabled_provider(name: str) -> str:
+    return provider_registry.spec(name).name
+
+# Any enabled provider, built in or registered through an entry point; normalized to lower case.
+ProviderName = Annotated[str, AfterValidator(enabled_provider)]
+
+class FallbackTarget(BaseModel):
+    provider: ProviderName
+    model: str
+    auth: Optional[Auth] = None  # defaults to the request's auth
+
+class Chunking(BaseModel):
+    """
+    Map-reduce over `input.data` too large for the model's context window: the data is split on
+    its structure, each chunk is run as its own request, and the results are combined.
+    """
+    reduce: Literal["concat", "merge_arrays", "summarize"] = "concat"
+    reduce_instruction: Optional[str] = None  # for "summarize"; defaults to combining the partial results
+    max_chunk_tokens: Optional[int] = Field(None, ge=64)  # data tokens per chunk; defaults to what fits the context window
+    allow_partial: bool = False  # combine the chunks that succeeded instead of failing the request
 
 class AgentRunRequest(BaseModel):
-    provider: Literal["openai", "gemini", "ollama"]
+    provider: ProviderName
     model: str
     auth: Auth
     input: Input
@@ -32,6 +57,12 @@ class AgentRunRequest(BaseModel):
     trace_id: Optional[str] = None
     timeout_seconds: Optional[int] = None
     safe_mode: bool = True
+    cache: bool = True  # set to false to bypass the response cache for this request
+    coalesce: bool = True  # set to false to opt out of sharing identical in-flight calls
+    max_retries: Optional[int] = Field(None, ge=0, le=5)  # defaults to RETRY_MAX_RETRIES
+    hedge: Optional[bool] = None  # defaults to HEDGE_ENABLED
+    fallbacks: Optional[List[FallbackTarget]] = None  # tried in order when the primary target fails
+    chunking: Optional[Chunking] = None  # split data that doesn't fit the context window
 
 class Result(BaseModel):
     type: Literal["text", "json"]
@@ -43,11 +74,14 @@ class Usage(BaseModel):
     output_tokens: int
     total_tokens: int
     is_estimated: bool = False
+    cached: bool = False
+    cached_input_tokens: int = 0  # input tokens the provider served from its prompt cache
 
 class Billing(BaseModel):
     currency: str = "USD"
     estimated_cost: Optional[float] = None
     pricing_source: Literal["config", "unknown"]
+    pricing_version: Optional[str] = None
     note: Optional[str] = None
 
 class Timing(BaseModel):
@@ -55,6 +89,33 @@ class Timing(BaseModel):
     ended_at: str
     duration_ms: int
     provider_duration_ms: int
+    time_to_first_token_ms: Optional[int] = None
+    queue_wait_ms: int = 0
+
+class PromptStats(BaseModel):
+    """
+    How `input.data` was encoded, with token estimates against indented JSON.
+    """
+    data_encoding: str
+    data_tokens: int
+    baseline_tokens: int  # the same data as indented JSON
+    saved_tokens: int
+    truncated_fields: int = 0
+    estimates: Dict[str, int] = {}  # data tokens for each encoding considered
+
+class ErrorDetail(BaseModel):
+    code: str
+    message: str
+    details: Optional[Dict[str, Any]] = None
+
+class ChunkResult(BaseModel):
+    index: int
+    stage: Literal["map", "reduce"] = "map"
+    ok: bool
+    usage: Optional[Usage] = None
+    billing: Optional[Billing] = None
+    provider_duration_ms: int = 0
+    error: Optional[ErrorDetail] = None
 
 class Warning(BaseModel):
     code: str
@@ -74,13 +135,84 @@ class SuccessResponse(BaseModel):
     timing: Timing
     warnings: List[Warning] = []
     echo: Optional[Echo] = None
+    prompt: Optional[PromptStats] = None
+    chunks: Optional[List[ChunkResult]] = None  # per-chunk usage and billing of a chunked request
 
-class ErrorDetail(BaseModel):
-    code: str
-    message: str
-    details: Optional[Dict[str, Any]] = None
+# Streaming (server-sent events) payloads
+class StreamDelta(BaseModel):
+    trace_id: str
+    delta: str
+
+class StreamProgress(BaseModel):
+    trace_id: str
+    completed: int
+    total: int
+    chunk: ChunkResult
+
+class StreamDone(BaseModel):
+    ok: bool = True
+    trace_id: str
+    provider: str
+    model: str
+    usage: Usage
+    billing: Billing
+    timing: Timing
+    warnings: List[Warning] = []
+    echo: Optional[Echo] = None
+    prompt: Optional[PromptStats] = None
+    chunks: Optional[List[ChunkResult]] = None
 
 class ErrorResponse(BaseModel):
     ok: bool = False
     trace_id: str
     error: ErrorDetail
+
+# Batch
+class BatchRunRequest(BaseModel):
+    items: List[AgentRunRequest] = Field(..., min_length=1)
+    stream: bool = False  # stream results as NDJSON in completion order
+
+class BatchItemResult(BaseModel):
+    index: int
+    ok: bool
+    response: Optional[SuccessResponse] = None
+    error: Optional[ErrorDetail] = None
+
+class BatchSummary(BaseModel):
+    total: int
+    succeeded: int
+    failed: int
+    usage: Usage
+    billing: Billing
+
+class BatchRunResponse(BaseModel):
+    ok: bool = True
+    trace_id: str
+    results: List[BatchItemResult]
+    summary: BatchSummary
+    timing: Timing
+
+class BatchStreamEnd(BaseModel):
+    ok: bool = True
+    trace_id: str
+    summary: BatchSummary
+    timing: Timing
+
+# Usage ledger
+class UsageRow(BaseModel):
+    tenant: str
+    provider: str
+    model: str
+    period_start: Optional[int] = None  # unix seconds; null for granularity "total"
+    requests: int
+    upstream_requests: int  # excludes cache hits and coalesced requests
+    estimated_requests: int
+    input_tokens: int
+    output_tokens: int
+    cached_input_tokens: int
+    cost: float
+
+class UsageReport(BaseModel):
+    ok: bool = True
+    granularity: Literal["hour", "day", "total"]
+    rows: List[UsageRow]
@@ -0,0 +1,208 @@
+import asyncio
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from .models import UsageEvent
+from ..core.config import settings
+
+# requests, upstream_requests, estimated_requests, input_tokens, output_tokens, cached_input_tokens, cost
+ROLLUP_FIELDS = 7
+RollupKey = Tuple[str, str, str, int]
+
+
+def _fold(rollups: Dict[RollupKey, list], event: UsageEvent):
+    totals = rollups.get(event.rollup_key)
+    if totals is None:
+        totals = rollups[event.rollup_key] = [0] * ROLLUP_FIELDS
+    totals[0] += 1
+    totals[1] += event.upstream
+    totals[2] += event.is_estimated
+    totals[3] += event.input_tokens
+    totals[4] += event.output_tokens
+    totals[5] += event.cached_input_tokens
+    totals[6] += event.cost or 0
+
+
+class UsageLedger:
+    """
+    Append-only record of usage and cost per request, with hourly rollups by tenant/provider/model.
+
+    `record` only appends to an in-memory buffer; a background task flushes the buffer in batches
+    to SQLite (WAL) from a worker thread. The buffer holds at most LEDGER_MAX_PENDING events. Past
+    that, events skip the raw log but are still folded into the rollups, so totals stay right while
+    memory stays bounded by the number of distinct tenant/provider/model/hour keys.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_pending: Optional[int] = None,
+                 batch_size: Optional[int] = None, flush_interval_seconds: Optional[float] = None):
+        self.path = path or settings.LEDGER_SQLITE_PATH or ":memory:"
+        self.max_pending = max_pending or settings.LEDGER_MAX_PENDING
+        self.batch_size = batch_size or settings.LEDGER_BATCH_SIZE
+        self.flush_interval_seconds = flush_interval_seconds or settings.LEDGER_FLUSH_INTERVAL_MS / 1000
+        self._pending: List[UsageEvent] = []
+        self._overflow: Dict[RollupKey, list] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self.recorded = 0
+        self.overflowed = 0
+        self.write_errors = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS usage_events (
+                    ts REAL NOT NULL, tenant TEXT NOT NULL, provider TEXT NOT NULL, model TEXT NOT NULL,
+                    trace_id TEXT, input_tokens INTEGER NOT NULL, output_tokens INTEGER NOT NULL,
+                    cached_input_tokens INTEGER NOT NULL, cost REAL, is_estimated INTEGER NOT NULL,
+                    upstream INTEGER NOT NULL, pricing_version TEXT
+                );
+                CREATE TABLE IF NOT EXISTS usage_hourly (
+                    tenant TEXT NOT NULL, provider TEXT NOT NULL, model TEXT NOT NULL, hour INTEGER NOT NULL,
+                    requests INTEGER NOT NULL, upstream_requests INTEGER NOT NULL, estimated_requests INTEGER NOT NULL,
+                    input_tokens INTEGER NOT NULL, output_tokens INTEGER NOT NULL,
+                    cached_input_tokens INTEGER NOT NULL, cost REAL NOT NULL,
+                    PRIMARY KEY (tenant, provider, model, hour)
+                );
+                CREATE INDEX IF NOT EXISTS usage_hourly_hour ON usage_hourly (hour);
+            """)
+        return self._conn
+
+    def record(self, event: UsageEvent):
+        """
+        Never blocks and never raises into the request path.
+        """
+        self.recorded += 1
+        if len(self._pending) < self.max_pending:
+            self._pending.append(event)
+            if len(self._pending) >= self.batch_size and self._wakeup is not None:
+                self._wakeup.set()
+        else:
+            self.overflowed += 1
+            _fold(self._overflow, event)
+
+    def _write(self, events: List[UsageEvent], rollups: Dict[RollupKey, list]):
+        for event in events:
+            _fold(rollups, event)
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO usage_events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (e.ts, e.tenant, e.provider, e.model, e.trace_id, e.input_tokens, e.output_tokens,
+                     e.cached_input_tokens, e.cost, e.is_estimated, e.upstream, e.pricing_version)
+                    for e in events
+                ],
+            )
+            self.conn.executemany(
+                """
+                INSERT INTO usage_hourly VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (tenant, provider, model, hour) DO UPDATE SET
+                    requests = requests + excluded.requests,
+                    upstream_requests = upstream_requests + excluded.upstream_requests,
+                    estimated_requests = estimated_requests + excluded.estimated_requests,
+                    input_tokens = input_tokens + excluded.input_tokens,
+                    output_tokens = output_tokens + excluded.output_tokens,
+                    cached_input_tokens = cached_input_tokens + excluded.cached_input_tokens,
+                    cost = cost + excluded.cost
+                """,
+                [(*key, *totals) for key, totals in rollups.items()],
+            )
+
+    async def flush(self):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            events, self._pending = self._pending, []
+            rollups, self._overflow = self._overflow, {}
+            if not events and not rollups:
+                return
+            try:
+                await asyncio.to_thread(self._write, events, rollups)
+            except sqlite3.Error:
+                # _write folded the events into `rollups` before touching the database. Keep those
+                # totals for the next flush; the raw events of this batch are lost.
+                self.write_errors += 1
+                for key, totals in rollups.items():
+                    merged = self._overflow.setdefault(key, [0] * ROLLUP_FIELDS)
+                    for i, value in enumerate(totals):
+                        merged[i] += value
+
+    async def _write_forever(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def start(self):
+        if self._writer_task is None:
+            self._wakeup = asyncio.Event()
+            self._writer_task = asyncio.create_task(self._write_forever())
+
+    async def aclose(self):
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            self._writer_task = None
+            self._wakeup = None
+        await self.flush()
+        self._flush_lock = None
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _query(self, tenant: Optional[str], provider: Optional[str], model: Optional[str],
+               start: Optional[int], end: Optional[int], granularity: str) -> List[dict]:
+        bucket = {"hour": "hour", "day": "hour - hour % 86400", "total": "NULL"}[granularity]
+        filters, params = [], []
+        for column, value in (("tenant", tenant), ("provider", provider), ("model", model)):
+            if value is not None:
+                filters.append(f"{column} = ?")
+                params.append(value)
+        if start is not None:
+            filters.append("hour >= ?")
+            params.append(start // 3600 * 3600)
+        if end is not None:
+            filters.append("hour < ?")
+            params.append(end)
+        where = f"WHERE {' AND '.join(filters)}" if filters else ""
+        sql = f"""
+            SELECT tenant, provider, model, {bucket} AS period, SUM(requests), SUM(upstream_requests),
+                   SUM(estimated_requests), SUM(input_tokens), SUM(output_tokens), SUM(cached_input_tokens), SUM(cost)
+            FROM usage_hourly {where}
+            GROUP BY tenant, provider, model, period
+            ORDER BY period, tenant, provider, model
+        """
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        columns = ("tenant", "provider", "model", "period_start", "requests", "upstream_requests",
+                   "estimated_requests", "input_tokens", "output_tokens", "cached_input_tokens", "cost")
+        return [dict(zip(columns, row)) for row in rows]
+
+    async def query(self, tenant: Optional[str] = None, provider: Optional[str] = None, model: Optional[str] = None,
+                    start: Optional[int] = None, end: Optional[int] = None, granularity: str = "hour") -> List[dict]:
+        """
+        Rolled-up usage, bucketed by hour, day or in total. Pending events are flushed first.
+        """
+        await self.flush()
+        return await asyncio.to_thread(self._query, tenant, provider, model, start, end, granularity)
+
+    def stats(self) -> dict:
+        return {
+            "recorded": self.recorded,
+            "pending": len(self._pending),
+            "overflowed": self.overflowed,
+            "write_errors": self.write_errors,
+        }
+
+
+usage_ledger = UsageLedger()
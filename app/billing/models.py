@@ -0,0 +1,118 @@
+import re
+from decimal import Decimal
+from typing import Dict, Optional, Tuple
+from pydantic import BaseModel, ConfigDict
+
+PER_1K = Decimal(1000)
+
+# Dated snapshots, e.g. "gpt-4o-2024-08-06", "claude-3-5-sonnet-20241022" or "gemini-1.5-pro-002".
+SNAPSHOT_SUFFIX = re.compile(r"-(\d{4}-\d{2}-\d{2}|\d{8}|\d{3,4})$")
+
+
+def per_token(value) -> Optional[Decimal]:
+    # str() first so 0.15 becomes Decimal("0.15"), not its binary approximation.
+    return None if value is None else Decimal(str(value)) / PER_1K
+
+
+class PriceRates(BaseModel):
+    """
+    Per-token rates. Cached input falls back to the regular input rate.
+    """
+    model_config = ConfigDict(frozen=True)
+
+    input: Decimal
+    output: Decimal
+    cached_input: Optional[Decimal] = None
+
+    @classmethod
+    def from_config(cls, entry: dict, default: Optional["PriceRates"] = None) -> "PriceRates":
+        input_rate = per_token(entry.get("input_per_1k"))
+        output_rate = per_token(entry.get("output_per_1k"))
+        cached_rate = per_token(entry.get("cached_input_per_1k"))
+        return cls(
+            input=input_rate if input_rate is not None else (default.input if default else Decimal(0)),
+            output=output_rate if output_rate is not None else (default.output if default else Decimal(0)),
+            cached_input=cached_rate if cached_rate is not None else (default.cached_input if default else None),
+        )
+
+
+class ModelPrice(BaseModel):
+    """
+    A model's base rates plus long-context tiers, as (input token threshold, rates) sorted by threshold.
+    A request whose input exceeds a threshold is billed entirely at that tier's rates.
+    """
+    model_config = ConfigDict(frozen=True)
+
+    base: PriceRates
+    tiers: Tuple[Tuple[int, PriceRates], ...] = ()
+
+    def rates_for(self, input_tokens: int) -> PriceRates:
+        rates = self.base
+        for threshold, tier in self.tiers:
+            if input_tokens > threshold:
+                rates = tier
+        return rates
+
+    def cost(self, input_tokens: int, output_tokens: int, cached_input_tokens: int = 0) -> Decimal:
+        rates = self.rates_for(input_tokens)
+        cached = min(cached_input_tokens, input_tokens)
+        cached_rate = rates.cached_input if rates.cached_input is not None else rates.input
+        return (input_tokens - cached) * rates.input + cached * cached_rate + output_tokens * rates.output
+
+
+class ProviderPrices(BaseModel):
+    """
+    Exact model names and aliases, plus prefixes (longest first) for dated snapshots and families.
+    """
+    model_config = ConfigDict(frozen=True)
+
+    exact: Dict[str, ModelPrice]
+    prefixes: Tuple[Tuple[str, ModelPrice], ...] = ()
+
+    def match(self, model: str) -> Optional[Tuple[str, ModelPrice]]:
+        """
+        The configured name a model is priced under ("o1*" for a prefix), and its price.
+        """
+        price = self.exact.get(model)
+        if price is not None:
+            return model, price
+        base_model = SNAPSHOT_SUFFIX.sub("", model)
+        if base_model != model and base_model in self.exact:
+            return base_model, self.exact[base_model]
+        for prefix, price in self.prefixes:
+            if model.startswith(prefix):
+                return f"{prefix}*", price
+        return None
+
+    def lookup(self, model: str) -> Optional[ModelPrice]:
+        match = self.match(model)
+        return match[1] if match is not None else None
+
+
+class UsageEvent:
+    """
+    One request's usage as recorded in the ledger. A plain slotted class: one is built per request.
+    `upstream` is False for cache hits and coalesced followers, which cost no upstream call.
+    """
+    __slots__ = ("ts", "tenant", "provider", "model", "trace_id", "input_tokens", "output_tokens",
+                 "cached_input_tokens", "cost", "is_estimated", "upstream", "pricing_version")
+
+    def __init__(self, ts: float, tenant: str, provider: str, model: str, trace_id: Optional[str],
+                 input_tokens: int, output_tokens: int, cached_input_tokens: int, cost: Optional[float],
+                 is_estimated: bool, upstream: bool, pricing_version: Optional[str]):
+        self.ts = ts
+        self.tenant = tenant
+        self.provider = provider
+        self.model = model
+        self.trace_id = trace_id
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.cached_input_tokens = cached_input_tokens
+        self.cost = cost
+        self.is_estimated = is_estimated
+        self.upstream = upstream
+        self.pricing_version = pricing_version
+
+    @property
+    def rollup_key(self) -> Tuple[str, str, str, int]:
+        return (self.tenant, self.provider, self.model, int(self.ts // 3600) * 3600)
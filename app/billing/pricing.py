@@ -1,27 +1,196 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+from .models import ModelPrice, PriceRates, ProviderPrices
 from ..core.config import settings
 from ..api.schemas import Usage, Billing
 
+
+class PricingTable:
+    """
+    An immutable, compiled pricing table. Built once per pricing source and swapped atomically on reload.
+
+    The source maps providers to models, e.g.::
+
+        {"version": "2024-10",
+         "openai": {"gpt-4o-mini": {"input_per_1k": 0.15, "output_per_1k": 0.60, "cached_input_per_1k": 0.075,
+                                    "aliases": ["gpt-4o-mini-latest"]},
+                    "o1*": {"input_per_1k": 15, "output_per_1k": 60}},
+         "gemini": {"gemini-1.5-pro": {"input_per_1k": 1.25, "output_per_1k": 5.0,
+                                       "tiers": [{"above_input_tokens": 128000, "input_per_1k": 2.5, "output_per_1k": 10}]}}}
+
+    Model names ending in "*" are prefixes; dated snapshots of a listed model resolve to it.
+    """
+
+    def __init__(self, providers: Dict[str, ProviderPrices], version: str, error: Optional[str] = None):
+        self.providers = providers
+        self.version = version
+        self.error = error
+
+    @classmethod
+    def compile(cls, source: str) -> "PricingTable":
+        data = json.loads(source or "{}")
+        if not isinstance(data, dict):
+            raise ValueError("Pricing must be a JSON object of providers.")
+        version = data.get("version") or hashlib.sha256(source.encode()).hexdigest()[:12]
+
+        providers = {}
+        for provider, models in data.items():
+            if not isinstance(models, dict):
+                continue
+            exact: Dict[str, ModelPrice] = {}
+            prefixes = []
+            for name, entry in models.items():
+                base = PriceRates.from_config(entry)
+                tiers = sorted(
+                    (int(tier["above_input_tokens"]), PriceRates.from_config(tier, default=base))
+                    for tier in entry.get("tiers", [])
+                )
+                price = ModelPrice(base=base, tiers=tuple(tiers))
+                if name.endswith("*"):
+                    prefixes.append((name[:-1], price))
+                else:
+                    exact[name] = price
+                for alias in entry.get("aliases", []):
+                    exact[alias] = price
+            prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+            providers[provider] = ProviderPrices(exact=exact, prefixes=tuple(prefixes))
+        return cls(providers, str(version))
+
+    def lookup(self, provider: str, model: str) -> Optional[ModelPrice]:
+        prices = self.providers.get(provider)
+        return prices.lookup(model) if prices is not None else None
+
+    def priced_name(self, provider: str, model: str) -> Optional[str]:
+        prices = self.providers.get(provider)
+        match = prices.match(model) if prices is not None else None
+        return match[0] if match is not None else None
+
+
+class PricingRegistry:
+    """
+    Holds the current PricingTable. The source is PRICING_FILE when set, else PRICING_JSON.
+
+    The file is polled by mtime every PRICING_RELOAD_INTERVAL_SECONDS and read in a worker
+    thread, never on the request path once the gateway has started; a file that fails to compile
+    keeps the previous table in place.
+    """
+
+    def __init__(self):
+        self._table: Optional[PricingTable] = None
+        self._source_key = None
+        self._reload_task: Optional[asyncio.Task] = None
+
+    def _source(self):
+        """
+        Returns (key, loader): the key changes whenever the source does, without reading the file.
+        """
+        path = settings.PRICING_FILE
+        if path:
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                mtime = None
+            return ("file", path, mtime), lambda: open(path, encoding="utf-8").read()
+        source = settings.PRICING_JSON
+        return ("json", source), lambda: source
+
+    def reload(self) -> PricingTable:
+        key, load = self._source()
+        if key == self._source_key and self._table is not None:
+            return self._table
+        try:
+            table = PricingTable.compile(load())
+        except (OSError, ValueError, TypeError, KeyError, AttributeError, ArithmeticError) as e:
+            # Keep serving the last good table; only report the error if there is none.
+            table = self._table or PricingTable({}, "none", error=str(e))
+        self._table, self._source_key = table, key
+        return table
+
+    def current(self) -> PricingTable:
+        """
+        The loaded table. Only a changed source setting (or a first use before `start`) loads one
+        here; changes to the file's contents are picked up by the background reload.
+        """
+        table, key = self._table, self._source_key
+        source = ("file", settings.PRICING_FILE) if settings.PRICING_FILE else ("json", settings.PRICING_JSON)
+        if table is None or key[:2] != source:
+            return self.reload()
+        return table
+
+    async def _reload_forever(self):
+        while True:
+            await asyncio.sleep(settings.PRICING_RELOAD_INTERVAL_SECONDS)
+            await asyncio.to_thread(self.reload)
+
+    async def start(self):
+        await asyncio.to_thread(self.reload)
+        if settings.PRICING_FILE and self._reload_task is None and settings.PRICING_RELOAD_INTERVAL_SECONDS > 0:
+            self._reload_task = asyncio.create_task(self._reload_forever())
+
+    async def aclose(self):
+        if self._reload_task is not None:
+            self._reload_task.cancel()
+            self._reload_task = None
+
+
+pricing_registry = PricingRegistry()
+
+
 class PricingService:
     def __init__(self):
-        self.pricing_data = settings.PRICING_DATA
+        self.table = pricing_registry.current()
 
     def calculate_cost(self, provider: str, model: str, usage: Usage) -> Billing:
-        if not self.pricing_data:
-            return Billing(pricing_source="unknown", note="Pricing data not configured.")
+        if not self.table.providers:
+            return Billing.model_construct(pricing_source="unknown", note="Pricing data not configured.", pricing_version=self.table.version)
 
-        provider_prices = self.pricing_data.get(provider, {})
-        model_prices = provider_prices.get(model)
+        model_prices = self.table.lookup(provider, model)
 
         if not model_prices:
-            return Billing(pricing_source="unknown", note=f"Pricing for model '{model}' not configured.")
+            return Billing.model_construct(
+                pricing_source="unknown",
+                note=f"Pricing for model '{model}' not configured.",
+                pricing_version=self.table.version
+            )
 
-        input_cost = (usage.input_tokens / 1000) * model_prices.get("input_per_1k", 0)
-        output_cost = (usage.output_tokens / 1000) * model_prices.get("output_per_1k", 0)
-        
-        estimated_cost = input_cost + output_cost
+        estimated_cost = model_prices.cost(usage.input_tokens, usage.output_tokens, usage.cached_input_tokens)
 
-        return Billing(
+        return Billing.model_construct(
             currency="USD",
-            estimated_cost=estimated_cost,
-            pricing_source="config"
+            estimated_cost=float(estimated_cost),
+            pricing_source="config",
+            pricing_version=self.table.version
         )
+
+
+def total_usage(usages: List[Usage]) -> Usage:
+    input_tokens = sum(usage.input_tokens for usage in usages)
+    output_tokens = sum(usage.output_tokens for usage in usages)
+    return Usage(
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        total_tokens=input_tokens + output_tokens,
+        is_estimated=any(usage.is_estimated for usage in usages),
+        cached_input_tokens=sum(usage.cached_input_tokens for usage in usages),
+    )
+
+
+def total_billing(billings: List[Billing], unit: str = "items") -> Billing:
+    """
+    Sums the cost of several calls. A pricing reload in between can price them with different
+    versions; then there is no single version.
+    """
+    priced = [billing.estimated_cost for billing in billings if billing.estimated_cost is not None]
+    versions = {billing.pricing_version for billing in billings}
+    billing = Billing(
+        estimated_cost=sum(priced) if priced else None,
+        pricing_source="config" if priced else "unknown",
+        pricing_version=versions.pop() if len(versions) == 1 else None,
+    )
+    if priced and len(priced) < len(billings):
+        billing.note = f"Pricing unknown for {len(billings) - len(priced)} of {len(billings)} {unit}; cost is partial."
+    return billing
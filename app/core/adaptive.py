@@ -0,0 +1,72 @@
+from typing import Optional
+
+
+class AdaptiveLimit:
+    """
+    AIMD concurrency limit with a latency gradient, in the spirit of Netflix's concurrency-limits.
+
+    - A drop (upstream 429, 5xx or timeout) multiplies the limit by `backoff_ratio`.
+    - A success while the short-term latency is more than `latency_tolerance` times the long-term
+      baseline is also treated as queueing upstream and backs off.
+    - Otherwise, while the limit is actually being used, it grows by about one per round trip.
+
+    Like TCP, it backs off at most once per window of `limit` samples, so a burst of failures from
+    requests that were already in flight counts as one congestion signal.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int,
+        min_limit: int = 1,
+        max_limit: int = 200,
+        backoff_ratio: float = 0.9,
+        latency_tolerance: float = 2.0,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.short_latency: Optional[float] = None
+        self.long_latency: Optional[float] = None
+        self.drops = 0
+        self._samples_since_backoff = float("inf")
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def _backoff(self):
+        if self._samples_since_backoff >= self._limit:
+            self._limit = max(self.min_limit, self._limit * self.backoff_ratio)
+            self._samples_since_backoff = 0
+
+    def on_drop(self) -> int:
+        self.drops += 1
+        self._samples_since_backoff += 1
+        self._backoff()
+        return self.limit
+
+    def on_success(self, latency_seconds: float, in_flight: int) -> int:
+        self._samples_since_backoff += 1
+        if self.long_latency is None:
+            self.short_latency = self.long_latency = latency_seconds
+        else:
+            self.short_latency += 0.2 * (latency_seconds - self.short_latency)
+            self.long_latency += 0.02 * (latency_seconds - self.long_latency)
+
+        if self.short_latency > self.latency_tolerance * self.long_latency:
+            self._backoff()
+        elif in_flight * 2 >= self._limit:
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+        return self.limit
+
+    def stats(self) -> dict:
+        return {
+            "adaptive_limit": self.limit,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "short_latency_ms": None if self.short_latency is None else int(self.short_latency * 1000),
+            "long_latency_ms": None if self.long_latency is None else int(self.long_latency * 1000),
+            "drops": self.drops,
+        }
@@ -0,0 +1,237 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, Optional, Union
+
+from .config import settings
+from .errors import CircuitOpenException, ProviderException, TimeoutException, UpstreamRateLimitException
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+def is_failure(e: Exception) -> bool:
+    """
+    Errors that say the upstream is unwell. Bad requests and invalid output don't count.
+    """
+    if isinstance(e, (UpstreamRateLimitException, TimeoutException)):
+        return True
+    # Connection failures carry no upstream status.
+    return isinstance(e, ProviderException) and e.details.get("upstream_status", 500) >= 500
+
+
+class CircuitBreaker:
+    """
+    Tracks one provider/model/backend over a rolling window of CIRCUIT_WINDOW_SECONDS, in
+    one-second buckets with running totals. Once the window holds CIRCUIT_MIN_CALLS calls, the
+    breaker opens if the share of failures (see `is_failure`) reaches
+    CIRCUIT_FAILURE_RATE, or the share of calls slower than CIRCUIT_SLOW_CALL_SECONDS reaches
+    CIRCUIT_SLOW_CALL_RATE.
+
+    An open breaker rejects calls at once for CIRCUIT_OPEN_SECONDS. It then turns half-open and
+    lets CIRCUIT_HALF_OPEN_PROBES calls through at a time. That many successes close it; any
+    failure opens it again.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._buckets: Deque[List[float]] = deque()  # [second, calls, failures, slow]
+        self._calls = 0
+        self._failures = 0
+        self._slow = 0
+        self._probes = 0
+        self._probe_successes = 0
+
+    def _expire(self, now: float):
+        horizon = int(now) - settings.CIRCUIT_WINDOW_SECONDS
+        while self._buckets and self._buckets[0][0] <= horizon:
+            _, calls, failures, slow = self._buckets.popleft()
+            self._calls -= calls
+            self._failures -= failures
+            self._slow -= slow
+
+    def _reset(self):
+        self._buckets.clear()
+        self._calls = self._failures = self._slow = 0
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + settings.CIRCUIT_OPEN_SECONDS - time.monotonic())
+
+    def acquire(self) -> bool:
+        """
+        Raises CircuitOpenException if the call may not go ahead. Returns whether it is a probe.
+        """
+        if self.state == OPEN:
+            if self.retry_after() > 0:
+                self._reject()
+            self.state = HALF_OPEN
+            self._probes = self._probe_successes = 0
+        if self.state == HALF_OPEN:
+            if self._probes >= settings.CIRCUIT_HALF_OPEN_PROBES:
+                self._reject()
+            self._probes += 1
+            return True
+        return False
+
+    def allows(self) -> bool:
+        """
+        Whether a call would be let through now, without taking a probe slot.
+        """
+        if self.state == OPEN:
+            return self.retry_after() <= 0
+        return self.state == CLOSED or self._probes < settings.CIRCUIT_HALF_OPEN_PROBES
+
+    def check(self):
+        """
+        Fails fast before queueing for an admission slot; `call` makes the real decision.
+        """
+        if not self.allows():
+            self._reject()
+
+    def _reject(self):
+        self.rejected += 1
+        raise CircuitOpenException(
+            f"{self.name} is failing; calls are suspended.",
+            retry_after=self.retry_after() or 1,
+            details={"circuit": self.name, "state": self.state},
+        )
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self._reset()
+
+    def record(self, failed: bool, seconds: float, probe: bool):
+        if probe:
+            self._probes -= 1
+            if self.state != HALF_OPEN:
+                return
+            if failed:
+                self._open()
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= settings.CIRCUIT_HALF_OPEN_PROBES:
+                self.state = CLOSED
+                self._reset()
+            return
+        if self.state != CLOSED:
+            return  # a call from before the breaker opened
+
+        now = time.monotonic()
+        self._expire(now)
+        second = int(now)
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0, 0])
+        bucket = self._buckets[-1]
+        slow = seconds >= settings.CIRCUIT_SLOW_CALL_SECONDS
+        bucket[1] += 1
+        bucket[2] += failed
+        bucket[3] += slow
+        self._calls += 1
+        self._failures += failed
+        self._slow += slow
+        if self._calls >= settings.CIRCUIT_MIN_CALLS and (
+            self._failures >= self._calls * settings.CIRCUIT_FAILURE_RATE
+            or self._slow >= self._calls * settings.CIRCUIT_SLOW_CALL_RATE
+        ):
+            self._open()
+
+    def release(self, probe: bool):
+        # A call that was cancelled (e.g. the losing side of a hedge) says nothing about health.
+        if probe:
+            self._probes -= 1
+
+    @contextmanager
+    def call(self, timed: bool = True) -> Iterator[None]:
+        """
+        Guards one upstream call and records its outcome. Streams pass `timed=False`: their
+        duration follows the output length, not the upstream's health.
+        """
+        probe = self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.record(is_failure(e), time.monotonic() - start if timed else 0.0, probe)
+            raise
+        except BaseException:
+            self.release(probe)
+            raise
+        else:
+            self.record(False, time.monotonic() - start if timed else 0.0, probe)
+
+    def stats(self) -> dict:
+        if self.state == CLOSED:
+            self._expire(time.monotonic())
+        stats = {
+            "state": self.state,
+            "calls": self._calls,
+            "failures": self._failures,
+            "slow_calls": self._slow,
+            "rejected": self.rejected,
+        }
+        if self.state == OPEN:
+            stats["retry_after_seconds"] = round(self.retry_after(), 3)
+        return stats
+
+
+class NoBreaker:
+    """
+    Stands in when breakers are disabled, or when the provider guards its backends itself.
+    """
+
+    def allows(self) -> bool:
+        return True
+
+    def check(self):
+        pass
+
+    @contextmanager
+    def call(self, timed: bool = True) -> Iterator[None]:
+        yield
+
+
+NO_BREAKER = NoBreaker()
+
+
+class CircuitBreakers:
+    """
+    One breaker per provider, model and backend, created on first use. Breakers are kept per
+    worker: each worker trips on the failures it sees itself. Past MAX_TRACKED_MODELS, the least
+    recently used closed breakers are dropped; open and half-open ones are kept.
+    """
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}  # least recently used first
+
+    def get(self, provider: str, model: str, backend: Optional[str] = "default") -> Union[CircuitBreaker, NoBreaker]:
+        """
+        `backend` is None for providers that route between backends and guard each one themselves.
+        """
+        if backend is None or not settings.CIRCUIT_BREAKER_ENABLED:
+            return NO_BREAKER
+        key = f"{provider}:{model}@{backend}"
+        breaker = self._breakers.pop(key, None)
+        if breaker is None:
+            for old_key, old in list(self._breakers.items()):
+                if len(self._breakers) < settings.MAX_TRACKED_MODELS:
+                    break
+                if old.state == CLOSED:
+                    del self._breakers[old_key]
+            breaker = CircuitBreaker(key)
+        self._breakers[key] = breaker
+        return breaker
+
+    def stats(self, provider: Optional[str] = None) -> Dict[str, dict]:
+        return {
+            key: breaker.stats() for key, breaker in self._breakers.items()
+            if provider is None or key.startswith(f"{provider}:")
+        }
+
+    def not_closed(self) -> Dict[str, dict]:
+        return {key: stats for key, stats in self.stats().items() if stats["state"] != CLOSED}
+
+
+circuit_breakers = CircuitBreakers()
@@ -1,45 +1,260 @@
 import asyncio
-from fastapi import Request, HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-from starlette.responses import JSONResponse
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional
 from ..core.config import settings
+from ..core.adaptive import AdaptiveLimit
+from ..core.shared_state import SharedState, shared_state
+from ..core.errors import ProviderException, RateLimitException, TimeoutException, UpstreamRateLimitException
 
-# Concurrency Limiter
-semaphore = asyncio.Semaphore(settings.MAX_CONCURRENCY)
-
-class ConcurrencyLimiterMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
-        if not await semaphore.acquire():
-            return JSONResponse(
-                status_code=429,
-                content={
-                    "ok": False,
-                    "trace_id": getattr(request.state, "trace_id", "N/A"),
-                    "error": {
-                        "code": "RATE_LIMIT",
-                        "message": "Too many concurrent requests.",
-                    },
-                },
-            )
+# Admission control
+class Limiter:
+    """
+    Concurrency limit with a bounded FIFO wait queue. Callers that can't be queued, or that wait longer
+    than `max_wait_seconds`, are rejected with RateLimitException instead of piling up.
+
+    With `shared` state the limit counts the slots held by every worker process. Queued callers
+    are woken at once by releases in this process, and by polling for those in other workers.
+    """
+    def __init__(self, name: str, limit: int, max_queue: int, max_wait_seconds: float,
+                 shared: Optional[SharedState] = None):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.shared = shared
+        self.in_flight = 0
+        self.rejected = 0
+        self.avg_hold_seconds = 0.0
+        self.adaptive: Optional[AdaptiveLimit] = None
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._poller: Optional[asyncio.Task] = None
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def has_capacity(self) -> bool:
+        return self.in_flight < self.limit and not self._waiters
+
+    def _take(self) -> bool:
+        if self.in_flight >= self.limit:
+            return False
+        if self.shared is not None and not self.shared.acquire(f"slots:{self.name}", self.limit):
+            return False
+        self.in_flight += 1
+        return True
+
+    def retry_after(self) -> float:
+        # Time for the current queue to drain at the observed service rate.
+        return self.avg_hold_seconds * (self.queued + 1) / max(self.limit, 1)
+
+    def _reject(self, reason: str):
+        self.rejected += 1
+        raise RateLimitException(
+            f"Too many concurrent requests ({reason}).",
+            retry_after=self.retry_after(),
+            details={"limiter": self.name, "limit": self.limit, "queued": self.queued},
+        )
+
+    async def acquire(self) -> float:
+        """
+        Waits for a slot and returns the time spent queued, in seconds.
+        """
+        if not self._waiters and self._take():
+            return 0.0
+        if self.queued >= self.max_queue:
+            self._reject("queue full")
+
+        start = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        if self.shared is not None and self._poller is None:
+            self._poller = asyncio.create_task(self._poll())
+        try:
+            await asyncio.wait_for(waiter, self.max_wait_seconds)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # A slot was handed over just as we gave up; pass it on.
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject("queue wait timeout")
+            raise
+        return time.monotonic() - start
+
+    def release(self):
+        self.in_flight -= 1
+        if self.shared is not None:
+            self.shared.release(f"slots:{self.name}")
+        self._wake()
+
+    def set_limit(self, limit: int):
+        self.limit = limit
+        self._wake()
+
+    def _wake(self):
+        while self._waiters:
+            if self._waiters[0].done():
+                self._waiters.popleft()
+            elif self._take():
+                self._waiters.popleft().set_result(None)
+            else:
+                break
+
+    async def _poll(self):
+        try:
+            while self._waiters:
+                await asyncio.sleep(settings.SHARED_STATE_POLL_MS / 1000)
+                self._wake()
+        finally:
+            self._poller = None
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[float]:
+        waited = await self.acquire()
+        start = time.monotonic()
         try:
-            return await call_next(request)
+            yield waited
         finally:
-            semaphore.release()
-
-# Request Size Limiter
-class RequestSizeLimiterMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
-        content_length = request.headers.get("Content-Length")
-        if content_length and int(content_length) > settings.MAX_REQUEST_BYTES:
-            return JSONResponse(
-                status_code=413,
-                content={
-                    "ok": False,
-                    "trace_id": getattr(request.state, "trace_id", "N/A"),
-                    "error": {
-                        "code": "PAYLOAD_TOO_LARGE",
-                        "message": f"Request payload exceeds the limit of {settings.MAX_REQUEST_BYTES} bytes.",
-                    },
-                },
+            self.avg_hold_seconds += 0.1 * ((time.monotonic() - start) - self.avg_hold_seconds)
+            self.release()
+
+    def stats(self) -> dict:
+        stats = {"limit": self.limit, "in_flight": self.in_flight, "queued": self.queued, "rejected": self.rejected}
+        if self.shared is not None:
+            stats["in_flight_all_workers"] = self.shared.held(f"slots:{self.name}")
+        if self.adaptive is not None:
+            stats.update(self.adaptive.stats())
+        return stats
+
+
+class AdmissionController:
+    """
+    One global limiter for every HTTP request plus one limiter per provider/model around upstream calls,
+    so slow providers can't starve cheap ones. Provider limits are looked up as "provider:model",
+    then "provider", then PROVIDER_MAX_CONCURRENCY.
+
+    With ADAPTIVE_CONCURRENCY_ENABLED, the configured provider limit is only the starting point:
+    each provider/model limit then follows observed upstream latency and throttling (see AdaptiveLimit).
+
+    Model names come from callers, so provider/model limiters are kept in LRU order and, past
+    MAX_TRACKED_MODELS, the least recently used idle ones are dropped with their shared-state slots.
+    """
+    def __init__(self):
+        self.global_limiter = Limiter(
+            "global", settings.MAX_CONCURRENCY, settings.MAX_QUEUE_DEPTH, settings.MAX_QUEUE_WAIT_MS / 1000, shared_state
+        )
+        self.provider_limits = settings.PROVIDER_CONCURRENCY_LIMITS
+        self._limiters: Dict[str, Limiter] = {}  # least recently used first
+
+    def limit_for(self, provider: str, model: str) -> int:
+        return self.provider_limits.get(f"{provider}:{model}", self.provider_limits.get(provider, settings.PROVIDER_MAX_CONCURRENCY))
+
+    def limiter(self, provider: str, model: str) -> Limiter:
+        key = f"{provider}:{model}"
+        limiter = self._limiters.pop(key, None)
+        if limiter is not None:
+            self._limiters[key] = limiter
+        else:
+            self._evict_idle()
+            limiter = self._limiters[key] = Limiter(
+                key, self.limit_for(provider, model), settings.MAX_QUEUE_DEPTH, settings.MAX_QUEUE_WAIT_MS / 1000, shared_state
             )
-        return await call_next(request)
+            if settings.ADAPTIVE_CONCURRENCY_ENABLED:
+                limiter.adaptive = AdaptiveLimit(
+                    limiter.limit,
+                    min_limit=settings.ADAPTIVE_MIN_CONCURRENCY,
+                    max_limit=settings.ADAPTIVE_MAX_CONCURRENCY,
+                    backoff_ratio=settings.ADAPTIVE_BACKOFF_RATIO,
+                    latency_tolerance=settings.ADAPTIVE_LATENCY_TOLERANCE,
+                )
+                limiter.set_limit(limiter.adaptive.limit)
+        return limiter
+
+    def _evict_idle(self):
+        # Limiters with calls in flight or queued stay; those are bounded by the global limit.
+        for key, limiter in list(self._limiters.items()):
+            if len(self._limiters) < settings.MAX_TRACKED_MODELS:
+                return
+            if limiter.in_flight or limiter.queued:
+                continue
+            del self._limiters[key]
+            if limiter.shared is not None:
+                name = limiter.shared.key(f"slots:{key}")
+                limiter.shared.evict(name, lambda held, _: held == 0)
+
+    @staticmethod
+    def is_overload(e: Exception) -> bool:
+        """
+        Upstream signals that mean "send less": throttling, timeouts and 5xx.
+        """
+        if isinstance(e, (UpstreamRateLimitException, TimeoutException)):
+            return True
+        return isinstance(e, ProviderException) and e.details.get("upstream_status", 0) >= 500
+
+    @asynccontextmanager
+    async def upstream(self, provider: str, model: str) -> AsyncIterator[float]:
+        """
+        Holds a provider/model slot around an upstream call and feeds the outcome to its adaptive limit.
+        Yields the time spent queued, in seconds.
+        """
+        limiter = self.limiter(provider, model)
+        async with limiter.slot() as waited:
+            in_flight = limiter.in_flight
+            start = time.monotonic()
+            try:
+                yield waited
+            except Exception as e:
+                if limiter.adaptive is not None and self.is_overload(e):
+                    limiter.set_limit(limiter.adaptive.on_drop())
+                raise
+            if limiter.adaptive is not None:
+                limiter.set_limit(limiter.adaptive.on_success(time.monotonic() - start, in_flight))
+
+    def stats(self) -> dict:
+        return {
+            "global": self.global_limiter.stats(),
+            "providers": {key: limiter.stats() for key, limiter in self._limiters.items()},
+        }
+
+admission = AdmissionController()
+
+# Per provider/model concurrency caps for fan-out work (e.g. batches)
+class KeyedLimiter:
+    """
+    Lazily creates one semaphore per provider/model. Limits are looked up as "provider:model",
+    then "provider", then the default. Past MAX_TRACKED_MODELS, the least recently used
+    semaphores nobody holds are dropped.
+    """
+    def __init__(self, default_limit: int, limits: Optional[Dict[str, int]] = None):
+        self.default_limit = default_limit
+        self.limits = limits or {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}  # least recently used first
+
+    def limit_for(self, provider: str, model: str) -> int:
+        return self.limits.get(f"{provider}:{model}", self.limits.get(provider, self.default_limit))
+
+    def get(self, provider: str, model: str) -> asyncio.Semaphore:
+        key = f"{provider}:{model}"
+        semaphore = self._semaphores.pop(key, None)
+        if semaphore is not None:
+            self._semaphores[key] = semaphore
+            return semaphore
+        for old_key, old in list(self._semaphores.items()):
+            if len(self._semaphores) < settings.MAX_TRACKED_MODELS:
+                break
+            # asyncio.Semaphore has no public count of holders: it is idle when fully released.
+            if old._value == self.limit_for(*old_key.split(":", 1)) and not old.locked():
+                del self._semaphores[old_key]
+        semaphore = self._semaphores[key] = asyncio.Semaphore(self.limit_for(provider, model))
+        return semaphore
+
+batch_limiter = KeyedLimiter(settings.BATCH_CONCURRENCY_PER_MODEL, settings.BATCH_CONCURRENCY_LIMITS)
+# Chunks of map-reduce requests; separate from batches so a chunked batch item can't wait on its own slot.
+chunk_limiter = KeyedLimiter(settings.CHUNK_CONCURRENCY_PER_MODEL, settings.BATCH_CONCURRENCY_LIMITS)
@@ -1,33 +1,190 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 import json
 
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8')
 
+    HOST: str = "0.0.0.0"
     PORT: int = 8000
     LOG_LEVEL: str = "INFO"
+    # Worker processes started by `python -m app.server`; 0 starts one per CPU core.
+    # Limits stay global across workers: they share their admission state through SHARED_STATE_PATH.
+    WORKERS: int = 1
+    SHARED_STATE_PATH: Optional[str] = None  # set by app.server for its workers
+    SHARED_STATE_POLL_MS: int = 5  # how often queued requests look for slots freed by other workers
     MAX_CONCURRENCY: int = 50
+    MAX_QUEUE_DEPTH: int = 100  # requests allowed to wait for a slot, per limiter
+    MAX_QUEUE_WAIT_MS: int = 5000  # waiting longer than this fails fast with 429
+    PROVIDER_MAX_CONCURRENCY: int = 20  # in-flight upstream calls per provider/model
+    # Per-provider or per-model overrides, e.g. {"ollama": 4, "openai:gpt-4o": 10}
+    PROVIDER_CONCURRENCY_JSON: str = '{}'
+    # Provider/model pairs with their own limiter, breaker and latency samples; past this the least recently used idle ones are dropped
+    MAX_TRACKED_MODELS: int = 1024
+    # Adapt provider/model limits to upstream latency and throttling (AIMD), starting from the limits above
+    ADAPTIVE_CONCURRENCY_ENABLED: bool = True
+    ADAPTIVE_MIN_CONCURRENCY: int = 1
+    ADAPTIVE_MAX_CONCURRENCY: int = 200
+    ADAPTIVE_BACKOFF_RATIO: float = 0.9
+    ADAPTIVE_LATENCY_TOLERANCE: float = 2.0
     REQUEST_TIMEOUT_SECONDS: int = 120
     MAX_REQUEST_BYTES: int = 2_000_000  # 2MB
     GATEWAY_API_KEY: Optional[str] = None
+    # Per-tenant token buckets (see core/security.py for how tenants are identified); 0 is unlimited
+    TENANT_REQUESTS_PER_MINUTE: int = 0
+    TENANT_TOKENS_PER_MINUTE: int = 0  # input tokens are charged up front, output tokens after the call
+    # Per-tenant overrides, e.g. {"acme": {"requests_per_minute": 600, "tokens_per_minute": 200000}}
+    TENANT_RATE_LIMITS_JSON: str = '{}'
+    TENANT_MAX_BUCKETS: int = 2048  # two per limited tenant; tenants beyond share an overflow bucket
     
     OLLAMA_HOST: str = "localhost"
     OLLAMA_PORT: int = 11434
 
+    @property
+    def PROVIDER_CONCURRENCY_LIMITS(self) -> Dict[str, int]:
+        try:
+            return json.loads(self.PROVIDER_CONCURRENCY_JSON)
+        except json.JSONDecodeError:
+            return {}
+
+    @property
+    def TENANT_RATE_LIMITS(self) -> Dict[str, Dict[str, int]]:
+        try:
+            return json.loads(self.TENANT_RATE_LIMITS_JSON)
+        except json.JSONDecodeError:
+            return {}
+
     @property
     def OLLAMA_BASE_URL(self) -> str:
         return f"http://{self.OLLAMA_HOST}:{self.OLLAMA_PORT}"
 
-    # For pricing, we expect a JSON string in the .env file
-    PRICING_JSON: str = '{}'
+    # Several Ollama backends, comma-separated (e.g. "http://gpu1:11434,http://gpu2:11434").
+    # When empty, OLLAMA_HOST/OLLAMA_PORT is the only backend.
+    OLLAMA_HOSTS: str = ""
+    OLLAMA_ROUTING: str = "p2c"  # "p2c" (power of two choices) or "least_outstanding"
+    OLLAMA_HEALTH_CHECK_INTERVAL_SECONDS: float = 10
+    OLLAMA_HEALTH_CHECK_TIMEOUT_SECONDS: float = 2
+    OLLAMA_EJECT_AFTER_FAILURES: int = 3
+    OLLAMA_EJECT_SECONDS: float = 30
+
+    @property
+    def OLLAMA_BACKEND_URLS(self) -> List[str]:
+        urls = [url.strip().rstrip("/") for url in self.OLLAMA_HOSTS.split(",") if url.strip()]
+        return urls or [self.OLLAMA_BASE_URL]
+
+    # Providers that can be used, comma-separated (e.g. "ollama"); empty enables every registered one.
+    ENABLED_PROVIDERS: str = ""
+
+    @property
+    def ENABLED_PROVIDER_NAMES(self) -> List[str]:
+        return [name.strip().lower() for name in self.ENABLED_PROVIDERS.split(",") if name.strip()]
+
+    OPENAI_BASE_URL: str = "https://api.openai.com/v1"
+    GEMINI_BASE_URL: str = "https://generativelanguage.googleapis.com/v1beta"
+
+    # Upstream HTTP client pool
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    HTTP2_ENABLED: bool = False
+    CLIENT_POOL_MAX_CLIENTS: int = 256  # credential-bound SDK clients kept alive (LRU)
+    CLIENT_POOL_IDLE_SECONDS: int = 600
+
+    # Exact-match response cache
+    CACHE_ENABLED: bool = True
+    CACHE_MAX_ENTRIES: int = 1024
+    CACHE_TTL_SECONDS: int = 3600
+    CACHE_DETERMINISTIC_ONLY: bool = True  # only cache temperature=0 or seeded requests
+    CACHE_SQLITE_PATH: Optional[str] = None  # enables the persistent tier
+
+    # Retries, hedging and fallbacks around provider calls
+    RETRY_MAX_RETRIES: int = 2
+    RETRY_BACKOFF_BASE_MS: int = 200
+    RETRY_BACKOFF_MAX_MS: int = 5000
+    RETRY_BUDGET_RATIO: float = 0.2  # extra calls (retries + hedges) allowed per primary call
+    RETRY_BUDGET_RESERVE: float = 10
+    HEDGE_ENABLED: bool = False
+    HEDGE_PERCENTILE: float = 95  # hedge once an attempt is slower than this latency percentile
+    HEDGE_MIN_SAMPLES: int = 20
+
+    # Circuit breakers per provider, model and backend
+    CIRCUIT_BREAKER_ENABLED: bool = True
+    CIRCUIT_WINDOW_SECONDS: int = 60
+    CIRCUIT_MIN_CALLS: int = 10  # calls in the window before the rates below are judged
+    CIRCUIT_FAILURE_RATE: float = 0.5
+    CIRCUIT_SLOW_CALL_SECONDS: float = 60
+    CIRCUIT_SLOW_CALL_RATE: float = 0.8
+    CIRCUIT_OPEN_SECONDS: float = 30
+    CIRCUIT_HALF_OPEN_PROBES: int = 1  # concurrent probes, and successes needed to close
+
+    # Share one upstream call between identical concurrent requests
+    COALESCE_ENABLED: bool = True
+
+    # json_schema enforcement for response_format "json"
+    JSON_SCHEMA_CACHE_SIZE: int = 256  # compiled schemas kept, by schema hash
+    JSON_STREAM_VALIDATION: bool = True  # stream schema'd requests upstream and abort on the first violation
+
+    # Prompt construction from instruction + data
+    PROMPT_DATA_ENCODING: str = "auto"  # "auto", "pretty", "minified" or "table"
+    PROMPT_MAX_FIELD_CHARS: int = 0  # cut longer string fields in data; 0 keeps them whole
+
+    # Batch endpoint
+    BATCH_MAX_ITEMS: int = 1000
+    BATCH_CONCURRENCY_PER_MODEL: int = 8
+    # Per-provider or per-model overrides, e.g. {"ollama": 2, "openai:gpt-4o-mini": 16}
+    BATCH_CONCURRENCY_JSON: str = '{}'
+
+    @property
+    def BATCH_CONCURRENCY_LIMITS(self) -> Dict[str, int]:
+        try:
+            return json.loads(self.BATCH_CONCURRENCY_JSON)
+        except json.JSONDecodeError:
+            return {}
+
+    # Map-reduce over input data larger than the model's context window (requests with `chunking`)
+    CONTEXT_WINDOW_TOKENS: int = 8192  # assumed for models without an entry below
+    # Per-provider or per-model context windows, e.g. {"openai": 128000, "ollama:llama3.1": 8192}
+    CONTEXT_WINDOWS_JSON: str = '{}'
+    CHUNK_OUTPUT_RESERVE_TOKENS: int = 1024  # kept free for the answer when max_output_tokens is unset
+    CHUNK_MAX_CHUNKS: int = 64  # data needing more chunks than this is rejected
+    CHUNK_CONCURRENCY_PER_MODEL: int = 8  # chunk calls in flight per provider/model, across requests
 
     @property
-    def PRICING_DATA(self) -> Dict:
+    def CONTEXT_WINDOWS(self) -> Dict[str, int]:
         try:
-            return json.loads(self.PRICING_JSON)
+            return json.loads(self.CONTEXT_WINDOWS_JSON)
         except json.JSONDecodeError:
-            # Handle cases where the JSON is malformed
             return {}
 
+    # Token estimation for providers that don't report usage, calibrated from those that do
+    TOKEN_CALIBRATION_PATH: Optional[str] = None  # persists learned ratios across restarts
+    TOKEN_CALIBRATION_SAVE_INTERVAL_SECONDS: int = 60
+
+    # Prometheus metrics at /metrics
+    METRICS_ENABLED: bool = True
+    METRICS_SAMPLE_INTERVAL_SECONDS: float = 1.0
+
+    # Event-loop lag monitor; stalls longer than the threshold log the blocking stack
+    LOOP_MONITOR_ENABLED: bool = True
+    LOOP_LAG_SAMPLE_INTERVAL_MS: int = 100
+    LOOP_STALL_THRESHOLD_MS: int = 250
+
+    # Per-request profiling for admin callers sending "X-Profile: true"
+    PROFILING_ENABLED: bool = False
+    PROFILE_SAMPLE_INTERVAL_MS: float = 2
+    PROFILE_MAX_STORED: int = 50
+
+    # Usage ledger with hourly rollups per tenant/provider/model
+    LEDGER_ENABLED: bool = True
+    LEDGER_SQLITE_PATH: Optional[str] = "usage_ledger.db"  # in-memory when empty
+    LEDGER_MAX_PENDING: int = 10000
+    LEDGER_BATCH_SIZE: int = 500
+    LEDGER_FLUSH_INTERVAL_MS: int = 1000
+
+    # For pricing, we expect a JSON string in the .env file
+    PRICING_JSON: str = '{}'
+    # Or a JSON file with the same shape, reloaded when it changes
+    PRICING_FILE: Optional[str] = None
+    PRICING_RELOAD_INTERVAL_SECONDS: int = 5
+
 settings = Settings()
@@ -0,0 +1,258 @@
+import asyncio
+import contextvars
+import logging
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import Counter as Tally, OrderedDict
+from typing import Dict, List, Optional, Set
+
+from .config import settings
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})"
+
+
+def _thread_stack(thread_id: int) -> List:
+    frame = sys._current_frames().get(thread_id)
+    stack = []
+    while frame is not None:
+        stack.append(frame)
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _task_frames(frames: List) -> List:
+    """
+    Drops the event loop's own frames, up to the handle that stepped the running task.
+    """
+    for index in range(len(frames) - 1, -1, -1):
+        code = frames[index].f_code
+        if code.co_name == "_run" and code.co_filename.endswith("events.py"):
+            return frames[index + 1:]
+    return frames
+
+
+def _await_chain(task: asyncio.Task) -> List:
+    """
+    Frames of a suspended task, outermost first, following each coroutine to the one it awaits.
+    """
+    frames = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return frames
+
+
+class LoopLagMonitor:
+    """
+    Measures event-loop lag by how late a periodic sleep wakes up, and exports it as a metric.
+
+    A watchdog thread watches the sampler's heartbeat. When the loop has not come back for
+    LOOP_STALL_THRESHOLD_MS, it logs the loop thread's stack, which shows the code that is blocking it.
+    """
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: Optional[int] = None
+        self.heartbeat = time.monotonic()
+        self.max_lag_seconds = 0.0
+        self.stalls = 0
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    async def _sample_forever(self):
+        interval = settings.LOOP_LAG_SAMPLE_INTERVAL_MS / 1000
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(interval)
+            self.heartbeat = time.monotonic()
+            lag = max(0.0, self.heartbeat - start - interval)
+            self.max_lag_seconds = max(self.max_lag_seconds, lag)
+            metrics.observe_loop_lag(lag)
+
+    def _watch(self):
+        threshold = settings.LOOP_STALL_THRESHOLD_MS / 1000 + settings.LOOP_LAG_SAMPLE_INTERVAL_MS / 1000
+        reported = None
+        stopped = self._stopped
+        while not stopped.wait(threshold / 2):
+            heartbeat = self.heartbeat
+            stalled_for = time.monotonic() - heartbeat
+            if stalled_for < threshold or reported == heartbeat:
+                continue
+            reported = heartbeat
+            self.stalls += 1
+            metrics.observe_loop_stall()
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "(no stack)"
+            logger.warning("Event loop blocked for %.0f ms so far; loop thread stack:\n%s", stalled_for * 1000, stack)
+
+    async def start(self):
+        if self._task is not None or not settings.LOOP_MONITOR_ENABLED:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self._stopped = threading.Event()
+        self._task = asyncio.create_task(self._sample_forever())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._stopped.set()
+        self._watchdog = None
+
+    def stats(self) -> dict:
+        return {"max_lag_ms": round(self.max_lag_seconds * 1000, 3), "stalls": self.stalls}
+
+
+loop_monitor = LoopLagMonitor()
+
+# The profile of the request being handled, inherited by every task it spawns.
+current_profile: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar("current_profile", default=None)
+
+
+class RequestProfile:
+    """
+    A wall-clock sampling profile of one request.
+
+    A sampler thread looks at the event loop every PROFILE_SAMPLE_INTERVAL_MS. If one of the
+    request's tasks is running, the loop thread's stack is counted as "running"; otherwise the
+    await chain of the request's innermost live task is counted as "waiting". Stacks are folded
+    ("outer;inner;leaf") so they can be fed straight to flame graph tools.
+    """
+
+    def __init__(self, trace_id: str, loop: asyncio.AbstractEventLoop, interval_seconds: float):
+        self.trace_id = trace_id
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        self.interval_seconds = interval_seconds
+        self.tasks: List[asyncio.Task] = []
+        self._task_set: Set[asyncio.Task] = set()
+        self._parents: Dict[asyncio.Task, asyncio.Task] = {}
+        self.stacks: Tally = Tally()
+        self.running_samples = 0
+        self.waiting_samples = 0
+        self.started = time.monotonic()
+        self.duration_ms = 0.0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample_forever, name=f"profile-{trace_id}", daemon=True)
+
+    def add_task(self, task: Optional[asyncio.Task], parent: Optional[asyncio.Task] = None):
+        if task is not None and task not in self._task_set:
+            self._task_set.add(task)
+            self.tasks.append(task)
+            if parent is not None:
+                self._parents[task] = parent
+
+    def _with_ancestors(self, task: asyncio.Task, frames: List) -> List:
+        # A child task's frames start at its own coroutine; prefix where its ancestors are awaiting it.
+        parent = self._parents.get(task)
+        while parent is not None:
+            frames = _await_chain(parent) + frames
+            parent = self._parents.get(parent)
+        return frames
+
+    def _sample(self):
+        running = asyncio.current_task(self.loop)
+        if running is not None and running in self._task_set:
+            frames = self._with_ancestors(running, _task_frames(_thread_stack(self.loop_thread_id)))
+            state = "running"
+            self.running_samples += 1
+        else:
+            live = [task for task in self.tasks if not task.done()]
+            if not live:
+                return
+            frames = self._with_ancestors(live[-1], _await_chain(live[-1]))
+            state = "waiting"
+            self.waiting_samples += 1
+        self.stacks[";".join([state] + [_frame_label(frame) for frame in frames])] += 1
+
+    def _sample_forever(self):
+        while not self._stopped.wait(self.interval_seconds):
+            try:
+                self._sample()
+            except Exception:  # frames can change under us; skip the sample
+                pass
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join(timeout=0.1)
+        self.duration_ms = (time.monotonic() - self.started) * 1000
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "duration_ms": round(self.duration_ms, 3),
+            "interval_ms": self.interval_seconds * 1000,
+            "running_samples": self.running_samples,
+            "waiting_samples": self.waiting_samples,
+            "stacks": dict(self.stacks.most_common()),
+        }
+
+
+class Profiler:
+    """
+    Opt-in per-request profiling (PROFILING_ENABLED) for admin callers. Finished profiles are kept
+    in memory, newest PROFILE_MAX_STORED only, and served by trace id.
+    """
+
+    def __init__(self):
+        self.profiles: "OrderedDict[str, dict]" = OrderedDict()
+        self._loops: "weakref.WeakSet[asyncio.AbstractEventLoop]" = weakref.WeakSet()
+
+    def _install_task_factory(self, loop: asyncio.AbstractEventLoop):
+        # Tasks spawned while a profile is active (by middleware, hedging, ...) join that profile.
+        previous = loop.get_task_factory()
+
+        def factory(loop, coro, **kwargs):
+            task = previous(loop, coro, **kwargs) if previous else asyncio.Task(coro, loop=loop, **kwargs)
+            profile = current_profile.get()
+            if profile is not None:
+                profile.add_task(task, parent=asyncio.current_task(loop))
+            return task
+
+        loop.set_task_factory(factory)
+
+    def begin(self, trace_id: str) -> RequestProfile:
+        loop = asyncio.get_running_loop()
+        if loop not in self._loops:
+            self._install_task_factory(loop)
+            self._loops.add(loop)
+        profile = RequestProfile(trace_id, loop, settings.PROFILE_SAMPLE_INTERVAL_MS / 1000)
+        profile.add_task(asyncio.current_task())
+        current_profile.set(profile)
+        profile.start()
+        return profile
+
+    def end(self, profile: RequestProfile):
+        profile.stop()
+        current_profile.set(None)
+        self.profiles[profile.trace_id] = profile.to_dict()
+        while len(self.profiles) > settings.PROFILE_MAX_STORED:
+            self.profiles.popitem(last=False)
+
+    def get(self, trace_id: str) -> Optional[dict]:
+        return self.profiles.get(trace_id)
+
+
+profiler = Profiler()
@@ -1,13 +1,15 @@
+import math
 from fastapi import Request
 from fastapi.responses import JSONResponse
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
 class BaseGatewayException(Exception):
-    def __init__(self, status_code: int, code: str, message: str, details: dict = None):
+    def __init__(self, status_code: int, code: str, message: str, details: dict = None, headers: dict = None):
         self.status_code = status_code
         self.code = code
         self.message = message
         self.details = details or {}
+        self.headers = headers or {}
 
 class ValidationException(BaseGatewayException):
     def __init__(self, message: str = "Validation failed.", details: dict = None):
@@ -25,9 +27,36 @@ class JsonInvalidException(BaseGatewayException):
     def __init__(self, message: str = "Invalid JSON output.", details: dict = None):
         super().__init__(422, "JSON_INVALID", message, details)
 
+class PayloadTooLargeException(BaseGatewayException):
+    def __init__(self, message: str = "Request payload too large.", details: dict = None):
+        super().__init__(413, "PAYLOAD_TOO_LARGE", message, details)
 
-async def gateway_exception_handler(request: Request, exc: BaseGatewayException):
-    trace_id = getattr(request.state, 'trace_id', 'N/A')
+class AuthenticationException(BaseGatewayException):
+    def __init__(self, message: str = "Authentication required.", details: dict = None):
+        super().__init__(401, "UNAUTHORIZED", message, details, headers={"WWW-Authenticate": "Bearer"})
+
+class RateLimitException(BaseGatewayException):
+    def __init__(self, message: str = "Too many concurrent requests.", retry_after: float = 1, details: dict = None):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(429, "RATE_LIMIT", message, details, headers={"Retry-After": str(self.retry_after)})
+
+class TenantRateLimitException(BaseGatewayException):
+    def __init__(self, message: str = "Tenant rate limit exceeded.", retry_after: float = 1, details: dict = None):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(429, "TENANT_RATE_LIMIT", message, details, headers={"Retry-After": str(self.retry_after)})
+
+class UpstreamRateLimitException(BaseGatewayException):
+    def __init__(self, message: str = "The provider is rate limiting requests.", retry_after: float = None, details: dict = None):
+        headers = {"Retry-After": str(max(1, math.ceil(retry_after)))} if retry_after else None
+        super().__init__(429, "UPSTREAM_RATE_LIMIT", message, details, headers=headers)
+
+class CircuitOpenException(BaseGatewayException):
+    def __init__(self, message: str = "The upstream is failing; calls are suspended.", retry_after: float = 1, details: dict = None):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(503, "CIRCUIT_OPEN", message, details, headers={"Retry-After": str(self.retry_after)})
+
+
+def gateway_error_response(exc: BaseGatewayException, trace_id: str) -> JSONResponse:
     return JSONResponse(
         status_code=exc.status_code,
         content={
@@ -38,9 +67,14 @@ async def gateway_exception_handler(request: Request, exc: BaseGatewayException)
                 "message": exc.message,
                 "details": exc.details
             }
-        }
+        },
+        headers=exc.headers or None,
     )
 
+async def gateway_exception_handler(request: Request, exc: BaseGatewayException):
+    trace_id = getattr(request.state, 'trace_id', 'N/A')
+    return gateway_error_response(exc, trace_id)
+
 async def http_exception_handler(request: Request, exc: StarletteHTTPException):
     trace_id = getattr(request.state, 'trace_id', 'N/A')
     return JSONResponse(
@@ -0,0 +1,191 @@
+import asyncio
+import os
+from typing import Dict, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+from .concurrency import admission
+from .config import settings
+from ..billing.pricing import pricing_registry
+
+# LLM calls run from tens of milliseconds to minutes.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Gateway overhead and queue wait should stay in the low milliseconds.
+OVERHEAD_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+LABELS = ("provider", "model", "status")
+# Models that are neither priced nor configured share this label.
+OTHER_MODEL = "other"
+MAX_MODEL_LABELS = 1024
+
+
+def multiprocess_mode() -> bool:
+    # prometheus_client switches to file-backed values when this is set before it is imported.
+    return "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+
+class GatewayMetrics:
+    """
+    Prometheus metrics for the gateway.
+
+    Latencies are split into queue wait, provider time and gateway overhead (the rest of the total).
+    Labelled children are cached so the hot path is a dict lookup plus prometheus_client's
+    uncontended per-value lock. Gauges are sampled in the background rather than updated per request.
+    The model label is the caller's string, so it is bounded: models are labelled by the name they
+    are priced under or configured with, and every other model is labelled "other".
+
+    With several workers, set PROMETHEUS_MULTIPROC_DIR to a shared empty directory; /metrics then
+    aggregates every worker's values.
+    """
+
+    def __init__(self, registry: Optional[CollectorRegistry] = REGISTRY):
+        self.registry = registry
+        self.request_duration = Histogram(
+            "gateway_request_duration_seconds", "Total request duration.", LABELS, buckets=LATENCY_BUCKETS, registry=registry
+        )
+        self.provider_duration = Histogram(
+            "gateway_provider_duration_seconds", "Time spent waiting on the provider.", LABELS, buckets=LATENCY_BUCKETS, registry=registry
+        )
+        self.overhead = Histogram(
+            "gateway_overhead_seconds", "Request time not spent queued or waiting on the provider.", LABELS,
+            buckets=OVERHEAD_BUCKETS, registry=registry
+        )
+        self.queue_wait = Histogram(
+            "gateway_queue_wait_seconds", "Time spent waiting for an admission slot.", LABELS, buckets=OVERHEAD_BUCKETS + (10, 30),
+            registry=registry
+        )
+        self.time_to_first_token = Histogram(
+            "gateway_time_to_first_token_seconds", "Time to the first streamed token.", ("provider", "model"),
+            buckets=LATENCY_BUCKETS, registry=registry
+        )
+        self.tokens = Counter("gateway_tokens", "Tokens processed.", ("provider", "model", "direction"), registry=registry)
+        self.cost = Counter("gateway_cost_usd", "Estimated cost in USD.", ("provider", "model"), registry=registry)
+        self.cache = Counter("gateway_response_cache", "Response cache lookups.", ("result",), registry=registry)
+        self.coalesced = Counter("gateway_coalesced_requests", "Requests answered by sharing an in-flight call.", registry=registry)
+        self.rate_limited = Counter(
+            "gateway_rate_limited_requests", "Requests rejected by a tenant rate limit.", ("limit",), registry=registry
+        )
+        self.in_flight = Gauge(
+            "gateway_in_flight", "Requests holding an admission slot.", ("limiter",), multiprocess_mode="livesum", registry=registry
+        )
+        self.queued = Gauge(
+            "gateway_queued", "Requests waiting for an admission slot.", ("limiter",), multiprocess_mode="livesum", registry=registry
+        )
+        self.limit = Gauge(
+            "gateway_concurrency_limit", "Current admission limit.", ("limiter",), multiprocess_mode="livemax", registry=registry
+        )
+        self.loop_lag = Histogram(
+            "gateway_event_loop_lag_seconds", "How late the event loop ran a periodic timer.", buckets=OVERHEAD_BUCKETS,
+            registry=registry
+        )
+        self.loop_stalls = Counter(
+            "gateway_event_loop_stalls", "Times the event loop was blocked past LOOP_STALL_THRESHOLD_MS.", registry=registry
+        )
+        self._children: Dict[Tuple, object] = {}
+        self._model_labels: Dict[Tuple[str, str], str] = {}
+        self._model_labels_table = None
+        self._sampler_task: Optional[asyncio.Task] = None
+
+    def _child(self, metric, *labels):
+        key = (id(metric), *labels)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = metric.labels(*labels)
+        return child
+
+    def model_label(self, provider: str, model: str) -> str:
+        table = pricing_registry.current()
+        if table is not self._model_labels_table or len(self._model_labels) >= MAX_MODEL_LABELS:
+            self._model_labels.clear()
+            self._model_labels_table = table
+        key = (provider, model)
+        label = self._model_labels.get(key)
+        if label is None:
+            label = self._model_labels[key] = table.priced_name(provider, model) or (
+                model if self._configured(provider, model) else OTHER_MODEL
+            )
+        return label
+
+    @staticmethod
+    def _configured(provider: str, model: str) -> bool:
+        key = f"{provider}:{model}"
+        return any(
+            key in limits
+            for limits in (settings.PROVIDER_CONCURRENCY_LIMITS, settings.BATCH_CONCURRENCY_LIMITS, settings.CONTEXT_WINDOWS)
+        )
+
+    def observe_request(self, provider: str, model: str, status: str, duration_ms: float,
+                        provider_duration_ms: float = 0, queue_wait_ms: float = 0,
+                        time_to_first_token_ms: Optional[float] = None):
+        if not settings.METRICS_ENABLED:
+            return
+        model = self.model_label(provider, model)
+        self._child(self.request_duration, provider, model, status).observe(duration_ms / 1000)
+        self._child(self.provider_duration, provider, model, status).observe(provider_duration_ms / 1000)
+        self._child(self.queue_wait, provider, model, status).observe(queue_wait_ms / 1000)
+        overhead_ms = max(0, duration_ms - provider_duration_ms - queue_wait_ms)
+        self._child(self.overhead, provider, model, status).observe(overhead_ms / 1000)
+        if time_to_first_token_ms is not None:
+            self._child(self.time_to_first_token, provider, model).observe(time_to_first_token_ms / 1000)
+
+    def observe_usage(self, provider: str, model: str, input_tokens: int, output_tokens: int, cost: Optional[float]):
+        if not settings.METRICS_ENABLED:
+            return
+        model = self.model_label(provider, model)
+        self._child(self.tokens, provider, model, "input").inc(input_tokens)
+        self._child(self.tokens, provider, model, "output").inc(output_tokens)
+        if cost:
+            self._child(self.cost, provider, model).inc(cost)
+
+    def observe_cache(self, hit: bool):
+        if settings.METRICS_ENABLED:
+            self._child(self.cache, "hit" if hit else "miss").inc()
+
+    def observe_coalesced(self):
+        if settings.METRICS_ENABLED:
+            self.coalesced.inc()
+
+    def observe_rate_limited(self, limit: str):
+        if settings.METRICS_ENABLED:
+            self._child(self.rate_limited, limit).inc()
+
+    def observe_loop_lag(self, seconds: float):
+        if settings.METRICS_ENABLED:
+            self.loop_lag.observe(seconds)
+
+    def observe_loop_stall(self):
+        if settings.METRICS_ENABLED:
+            self.loop_stalls.inc()
+
+    def sample_limiters(self, stats: dict):
+        for name, limiter in [("global", stats["global"]), *stats["providers"].items()]:
+            self._child(self.in_flight, name).set(limiter["in_flight"])
+            self._child(self.queued, name).set(limiter["queued"])
+            self._child(self.limit, name).set(limiter["limit"])
+
+    async def _sample_forever(self):
+        while True:
+            self.sample_limiters(admission.stats())
+            await asyncio.sleep(settings.METRICS_SAMPLE_INTERVAL_SECONDS)
+
+    async def start(self):
+        if settings.METRICS_ENABLED and self._sampler_task is None:
+            self._sampler_task = asyncio.create_task(self._sample_forever())
+
+    async def aclose(self):
+        if self._sampler_task is not None:
+            self._sampler_task.cancel()
+            self._sampler_task = None
+        if multiprocess_mode():
+            multiprocess.mark_process_dead(os.getpid())
+
+    def render(self) -> Tuple[bytes, str]:
+        if multiprocess_mode():
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = self.registry
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+metrics = GatewayMetrics()
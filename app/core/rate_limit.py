@@ -0,0 +1,140 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .config import settings
+from .errors import TenantRateLimitException
+from .metrics import metrics
+from .shared_state import SharedState, SharedStateFull, shared_state
+
+# A bucket holds one minute's worth and may run up to one minute's worth of debt, so two idle
+# minutes refill any bucket completely: dropping it then loses nothing.
+IDLE_SECONDS = 120
+SWEEP_INTERVAL_SECONDS = 60
+# Tenants that find the bucket table full share this one, so they are still limited.
+OVERFLOW_TENANT = "*overflow"
+
+
+def refill(tokens: float, updated: float, capacity: float, now: float) -> float:
+    if not updated:
+        return capacity  # a new bucket starts full
+    return min(capacity, tokens + (now - updated) * capacity / 60)
+
+
+class TenantRateLimiter:
+    """
+    Per-tenant token buckets on requests per minute and tokens per minute.
+
+    A request takes one request token and its estimated input tokens up front; `true_up` then
+    settles the difference with the usage the provider reported. Buckets are two floats refilled
+    lazily on access, and buckets idle long enough to be full again are dropped. With shared
+    state (several workers) the buckets live there, so limits hold across the server.
+
+    At most TENANT_MAX_BUCKETS buckets are kept (and at most half the shared state). Beyond that,
+    new tenants are charged to a shared overflow bucket, so a flood of tenant names can't crowd
+    out other state.
+    """
+
+    def __init__(self, shared: Optional[SharedState] = None):
+        self.shared = shared
+        self.overrides = settings.TENANT_RATE_LIMITS
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._last_sweep = time.monotonic()
+
+    def limits_for(self, tenant: str) -> Dict[str, int]:
+        """
+        TENANT_RATE_LIMITS_JSON entries for the tenant override TENANT_REQUESTS_PER_MINUTE and
+        TENANT_TOKENS_PER_MINUTE. 0 means unlimited.
+        """
+        limits = {"requests_per_minute": settings.TENANT_REQUESTS_PER_MINUTE, "tokens_per_minute": settings.TENANT_TOKENS_PER_MINUTE}
+        limits.update(self.overrides.get(tenant, {}))
+        return limits
+
+    def _take(self, kind: str, tenant: str, capacity: float, amount: float, force: bool = False) -> float:
+        """
+        Takes `amount` from the tenant's bucket if it holds that much (or `force`, which may leave
+        it in debt) and returns 0; otherwise returns the seconds until it will.
+        """
+        name = f"bucket:{kind}:{tenant}"
+        overflow = f"bucket:{kind}:{OVERFLOW_TENANT}"
+        now = time.time()
+
+        def take(tokens: float, updated: float) -> Tuple[float, float, float]:
+            tokens = refill(tokens, updated, capacity, now)
+            if tokens >= amount or force:
+                return min(capacity, max(-capacity, tokens - amount)), now, 0.0
+            return tokens, now, (amount - tokens) * 60 / capacity
+
+        if self.shared is not None:
+            try:
+                return self.shared.update(name, take, min(settings.TENANT_MAX_BUCKETS, self.shared.slots // 2))
+            except SharedStateFull:
+                return self.shared.update(overflow, take)
+        bucket = self._buckets.get(name)
+        if bucket is None:
+            if len(self._buckets) >= settings.TENANT_MAX_BUCKETS:
+                name = overflow
+                bucket = self._buckets.get(name)
+            if bucket is None:
+                bucket = self._buckets[name] = [0.0, 0.0]
+        self._buckets.move_to_end(name)
+        bucket[0], bucket[1], wait = take(*bucket)
+        return wait
+
+    def _sweep(self):
+        now = time.time()
+        # Buckets are kept in order of last use, so the idle ones are at the front.
+        while self._buckets:
+            name, (_, updated) = next(iter(self._buckets.items()))
+            if now - updated < IDLE_SECONDS:
+                break
+            del self._buckets[name]
+        if self.shared is not None and time.monotonic() - self._last_sweep > SWEEP_INTERVAL_SECONDS:
+            self._last_sweep = time.monotonic()
+            self.shared.evict("bucket:", lambda tokens, updated: now - updated >= IDLE_SECONDS)
+
+    def admit(self, tenant: str, estimate_tokens: Callable[[], int]) -> int:
+        """
+        Charges one request and the estimated tokens to the tenant, or raises TenantRateLimitException
+        with how long to wait. The estimate is only computed when the tenant has a tokens limit.
+        Returns the tokens charged, to pass to `true_up`.
+        """
+        limits = self.limits_for(tenant)
+        rpm, tpm = limits["requests_per_minute"], limits["tokens_per_minute"]
+        if not rpm and not tpm:
+            return 0
+        self._sweep()
+
+        if rpm:
+            wait = self._take("rpm", tenant, rpm, 1)
+            if wait:
+                self._reject(tenant, "requests_per_minute", rpm, wait)
+        # A request larger than the whole bucket is charged the bucket, or it could never run.
+        charged = min(estimate_tokens(), tpm) if tpm else 0
+        if charged:
+            wait = self._take("tpm", tenant, tpm, charged)
+            if wait:
+                if rpm:
+                    self._take("rpm", tenant, rpm, -1, force=True)  # give the request back
+                self._reject(tenant, "tokens_per_minute", tpm, wait)
+        return charged
+
+    def true_up(self, tenant: str, charged: int, actual_tokens: int):
+        """
+        Settles the up-front charge with the tokens the call really used. Calls that go over their
+        estimate can leave the bucket in debt, which later requests wait out.
+        """
+        tpm = self.limits_for(tenant)["tokens_per_minute"]
+        if tpm and actual_tokens != charged:
+            self._take("tpm", tenant, tpm, actual_tokens - charged, force=True)
+
+    def _reject(self, tenant: str, kind: str, limit: int, wait: float):
+        metrics.observe_rate_limited(kind)
+        raise TenantRateLimitException(
+            f"Tenant rate limit exceeded ({kind.replace('_', ' ')}).",
+            retry_after=wait,
+            details={"tenant": tenant, "limit": kind, "limit_value": limit, "retry_after_seconds": round(wait, 3)},
+        )
+
+
+rate_limiter = TenantRateLimiter(shared_state)
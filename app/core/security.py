@@ -0,0 +1,49 @@
+import hmac
+from typing import Optional
+from fastapi import Request
+
+from .config import settings
+from .errors import AuthenticationException
+from ..providers.client_pool import credential_fingerprint
+
+TENANT_HEADER = "X-Tenant-ID"
+# Providers that never check the caller's credential, so any string passes as a key.
+KEYLESS_PROVIDERS = frozenset({"ollama"})
+
+
+def tenant_id(http_request: Request, credential: Optional[str] = None, provider: Optional[str] = None) -> str:
+    """
+    The tenant a request is accounted to: the X-Tenant-ID header, else a fingerprint of the
+    provider credential the caller brought, else "anonymous". The header is only trusted from
+    callers holding the gateway API key (such as a front end that authenticates its own users);
+    from anyone else it would let them dodge their limits or spend another tenant's. For the same
+    reason a credential is ignored for keyless providers, where a fresh one costs nothing.
+    """
+    tenant = http_request.headers.get(TENANT_HEADER)
+    if tenant and has_gateway_key(http_request):
+        return tenant
+    if credential and provider not in KEYLESS_PROVIDERS:
+        return f"key:{credential_fingerprint(credential)}"
+    return "anonymous"
+
+
+def has_gateway_key(http_request: Request) -> bool:
+    """
+    Whether the caller sent `Authorization: Bearer <GATEWAY_API_KEY>`. Never true while the key is unset.
+    """
+    if not settings.GATEWAY_API_KEY:
+        return False
+    scheme, _, token = http_request.headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(token.encode(), settings.GATEWAY_API_KEY.encode())
+
+
+def is_admin(http_request: Request) -> bool:
+    """
+    Admin endpoints need `Authorization: Bearer <GATEWAY_API_KEY>`; while the key is unset they are closed.
+    """
+    return has_gateway_key(http_request)
+
+
+def require_admin(http_request: Request):
+    if not is_admin(http_request):
+        raise AuthenticationException("This endpoint requires the gateway API key; set GATEWAY_API_KEY to enable it.")
@@ -0,0 +1,194 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Tuple, TypeVar
+
+from .config import settings
+
+SLOT_SIZE = 128
+NAME_SIZE = 112
+MAX_NAME_CHARS = 100  # longer names are hashed, leaving room for an "@<pid>" suffix
+TOMBSTONE = 1  # first name byte of an evicted slot; lookups scan past it, new names may reuse it
+VALUES = struct.Struct("<dd")
+
+T = TypeVar("T")
+
+
+class SharedStateFull(RuntimeError):
+    pass
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedState:
+    """
+    Named pairs of numbers shared by the worker processes of one server, without a separate service.
+
+    They live in a memory-mapped file of fixed slots (a name, then two float64s). Every
+    read-modify-write holds an exclusive flock on the file for a few microseconds, so updates are
+    atomic across workers. Slots are claimed on first use and freed by `evict`; each process
+    caches where its names live.
+    """
+
+    def __init__(self, path: str, slots: int = 4096):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < slots * SLOT_SIZE:
+            os.ftruncate(self._fd, slots * SLOT_SIZE)
+        self.slots = os.fstat(self._fd).st_size // SLOT_SIZE
+        self._map = mmap.mmap(self._fd, self.slots * SLOT_SIZE)
+        self._offsets: Dict[str, Tuple[int, bytes]] = {}
+
+    @staticmethod
+    def key(name: str) -> str:
+        if len(name) <= MAX_NAME_CHARS:
+            return name
+        return "#" + hashlib.blake2b(name.encode(), digest_size=20).hexdigest()
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _offset(self, name: str, limit: Optional[int] = None) -> int:
+        # Call with the lock held. A cached offset is checked, since another worker may have evicted it.
+        # A new name may only take a never-used slot below `limit`, which keeps the rest for other names.
+        cached = self._offsets.get(name)
+        if cached is not None and self._map[cached[0]:cached[0] + NAME_SIZE] == cached[1]:
+            return cached[0]
+        encoded = name.encode().ljust(NAME_SIZE, b"\0")
+        free = None
+        for offset in range(0, self.slots * SLOT_SIZE, SLOT_SIZE):
+            current = self._map[offset:offset + NAME_SIZE]
+            if current == encoded:
+                break
+            if current[0] == TOMBSTONE and free is None:
+                free = offset
+            elif current[0] == 0:
+                if free is None and limit is not None and offset >= limit * SLOT_SIZE:
+                    raise SharedStateFull(f"Shared state {self.path} has no room for {name!r} below slot {limit}.")
+                offset = free if free is not None else offset
+                self._map[offset:offset + NAME_SIZE] = encoded
+                self._set(offset, 0, 0)
+                break
+        else:
+            if free is None:
+                raise SharedStateFull(f"Shared state {self.path} is full ({self.slots} slots).")
+            offset = free
+            self._map[offset:offset + NAME_SIZE] = encoded
+            self._set(offset, 0, 0)
+        self._offsets[name] = (offset, encoded)
+        return offset
+
+    def _get(self, offset: int) -> Tuple[float, float]:
+        return VALUES.unpack_from(self._map, offset + NAME_SIZE)
+
+    def _set(self, offset: int, a: float, b: float):
+        VALUES.pack_into(self._map, offset + NAME_SIZE, a, b)
+
+    def read(self, name: str) -> Tuple[float, float]:
+        with self._locked():
+            return self._get(self._offset(self.key(name)))
+
+    def update(self, name: str, fn: Callable[[float, float], Tuple[float, float, T]], limit: Optional[int] = None) -> T:
+        """
+        Atomically replaces the pair stored under `name` with the first two values `fn` returns
+        and returns the third. Unused names start at (0, 0). With `limit`, a new name that would
+        need a slot at or above it raises SharedStateFull instead.
+        """
+        with self._locked():
+            offset = self._offset(self.key(name), limit)
+            a, b, result = fn(*self._get(offset))
+            self._set(offset, a, b)
+            return result
+
+    # Counters of held slots, e.g. requests in flight. Each worker's share is kept under
+    # "<name>@<pid>" as well, so what a dead worker held can be given back.
+
+    def acquire(self, name: str, limit: float) -> bool:
+        """
+        Adds one to the counter unless it has reached `limit`.
+        """
+        key = self.key(name)
+        with self._locked():
+            total = self._offset(key)
+            held, _ = self._get(total)
+            if held >= limit:
+                return False
+            own = self._offset(f"{key}@{os.getpid()}")
+            self._set(total, held + 1, 0)
+            self._set(own, self._get(own)[0] + 1, 0)
+            return True
+
+    def release(self, name: str):
+        key = self.key(name)
+        with self._locked():
+            total = self._offset(key)
+            own = self._offset(f"{key}@{os.getpid()}")
+            self._set(total, max(0.0, self._get(total)[0] - 1), 0)
+            self._set(own, max(0.0, self._get(own)[0] - 1), 0)
+
+    def held(self, name: str) -> int:
+        return int(self.read(name)[0])
+
+    def reclaim_dead_workers(self) -> int:
+        """
+        Gives back the slots held by workers that are gone (crashed or killed). Returns how many.
+        """
+        reclaimed = 0
+        with self._locked():
+            for offset in range(0, self.slots * SLOT_SIZE, SLOT_SIZE):
+                raw = self._map[offset:offset + NAME_SIZE]
+                if raw[0] == 0:
+                    break
+                if raw[0] == TOMBSTONE:
+                    continue
+                base, _, pid = raw.rstrip(b"\0").decode().rpartition("@")
+                if not base or not pid.isdigit() or pid_alive(int(pid)):
+                    continue
+                held, _ = self._get(offset)
+                if held:
+                    total = self._offset(base)
+                    self._set(total, max(0.0, self._get(total)[0] - held), 0)
+                    self._set(offset, 0, 0)
+                    reclaimed += int(held)
+        return reclaimed
+
+    def evict(self, prefix: str, predicate: Callable[[float, float], bool]) -> int:
+        """
+        Frees the slots of names starting with `prefix` whose values match `predicate`. Returns how many.
+        """
+        encoded_prefix = prefix.encode()
+        evicted = 0
+        with self._locked():
+            for offset in range(0, self.slots * SLOT_SIZE, SLOT_SIZE):
+                first = self._map[offset]
+                if first == 0:
+                    break
+                if first != TOMBSTONE and self._map[offset:offset + len(encoded_prefix)] == encoded_prefix \
+                        and predicate(*self._get(offset)):
+                    self._map[offset:offset + NAME_SIZE] = bytes([TOMBSTONE]).ljust(NAME_SIZE, b"\0")
+                    evicted += 1
+        return evicted
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+# Set by the multi-worker launcher (app.server); None in a single process.
+shared_state: Optional[SharedState] = SharedState(settings.SHARED_STATE_PATH) if settings.SHARED_STATE_PATH else None
@@ -1,9 +1,18 @@
 from fastapi import FastAPI
 from .api import routes as api_routes
 from .core.config import settings
-from .api.middleware import TimingAndTraceMiddleware
-from .core.concurrency import ConcurrencyLimiterMiddleware, RequestSizeLimiterMiddleware
+from .api.middleware import GatewayMiddleware
 from .core.errors import add_exception_handlers
+from .core.diagnostics import loop_monitor
+from .core.metrics import metrics
+from .core.shared_state import shared_state
+from .providers.client_pool import client_pool
+from .agents.cache import response_cache
+from .providers.factory import provider_registry
+from .billing.ledger import usage_ledger
+from .billing.pricing import pricing_registry
+from .utils.token_estimator import token_estimator
+import asyncio
 
 app = FastAPI(
     title="LLM Agent Gateway",
@@ -11,9 +20,7 @@ app = FastAPI(
 )
 
 # Add middleware
-app.add_middleware(TimingAndTraceMiddleware)
-app.add_middleware(ConcurrencyLimiterMiddleware)
-app.add_middleware(RequestSizeLimiterMiddleware)
+app.add_middleware(GatewayMiddleware)
 
 # Add exception handlers
 add_exception_handlers(app)
@@ -21,10 +28,41 @@ add_exception_handlers(app)
 # Include API routes
 app.include_router(api_routes.router)
 
+def ollama_enabled() -> bool:
+    # The pool polls every backend's /api/ps, so it is only imported and started for deployments that use Ollama.
+    return "ollama" in provider_registry.names()
+
 @app.on_event("startup")
 async def startup_event():
-    pass
+    if shared_state is not None:
+        # A worker replacing a crashed one frees the slots that one still held.
+        shared_state.reclaim_dead_workers()
+    await client_pool.start()
+    if ollama_enabled():
+        from .providers.ollama_pool import ollama_pool
+        await ollama_pool.start()
+    await pricing_registry.start()
+    await metrics.start()
+    await loop_monitor.start()
+    if settings.LEDGER_ENABLED:
+        await usage_ledger.start()
+    if settings.TOKEN_CALIBRATION_PATH:
+        token_estimator.load(settings.TOKEN_CALIBRATION_PATH)
+        app.state.calibration_task = asyncio.create_task(token_estimator.save_periodically(
+            settings.TOKEN_CALIBRATION_PATH, settings.TOKEN_CALIBRATION_SAVE_INTERVAL_SECONDS
+        ))
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    pass
+    if ollama_enabled():
+        from .providers.ollama_pool import ollama_pool
+        await ollama_pool.aclose()
+    await pricing_registry.aclose()
+    await usage_ledger.aclose()
+    await loop_monitor.aclose()
+    await metrics.aclose()
+    await client_pool.aclose()
+    response_cache.close()
+    if settings.TOKEN_CALIBRATION_PATH:
+        app.state.calibration_task.cancel()
+        token_estimator.save(settings.TOKEN_CALIBRATION_PATH)
@@ -1,11 +1,36 @@
 from abc import ABC, abstractmethod
-from ..api.schemas import AgentRunRequest, SuccessResponse
+from typing import AsyncIterator, Dict, List, Optional, Sequence
+from pydantic import BaseModel
+from ..api.schemas import AgentRunRequest, SuccessResponse, Result
+from ..utils.json_tools import dumps, loads
+
+class StreamChunk(BaseModel):
+    """
+    A piece of a streamed completion. Providers put the final usage, when known, on the last chunk.
+    """
+    delta: str = ""
+    usage: Optional[dict] = None
 
 class BaseProvider(ABC):
+    # The circuit breaker backend for this provider's calls. None for providers that route between
+    # several backends and guard each one themselves.
+    breaker_backend: Optional[str] = "default"
+    # Reported by /v1/providers for providers registered without declaring capabilities.
+    capabilities: Sequence[str] = ("chat_completions",)
+
     @abstractmethod
     async def invoke(self, request: AgentRunRequest) -> SuccessResponse:
         pass
 
+    async def stream(self, request: AgentRunRequest) -> AsyncIterator[StreamChunk]:
+        """
+        Streams the completion as deltas. Providers without native streaming fall back to a single chunk.
+        """
+        response = await self.invoke(request)
+        result = response.result
+        text = result.text if result.type == "text" else dumps(result.json).decode()
+        yield StreamChunk(delta=text or "", usage=response.usage.model_dump())
+
     @property
     @abstractmethod
     def supports_json_mode(self) -> bool:
@@ -14,3 +39,33 @@ class BaseProvider(ABC):
     @abstractmethod
     def extract_usage(self, response: any) -> dict:
         pass
+
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        try:
+            return float(value) if value else None
+        except ValueError:
+            return None
+
+    @staticmethod
+    def json_result(content: Optional[str]) -> Result:
+        """
+        A JSON result, or the raw text when it doesn't parse; enforcement and repair happen later.
+        """
+        try:
+            value = loads(content or "")
+        except ValueError:
+            value = None
+        if isinstance(value, dict):
+            return Result.model_construct(type="json", json=value)
+        return Result.model_construct(type="text", text=content)
+
+    @staticmethod
+    def build_messages(request: AgentRunRequest) -> List[Dict[str, str]]:
+        if request.input.messages:
+            return [{"role": msg.role, "content": msg.content} for msg in request.input.messages]
+        data = request.input.data
+        return [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": f"{request.input.instruction}\n\n{dumps(data).decode() if isinstance(data, dict) else data}"}
+        ]
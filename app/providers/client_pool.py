@@ -0,0 +1,111 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import httpx
+
+from ..core.config import settings
+
+
+def credential_fingerprint(credential: Optional[str]) -> str:
+    """
+    Returns a short, non-reversible fingerprint of a credential so raw keys are never used as dict keys.
+    """
+    if not credential:
+        return ""
+    return hashlib.sha256(credential.encode("utf-8")).hexdigest()[:16]
+
+
+class ClientPool:
+    """
+    Long-lived upstream clients shared across requests.
+
+    One `httpx.AsyncClient` (and therefore one keep-alive connection pool) is kept per upstream base URL.
+    SDK clients bound to a credential are cached on top of it, keyed by (provider, base URL, credential),
+    and evicted in LRU order or when idle so per-tenant keys don't accumulate forever.
+    """
+
+    def __init__(self, max_clients: Optional[int] = None, idle_seconds: Optional[float] = None):
+        self.max_clients = max_clients or settings.CLIENT_POOL_MAX_CLIENTS
+        self.idle_seconds = idle_seconds or settings.CLIENT_POOL_IDLE_SECONDS
+        self._http_clients: Dict[str, httpx.AsyncClient] = {}
+        self._clients: "OrderedDict[Tuple[str, str, str], Tuple[Any, float]]" = OrderedDict()
+        self._reaper: Optional[asyncio.Task] = None
+
+    def http_client(self, base_url: str) -> httpx.AsyncClient:
+        client = self._http_clients.get(base_url)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                base_url=base_url,
+                http2=settings.HTTP2_ENABLED,
+                timeout=settings.REQUEST_TIMEOUT_SECONDS,
+                limits=httpx.Limits(
+                    max_connections=settings.HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY_SECONDS,
+                ),
+            )
+            self._http_clients[base_url] = client
+        return client
+
+    def get_client(
+        self,
+        provider: str,
+        base_url: str,
+        credential: Optional[str],
+        factory: Callable[[httpx.AsyncClient], Any],
+    ) -> Any:
+        """
+        Returns the cached SDK client for (provider, base_url, credential), building it with
+        `factory(http_client)` on a miss. The factory receives the shared connection pool for `base_url`.
+        """
+        key = (provider, base_url, credential_fingerprint(credential))
+        entry = self._clients.get(key)
+        now = time.monotonic()
+        if entry is not None:
+            self._clients.move_to_end(key)
+            self._clients[key] = (entry[0], now)
+            return entry[0]
+
+        client = factory(self.http_client(base_url))
+        self._clients[key] = (client, now)
+        while len(self._clients) > self.max_clients:
+            self._clients.popitem(last=False)
+        return client
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        now = time.monotonic() if now is None else now
+        stale = [key for key, (_, last_used) in self._clients.items() if now - last_used > self.idle_seconds]
+        for key in stale:
+            del self._clients[key]
+        return len(stale)
+
+    async def _reap_forever(self):
+        interval = min(self.idle_seconds, 60)
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle()
+
+    async def start(self):
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_forever())
+
+    async def aclose(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        self._clients.clear()
+        clients, self._http_clients = list(self._http_clients.values()), {}
+        for client in clients:
+            await client.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "upstreams": len(self._http_clients),
+            "clients": len(self._clients),
+        }
+
+
+client_pool = ClientPool()
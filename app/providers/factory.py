@@ -1,19 +1,101 @@
-from .base import BaseProvider
-from .openai_provider import OpenAIProvider
-from .gemini_provider import GeminiProvider
-from .ollama_provider import OllamaProvider
-from typing import Type
+import importlib
+from importlib import metadata
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Type
 
-def get_provider(provider_name: str) -> Type[BaseProvider]:
+from ..core.config import settings
+
+if TYPE_CHECKING:
+    from .base import BaseProvider
+
+# Third-party packages add providers under this entry point group, e.g. in pyproject.toml:
+#   [project.entry-points."llm_agent_gateway.providers"]
+#   acme = "acme_gateway.provider:AcmeProvider"
+ENTRY_POINT_GROUP = "llm_agent_gateway.providers"
+
+
+class ProviderSpec:
+    """
+    A provider as known before it is imported: its name, where its class lives ("module:Class")
+    and what it supports. Without declared capabilities, the class's `capabilities` are read,
+    which imports its module but doesn't instantiate it.
+    """
+
+    def __init__(self, name: str, target: str, capabilities: Optional[Sequence[str]] = None):
+        self.name = name.lower()
+        self.target = target
+        self._capabilities = list(capabilities) if capabilities is not None else None
+
+    def load(self) -> Type["BaseProvider"]:
+        module, _, attr = self.target.partition(":")
+        return getattr(importlib.import_module(module), attr)
+
+    @property
+    def capabilities(self) -> List[str]:
+        if self._capabilities is None:
+            self._capabilities = list(self.load().capabilities)
+        return self._capabilities
+
+
+class ProviderRegistry:
+    """
+    Providers by name. A provider's module (and its SDK) is imported when the provider is first
+    used, so deployments don't pay for providers they never call. ENABLED_PROVIDERS limits which
+    registered providers can be used; entry points are discovered on first lookup.
+    """
+
+    def __init__(self):
+        self._specs: Dict[str, ProviderSpec] = {}
+        # Providers are stateless; upstream clients live in the client pool, so one instance per provider is shared.
+        self._instances: Dict[str, "BaseProvider"] = {}
+        self._discovered = False
+
+    def register(self, name: str, target: str, capabilities: Optional[Sequence[str]] = None) -> ProviderSpec:
+        spec = self._specs[name.lower()] = ProviderSpec(name, target, capabilities)
+        self._instances.pop(spec.name, None)
+        return spec
+
+    def _discover(self):
+        if self._discovered:
+            return
+        self._discovered = True
+        for entry_point in metadata.entry_points(group=ENTRY_POINT_GROUP):
+            # Built-in providers keep their names.
+            if entry_point.name.lower() not in self._specs:
+                self.register(entry_point.name, entry_point.value)
+
+    def names(self) -> List[str]:
+        """
+        The enabled providers, in registration order.
+        """
+        self._discover()
+        enabled = settings.ENABLED_PROVIDER_NAMES
+        return [name for name in self._specs if not enabled or name in enabled]
+
+    def spec(self, name: str) -> ProviderSpec:
+        name = name.lower()
+        if name not in self.names():
+            raise ValueError(f"Provider '{name}' not supported. Enabled providers: {', '.join(self.names())}.")
+        return self._specs[name]
+
+    def get(self, name: str) -> "BaseProvider":
+        spec = self.spec(name)
+        provider = self._instances.get(spec.name)
+        if provider is None:
+            provider = self._instances[spec.name] = spec.load()()
+        return provider
+
+    def loaded(self) -> List[str]:
+        return list(self._instances)
+
+
+provider_registry = ProviderRegistry()
+provider_registry.register("openai", f"{__package__}.openai_provider:OpenAIProvider", ["json_mode", "chat_completions"])
+provider_registry.register("gemini", f"{__package__}.gemini_provider:GeminiProvider", ["json_mode", "chat_completions"])
+provider_registry.register("ollama", f"{__package__}.ollama_provider:OllamaProvider", ["json_mode", "chat_completions"])
+
+
+def get_provider(provider_name: str) -> "BaseProvider":
     """
-    Factory function to get a provider class based on its name.
+    The shared instance of an enabled provider, importing it on first use.
     """
-    provider_map = {
-        "openai": OpenAIProvider,
-        "gemini": GeminiProvider,
-        "ollama": OllamaProvider,
-    }
-    provider_class = provider_map.get(provider_name.lower())
-    if not provider_class:
-        raise ValueError(f"Provider '{provider_name}' not supported.")
-    return provider_class()
+    return provider_registry.get(provider_name)
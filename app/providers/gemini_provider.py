@@ -1,62 +1,151 @@
 import time
-import google.generativeai as genai
-from .base import BaseProvider
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional
+import httpx
+from .base import BaseProvider, StreamChunk
+from .client_pool import client_pool
 from ..api.schemas import AgentRunRequest, SuccessResponse, Result, Usage, Billing, Timing
-import json
+from ..core.config import settings
+from ..core.errors import BaseGatewayException, ProviderException, TimeoutException, UpstreamRateLimitException
+from ..utils.json_tools import dumps, loads
 
-class GeminiProvider(BaseProvider):
-    async def invoke(self, request: AgentRunRequest) -> SuccessResponse:
-        genai.configure(api_key=request.auth.key)
+# Gateway roles to Gemini content roles; system messages become the system instruction.
+ROLES = {"user": "user", "assistant": "model"}
+MAX_MODELS_PER_CLIENT = 32
 
-        provider_start_time = time.time()
 
-        model = genai.GenerativeModel(request.model)
+class GeminiModel:
+    """
+    A model's resolved resource name and endpoints, built once per client and model.
+    """
 
-        if request.input.messages:
-            # Not a direct mapping, need to handle roles and content.
-            # This is a simplified version.
-            prompt = [f"{msg.role}: {msg.content}" for msg in request.input.messages]
-            prompt = "\n".join(prompt)
-        else:
-            prompt = f"{request.input.instruction}\n\n{json.dumps(request.input.data) if isinstance(request.input.data, dict) else request.input.data}"
-        
-        generation_config = genai.types.GenerationConfig(
-            temperature=request.temperature,
-            max_output_tokens=request.max_output_tokens,
-            top_p=request.top_p,
-            stop_sequences=request.stop,
-        )
+    def __init__(self, name: str):
+        self.name = name if name.startswith(("models/", "tunedModels/")) else f"models/{name}"
+        self.generate_path = f"/{self.name}:generateContent"
+        self.stream_path = f"/{self.name}:streamGenerateContent"
+
+
+class GeminiClient:
+    """
+    The Gemini REST API bound to one API key. It rides on the pooled HTTP client for the base URL
+    and sends its key per request, so nothing is shared (or raced) between tenants.
+    """
 
-        response = await model.generate_content_async(
-            prompt,
-            generation_config=generation_config
+    def __init__(self, http_client: httpx.AsyncClient, api_key: Optional[str]):
+        self.http_client = http_client
+        self.headers = {"Content-Type": "application/json", "x-goog-api-key": api_key or ""}
+        self._models: "OrderedDict[str, GeminiModel]" = OrderedDict()
+
+    def model(self, name: str) -> GeminiModel:
+        model = self._models.get(name)
+        if model is None:
+            model = self._models[name] = GeminiModel(name)
+            while len(self._models) > MAX_MODELS_PER_CLIENT:
+                self._models.popitem(last=False)
+        return model
+
+    async def generate(self, model: GeminiModel, body: bytes, timeout: float) -> dict:
+        res = await self.http_client.post(model.generate_path, content=body, headers=self.headers, timeout=timeout)
+        res.raise_for_status()
+        return loads(res.content)
+
+    async def stream(self, model: GeminiModel, body: bytes, timeout: float) -> AsyncIterator[dict]:
+        async with self.http_client.stream(
+            "POST", model.stream_path, params={"alt": "sse"}, content=body, headers=self.headers, timeout=timeout
+        ) as res:
+            if res.is_error:
+                await res.aread()
+                res.raise_for_status()
+            async for line in res.aiter_lines():
+                if line.startswith("data:"):
+                    yield loads(line[5:])
+
+
+class GeminiProvider(BaseProvider):
+    def _client(self, request: AgentRunRequest) -> GeminiClient:
+        return client_pool.get_client(
+            "gemini",
+            settings.GEMINI_BASE_URL,
+            request.auth.key,
+            lambda http_client: GeminiClient(http_client, request.auth.key),
         )
 
+    @staticmethod
+    def _contents(messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """
+        Maps chat messages to Gemini contents. Consecutive messages with the same role are merged
+        into one turn with several parts.
+        """
+        system = [{"text": message["content"]} for message in messages if message["role"] == "system"]
+        contents: List[Dict[str, Any]] = []
+        for message in messages:
+            role = ROLES.get(message["role"])
+            if role is None:
+                continue
+            if contents and contents[-1]["role"] == role:
+                contents[-1]["parts"].append({"text": message["content"]})
+            else:
+                contents.append({"role": role, "parts": [{"text": message["content"]}]})
+        body: Dict[str, Any] = {"contents": contents}
+        if system:
+            body["systemInstruction"] = {"parts": system}
+        return body
+
+    def _body(self, request: AgentRunRequest) -> bytes:
+        config = {
+            "temperature": request.temperature,
+            "topP": request.top_p,
+            "maxOutputTokens": request.max_output_tokens,
+            "stopSequences": request.stop,
+            "seed": request.seed,
+        }
+        if request.response_format == "json":
+            config["responseMimeType"] = "application/json"
+        body = self._contents(self.build_messages(request))
+        body["generationConfig"] = {key: value for key, value in config.items() if value is not None}
+        return dumps(body)
+
+    @staticmethod
+    def _text(response: dict) -> str:
+        candidates = response.get("candidates") or []
+        if not candidates:
+            return ""
+        parts = (candidates[0].get("content") or {}).get("parts") or []
+        return "".join(part.get("text", "") for part in parts)
+
+    @staticmethod
+    def _check_blocked(response: dict):
+        block_reason = (response.get("promptFeedback") or {}).get("blockReason")
+        if block_reason and not response.get("candidates"):
+            raise ProviderException(f"Gemini blocked the prompt ({block_reason}).", details={"block_reason": block_reason})
+
+    async def invoke(self, request: AgentRunRequest) -> SuccessResponse:
+        client = self._client(request)
+        model = client.model(request.model)
+        provider_start_time = time.time()
+
+        try:
+            response = await client.generate(model, self._body(request), request.timeout_seconds or settings.REQUEST_TIMEOUT_SECONDS)
+        except httpx.HTTPError as e:
+            raise self._translate_error(e) from e
+        self._check_blocked(response)
+
         provider_duration_ms = int((time.time() - provider_start_time) * 1000)
 
-        usage = self.extract_usage(response)
-        
+        text = self._text(response)
         if request.response_format == "json":
-             # Gemini doesn't have a native JSON mode in the same way as OpenAI.
-             # This is a simplification. We'd need to add post-processing.
-            try:
-                result_json = json.loads(response.text)
-                result = Result(type="json", json=result_json)
-            except json.JSONDecodeError:
-                # Or return an error, as per requirements
-                result = Result(type="text", text=response.text)
+            result = self.json_result(text)
         else:
-            result = Result(type="text", text=response.text)
+            result = Result.model_construct(type="text", text=text)
 
-        # This is a simplified implementation. We'll add billing and other details later.
-        return SuccessResponse(
+        return SuccessResponse.model_construct(
             trace_id=request.trace_id,
             provider=request.provider,
             model=request.model,
             result=result,
-            usage=Usage(**usage),
-            billing=Billing(pricing_source="unknown"), # Placeholder
-            timing=Timing(
+            usage=Usage.model_construct(**self.extract_usage(response)),
+            billing=Billing.model_construct(pricing_source="unknown"), # Placeholder
+            timing=Timing.model_construct(
                 started_at="", # Placeholder
                 ended_at="", # Placeholder
                 duration_ms=0, # Placeholder
@@ -64,17 +153,56 @@ class GeminiProvider(BaseProvider):
             )
         )
 
+    async def stream(self, request: AgentRunRequest) -> AsyncIterator[StreamChunk]:
+        client = self._client(request)
+        model = client.model(request.model)
+        last = None
+        try:
+            async for event in client.stream(model, self._body(request), request.timeout_seconds or settings.REQUEST_TIMEOUT_SECONDS):
+                self._check_blocked(event)
+                last = event
+                delta = self._text(event)
+                if delta:
+                    yield StreamChunk(delta=delta)
+        except httpx.HTTPError as e:
+            raise self._translate_error(e) from e
+        # Every event carries the running usage; the last one is final.
+        if last is not None:
+            yield StreamChunk(usage=self.extract_usage(last))
+
+    def _translate_error(self, e: httpx.HTTPError) -> BaseGatewayException:
+        if isinstance(e, httpx.TimeoutException):
+            return TimeoutException(f"Gemini request timed out: {e!r}")
+        if isinstance(e, httpx.HTTPStatusError):
+            status = e.response.status_code
+            try:
+                message = loads(e.response.content)["error"]["message"]
+            except (ValueError, KeyError, TypeError):
+                message = f"Gemini returned HTTP {status}."
+            if status == 429:
+                return UpstreamRateLimitException(
+                    message,
+                    retry_after=self.parse_retry_after(e.response.headers.get("retry-after")),
+                    details={"upstream_status": status},
+                )
+            return ProviderException(message, details={"upstream_status": status})
+        return ProviderException(f"Gemini request failed: {e!r}")
+
     @property
     def supports_json_mode(self) -> bool:
-        return True # But requires post-processing
+        return True
 
     def extract_usage(self, response: any) -> dict:
-        # The usage metadata from Gemini is not as straightforward as OpenAI's.
-        # This is a placeholder and might need adjustment based on the actual response structure.
-        # It's often not provided directly and needs to be estimated.
+        metadata = response.get("usageMetadata")
+        if not metadata:
+            return {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0, "is_estimated": True}
+        input_tokens = metadata.get("promptTokenCount", 0)
+        # Thinking models bill their reasoning tokens as output.
+        output_tokens = metadata.get("candidatesTokenCount", 0) + metadata.get("thoughtsTokenCount", 0)
         return {
-            "input_tokens": 0, 
-            "output_tokens": 0,
-            "total_tokens": 0,
-            "is_estimated": True
-        }
\ No newline at end of file
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": metadata.get("totalTokenCount", input_tokens + output_tokens),
+            "cached_input_tokens": metadata.get("cachedContentTokenCount", 0),
+            "is_estimated": False,
+        }
@@ -0,0 +1,145 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional, Set
+
+from .client_pool import client_pool
+from ..core.circuit_breaker import circuit_breakers
+from ..core.config import settings
+from ..core.errors import ProviderException, TimeoutException
+
+
+def normalize_model(name: str) -> str:
+    # Ollama reports loaded models with their tag ("llama3.1:latest"); requests often omit it.
+    return name if ":" in name else f"{name}:latest"
+
+
+class OllamaBackend:
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.loaded_models: Set[str] = set()
+
+    @property
+    def available(self) -> bool:
+        return self.ejected_until <= time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "available": self.available,
+            "outstanding": self.outstanding,
+            "consecutive_failures": self.consecutive_failures,
+            "loaded_models": sorted(self.loaded_models),
+        }
+
+
+class OllamaBackendPool:
+    """
+    Routes Ollama calls across several backends.
+
+    Requests go to a backend that already has the model loaded when there is one (learned from
+    `/api/ps` and from successful calls), then by least outstanding requests or power of two choices.
+    Backends that fail OLLAMA_EJECT_AFTER_FAILURES times in a row are ejected for OLLAMA_EJECT_SECONDS;
+    a background health check brings them back early once they answer again. Each backend also has
+    a circuit breaker per model, so a model failing on one backend is routed around there alone.
+    """
+
+    def __init__(self, urls: Optional[List[str]] = None, routing: Optional[str] = None):
+        self.backends = [OllamaBackend(url) for url in (urls or settings.OLLAMA_BACKEND_URLS)]
+        self.routing = routing or settings.OLLAMA_ROUTING
+        self._health_task: Optional[asyncio.Task] = None
+
+    def pick(self, model: str) -> OllamaBackend:
+        candidates = [backend for backend in self.backends if backend.available]
+        if not candidates:
+            raise ProviderException("No healthy Ollama backends.", details={"backends": len(self.backends)})
+
+        breakers = [circuit_breakers.get("ollama", model, backend.url) for backend in candidates]
+        closed = [backend for backend, breaker in zip(candidates, breakers) if breaker.allows()]
+        if not closed:
+            min(breakers, key=lambda breaker: breaker.retry_after()).check()
+        candidates = closed
+
+        model = normalize_model(model)
+        warm = [backend for backend in candidates if model in backend.loaded_models]
+        candidates = warm or candidates
+
+        if self.routing == "p2c" and len(candidates) > 2:
+            candidates = random.sample(candidates, 2)
+        fewest = min(backend.outstanding for backend in candidates)
+        return random.choice([backend for backend in candidates if backend.outstanding == fewest])
+
+    def record_success(self, backend: OllamaBackend, model: Optional[str] = None):
+        backend.consecutive_failures = 0
+        backend.ejected_until = 0.0
+        if model:
+            backend.loaded_models.add(normalize_model(model))
+
+    def record_failure(self, backend: OllamaBackend):
+        backend.consecutive_failures += 1
+        if backend.consecutive_failures >= settings.OLLAMA_EJECT_AFTER_FAILURES:
+            backend.ejected_until = time.monotonic() + settings.OLLAMA_EJECT_SECONDS
+
+    @staticmethod
+    def is_backend_failure(e: Exception) -> bool:
+        if isinstance(e, TimeoutException):
+            return True
+        # Connection failures carry no upstream status; 5xx means the backend itself is unwell.
+        return isinstance(e, ProviderException) and e.details.get("upstream_status", 500) >= 500
+
+    @asynccontextmanager
+    async def backend(self, model: str, timed: bool = True) -> AsyncIterator[OllamaBackend]:
+        backend = self.pick(model)
+        backend.outstanding += 1
+        try:
+            with circuit_breakers.get("ollama", model, backend.url).call(timed):
+                yield backend
+        except Exception as e:
+            if self.is_backend_failure(e):
+                self.record_failure(backend)
+            raise
+        else:
+            self.record_success(backend, model)
+        finally:
+            backend.outstanding -= 1
+
+    async def check(self, backend: OllamaBackend):
+        """
+        Probes `/api/ps`, which also tells us which models are loaded in memory right now.
+        """
+        try:
+            res = await client_pool.http_client(backend.url).get("/api/ps", timeout=settings.OLLAMA_HEALTH_CHECK_TIMEOUT_SECONDS)
+            res.raise_for_status()
+            models = res.json().get("models", [])
+        except Exception:
+            self.record_failure(backend)
+            return
+        backend.loaded_models = {normalize_model(model.get("name") or model.get("model", "")) for model in models}
+        self.record_success(backend)
+
+    async def check_all(self):
+        await asyncio.gather(*(self.check(backend) for backend in self.backends))
+
+    async def _check_forever(self):
+        while True:
+            await self.check_all()
+            await asyncio.sleep(settings.OLLAMA_HEALTH_CHECK_INTERVAL_SECONDS)
+
+    async def start(self):
+        if self._health_task is None and settings.OLLAMA_HEALTH_CHECK_INTERVAL_SECONDS > 0:
+            self._health_task = asyncio.create_task(self._check_forever())
+
+    async def aclose(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+
+    def stats(self) -> dict:
+        return {"routing": self.routing, "backends": [backend.stats() for backend in self.backends]}
+
+
+ollama_pool = OllamaBackendPool()
@@ -1,70 +1,114 @@
 import time
 import httpx
-import json
-from .base import BaseProvider
+from typing import AsyncIterator
+from .base import BaseProvider, StreamChunk
+from .client_pool import client_pool
+from .ollama_pool import ollama_pool
 from ..api.schemas import AgentRunRequest, SuccessResponse, Result, Usage, Billing, Timing
 from ..core.config import settings
+from ..core.errors import BaseGatewayException, ProviderException, TimeoutException, UpstreamRateLimitException
+from ..utils.json_tools import dumps, loads
+
+JSON_HEADERS = {"Content-Type": "application/json"}
 
 class OllamaProvider(BaseProvider):
-    async def invoke(self, request: AgentRunRequest) -> SuccessResponse:
-        async with httpx.AsyncClient() as client:
-            provider_start_time = time.time()
+    breaker_backend = None  # ollama_pool keeps a breaker per backend
 
-            if request.input.messages:
-                messages = [msg.dict() for msg in request.input.messages]
-            else:
-                messages = [
-                    {"role": "system", "content": "You are a helpful assistant."}, 
-                    {"role": "user", "content": f"{request.input.instruction}\n\n{json.dumps(request.input.data) if isinstance(request.input.data, dict) else request.input.data}"}
-                ]
-            
-            response_format = "json" if request.response_format == "json" else ""
+    def _payload(self, request: AgentRunRequest, stream: bool) -> dict:
+        response_format = "json" if request.response_format == "json" else ""
 
-            payload = {
-                "model": request.model,
-                "messages": messages,
-                "stream": False,
-                "format": response_format,
-                "options": {
-                    "temperature": request.temperature,
-                    "top_p": request.top_p,
-                    "stop": request.stop,
-                    "seed": request.seed,
-                }
+        return {
+            "model": request.model,
+            "messages": self.build_messages(request),
+            "stream": stream,
+            "format": response_format,
+            "options": {
+                "temperature": request.temperature,
+                "top_p": request.top_p,
+                "stop": request.stop,
+                "seed": request.seed,
             }
+        }
 
-            res = await client.post(
-                f"{settings.OLLAMA_BASE_URL}/api/chat",
-                json=payload,
-                timeout=request.timeout_seconds or settings.REQUEST_TIMEOUT_SECONDS
-            )
-            res.raise_for_status()
-            ollama_response = res.json()
+    async def invoke(self, request: AgentRunRequest) -> SuccessResponse:
+        provider_start_time = time.time()
+
+        async with ollama_pool.backend(request.model) as backend:
+            client = client_pool.http_client(backend.url)
+            try:
+                res = await client.post(
+                    "/api/chat",
+                    content=dumps(self._payload(request, stream=False)),
+                    headers=JSON_HEADERS,
+                    timeout=request.timeout_seconds or settings.REQUEST_TIMEOUT_SECONDS
+                )
+                res.raise_for_status()
+            except httpx.HTTPError as e:
+                raise self._translate_error(e) from e
+        ollama_response = loads(res.content)
 
-            provider_duration_ms = int((time.time() - provider_start_time) * 1000)
+        provider_duration_ms = int((time.time() - provider_start_time) * 1000)
 
-            usage = self.extract_usage(ollama_response)
+        usage = self.extract_usage(ollama_response)
 
-            if request.response_format == "json":
-                result = Result(type="json", json=json.loads(ollama_response["message"]["content"]))
-            else:
-                result = Result(type="text", text=ollama_response["message"]["content"])
-            
-            # This is a simplified implementation. We'll add billing and other details later.
-            return SuccessResponse(
-                trace_id=request.trace_id,
-                provider=request.provider,
-                model=request.model,
-                result=result,
-                usage=Usage(**usage),
-                billing=Billing(pricing_source="unknown"), # Placeholder
-                timing=Timing(
-                    started_at="", # Placeholder
-                    ended_at="", # Placeholder
-                    duration_ms=0, # Placeholder
-                    provider_duration_ms=provider_duration_ms
-                )
+        if request.response_format == "json":
+            result = self.json_result(ollama_response["message"]["content"])
+        else:
+            result = Result.model_construct(type="text", text=ollama_response["message"]["content"])
+
+        # Built from data we just produced, so skip validation.
+        return SuccessResponse.model_construct(
+            trace_id=request.trace_id,
+            provider=request.provider,
+            model=request.model,
+            result=result,
+            usage=Usage.model_construct(**usage),
+            billing=Billing.model_construct(pricing_source="unknown"), # Placeholder
+            timing=Timing.model_construct(
+                started_at="", # Placeholder
+                ended_at="", # Placeholder
+                duration_ms=0, # Placeholder
+                provider_duration_ms=provider_duration_ms
             )
+        )
+
+    async def stream(self, request: AgentRunRequest) -> AsyncIterator[StreamChunk]:
+        async with ollama_pool.backend(request.model, timed=False) as backend:
+            client = client_pool.http_client(backend.url)
+            try:
+                async with client.stream(
+                    "POST",
+                    "/api/chat",
+                    content=dumps(self._payload(request, stream=True)),
+                    headers=JSON_HEADERS,
+                    timeout=request.timeout_seconds or settings.REQUEST_TIMEOUT_SECONDS
+                ) as res:
+                    res.raise_for_status()
+                    # Ollama streams one JSON object per line; the last one has "done": true and the counters.
+                    async for line in res.aiter_lines():
+                        if not line:
+                            continue
+                        event = loads(line)
+                        delta = event.get("message", {}).get("content", "")
+                        if event.get("done"):
+                            yield StreamChunk(delta=delta, usage=self.extract_usage(event))
+                        elif delta:
+                            yield StreamChunk(delta=delta)
+            except httpx.HTTPError as e:
+                raise self._translate_error(e) from e
+
+    def _translate_error(self, e: httpx.HTTPError) -> BaseGatewayException:
+        if isinstance(e, httpx.TimeoutException):
+            return TimeoutException(f"Ollama request timed out: {e!r}")
+        if isinstance(e, httpx.HTTPStatusError):
+            status = e.response.status_code
+            if status == 429:
+                return UpstreamRateLimitException(
+                    retry_after=self.parse_retry_after(e.response.headers.get("retry-after")),
+                    details={"upstream_status": status},
+                )
+            return ProviderException(f"Ollama returned HTTP {status}.", details={"upstream_status": status})
+        return ProviderException(f"Ollama request failed: {e!r}")
 
     @property
     def supports_json_mode(self) -> bool:
@@ -77,4 +121,4 @@ class OllamaProvider(BaseProvider):
             "output_tokens": response.get("eval_count", 0),
             "total_tokens": response.get("prompt_eval_count", 0) + response.get("eval_count", 0),
             "is_estimated": False,
-        }
\ No newline at end of file
+        }
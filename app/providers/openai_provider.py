@@ -1,28 +1,32 @@
 import time
-from .base import BaseProvider
+from typing import AsyncIterator
+from .base import BaseProvider, StreamChunk
+from .client_pool import client_pool
 from ..api.schemas import AgentRunRequest, SuccessResponse, Result, Usage, Billing, Timing
+from ..core.config import settings
+from ..core.errors import BaseGatewayException, ProviderException, TimeoutException, UpstreamRateLimitException
 from openai import AsyncOpenAI
-import json
+import openai
 
 class OpenAIProvider(BaseProvider):
-    async def invoke(self, request: AgentRunRequest) -> SuccessResponse:
-        client = AsyncOpenAI(api_key=request.auth.key)
-
-        provider_start_time = time.time()
-
-        if request.input.messages:
-            messages = [msg.dict() for msg in request.input.messages]
-        else:
-            messages = [
-                {"role": "system", "content": "You are a helpful assistant."}, 
-                {"role": "user", "content": f"{request.input.instruction}\n\n{json.dumps(request.input.data) if isinstance(request.input.data, dict) else request.input.data}"}
-            ]
+    def _client(self, request: AgentRunRequest) -> AsyncOpenAI:
+        return client_pool.get_client(
+            "openai",
+            settings.OPENAI_BASE_URL,
+            request.auth.key,
+            lambda http_client: AsyncOpenAI(
+                api_key=request.auth.key,
+                base_url=settings.OPENAI_BASE_URL,
+                http_client=http_client,
+                max_retries=0,  # retries are handled by the gateway's call policy
+            ),
+        )
 
+    def _completion_kwargs(self, request: AgentRunRequest) -> dict:
         response_format = {"type": "json_object"} if request.response_format == "json" else {"type": "text"}
-        
-        completion = await client.chat.completions.create(
+        return dict(
             model=request.model,
-            messages=messages,
+            messages=self.build_messages(request),
             temperature=request.temperature,
             max_tokens=request.max_output_tokens,
             top_p=request.top_p,
@@ -31,24 +35,34 @@ class OpenAIProvider(BaseProvider):
             response_format=response_format,
         )
 
+    async def invoke(self, request: AgentRunRequest) -> SuccessResponse:
+        client = self._client(request)
+
+        provider_start_time = time.time()
+
+        try:
+            completion = await client.chat.completions.create(**self._completion_kwargs(request))
+        except openai.APIError as e:
+            raise self._translate_error(e) from e
+
         provider_duration_ms = int((time.time() - provider_start_time) * 1000)
 
         usage = self.extract_usage(completion)
-        
+
         if request.response_format == "json":
-            result = Result(type="json", json=json.loads(completion.choices[0].message.content))
+            result = self.json_result(completion.choices[0].message.content)
         else:
-            result = Result(type="text", text=completion.choices[0].message.content)
-            
-        # This is a simplified implementation. We'll add billing and other details later.
-        return SuccessResponse(
+            result = Result.model_construct(type="text", text=completion.choices[0].message.content)
+
+        # Built from data we just produced, so skip validation.
+        return SuccessResponse.model_construct(
             trace_id=request.trace_id,
             provider=request.provider,
             model=request.model,
             result=result,
-            usage=Usage(**usage, is_estimated=False),
-            billing=Billing(pricing_source="unknown"), # Placeholder
-            timing=Timing(
+            usage=Usage.model_construct(**usage, is_estimated=False),
+            billing=Billing.model_construct(pricing_source="unknown"), # Placeholder
+            timing=Timing.model_construct(
                 started_at="", # Placeholder
                 ended_at="", # Placeholder
                 duration_ms=0, # Placeholder
@@ -56,6 +70,37 @@ class OpenAIProvider(BaseProvider):
             )
         )
 
+    async def stream(self, request: AgentRunRequest) -> AsyncIterator[StreamChunk]:
+        client = self._client(request)
+        try:
+            stream = await client.chat.completions.create(
+                **self._completion_kwargs(request),
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            async with stream:
+                async for chunk in stream:
+                    # With include_usage the last chunk carries usage and no choices.
+                    if chunk.usage is not None:
+                        yield StreamChunk(usage={**self.extract_usage(chunk), "is_estimated": False})
+                    elif chunk.choices and chunk.choices[0].delta.content:
+                        yield StreamChunk(delta=chunk.choices[0].delta.content)
+        except openai.APIError as e:
+            raise self._translate_error(e) from e
+
+    def _translate_error(self, e: openai.APIError) -> BaseGatewayException:
+        if isinstance(e, openai.APITimeoutError):
+            return TimeoutException(f"OpenAI request timed out: {e}")
+        if isinstance(e, openai.RateLimitError):
+            return UpstreamRateLimitException(
+                e.message,
+                retry_after=self.parse_retry_after(e.response.headers.get("retry-after")),
+                details={"upstream_status": e.status_code},
+            )
+        if isinstance(e, openai.APIStatusError):
+            return ProviderException(e.message, details={"upstream_status": e.status_code})
+        return ProviderException(str(e))
+
     @property
     def supports_json_mode(self) -> bool:
         return True
@@ -65,4 +110,5 @@ class OpenAIProvider(BaseProvider):
             "input_tokens": response.usage.prompt_tokens,
             "output_tokens": response.usage.completion_tokens,
             "total_tokens": response.usage.total_tokens,
-        }
\ No newline at end of file
+            "cached_input_tokens": getattr(getattr(response.usage, "prompt_tokens_details", None), "cached_tokens", None) or 0,
+        }
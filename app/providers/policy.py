@@ -0,0 +1,208 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from . import structured
+from .factory import get_provider
+from ..api.schemas import AgentRunRequest, SuccessResponse, Warning
+from ..core.circuit_breaker import circuit_breakers
+from ..core.concurrency import admission
+from ..core.config import settings
+from ..core.errors import (
+    CircuitOpenException, JsonInvalidException, ProviderException, RateLimitException, TimeoutException, UpstreamRateLimitException,
+)
+
+
+class LatencyTracker:
+    """
+    Recent successful upstream latencies per provider/model, for picking hedge delays. Samples
+    are kept for at most `max_keys` (MAX_TRACKED_MODELS) keys; the least recently recorded go first.
+    """
+
+    def __init__(self, window: int = 256, max_keys: Optional[int] = None):
+        self.window = window
+        self.max_keys = max_keys or settings.MAX_TRACKED_MODELS
+        self._samples: Dict[str, Deque[float]] = {}  # least recently recorded first
+
+    def record(self, key: str, seconds: float):
+        samples = self._samples.pop(key, None)
+        if samples is None:
+            while len(self._samples) >= self.max_keys:
+                del self._samples[next(iter(self._samples))]
+            samples = deque(maxlen=self.window)
+        self._samples[key] = samples
+        samples.append(seconds)
+
+    def percentile(self, key: str, q: float, min_samples: int = 1) -> Optional[float]:
+        samples = self._samples.get(key)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+class RetryBudget:
+    """
+    Caps extra upstream calls (retries and hedges) to `ratio` per primary call. Every primary call
+    deposits `ratio` tokens, up to `reserve`, and every extra call spends one.
+    """
+
+    def __init__(self, ratio: float, reserve: float):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.tokens = reserve
+
+    def deposit(self):
+        self.tokens = min(self.reserve, self.tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def is_retryable(e: Exception) -> bool:
+    # Model output is sampled; a retry can produce valid JSON where repair couldn't.
+    if isinstance(e, (UpstreamRateLimitException, TimeoutException, JsonInvalidException)):
+        return True
+    # Connection failures carry no upstream status.
+    return isinstance(e, ProviderException) and e.details.get("upstream_status", 500) >= 500
+
+
+class CallPolicy:
+    """
+    Wraps provider invocation with, in order of escalation:
+
+    1. a per-attempt timeout (`timeout_seconds` or REQUEST_TIMEOUT_SECONDS),
+    2. hedging: if an attempt is slower than the model's HEDGE_PERCENTILE latency, a second identical
+       call is started and the first to succeed wins; the other is cancelled,
+    3. retries of retryable errors with full-jitter exponential backoff,
+    4. the request's fallback targets, tried in order once a target is exhausted or its circuit
+       breaker is open.
+
+    Retries and hedges draw from a shared RetryBudget so they can't multiply upstream spend.
+    """
+
+    def __init__(self, tracker: Optional[LatencyTracker] = None, budget: Optional[RetryBudget] = None):
+        self.tracker = tracker or LatencyTracker()
+        self.budget = budget or RetryBudget(settings.RETRY_BUDGET_RATIO, settings.RETRY_BUDGET_RESERVE)
+
+    async def invoke(self, request: AgentRunRequest) -> SuccessResponse:
+        self.budget.deposit()
+        targets = [request] + [
+            request.model_copy(update={
+                "provider": fallback.provider,
+                "model": fallback.model,
+                "auth": fallback.auth or request.auth,
+            })
+            for fallback in request.fallbacks or []
+        ]
+
+        warnings: List[Warning] = []
+        for index, target in enumerate(targets):
+            try:
+                response, attempts, hedged, waited = await self._call_target(target)
+            except Exception as e:
+                if index + 1 < len(targets) and (is_retryable(e) or isinstance(e, (RateLimitException, CircuitOpenException))):
+                    warnings.append(Warning(
+                        code="FALLBACK",
+                        message=f"{target.provider}/{target.model} failed ({getattr(e, 'code', type(e).__name__)}); falling back.",
+                    ))
+                    continue
+                raise
+
+            if attempts > 1:
+                warnings.append(Warning(code="RETRIED", message=f"Succeeded after {attempts} attempts."))
+            if hedged:
+                warnings.append(Warning(code="HEDGED", message="A hedged duplicate request answered first."))
+            response.timing.queue_wait_ms = int(waited * 1000)
+            response.warnings.extend(warnings)
+            return response
+
+    def _max_attempts(self, request: AgentRunRequest) -> int:
+        retries = settings.RETRY_MAX_RETRIES if request.max_retries is None else request.max_retries
+        return 1 + max(retries, 0)
+
+    def _backoff_seconds(self, attempt: int, e: Exception) -> float:
+        cap = settings.RETRY_BACKOFF_MAX_MS / 1000
+        retry_after = getattr(e, "headers", {}).get("Retry-After")
+        if retry_after is not None and float(retry_after) <= cap:
+            return float(retry_after)
+        return random.uniform(0, min(cap, settings.RETRY_BACKOFF_BASE_MS / 1000 * 2 ** attempt))
+
+    async def _call_target(self, request: AgentRunRequest) -> Tuple[SuccessResponse, int, bool, float]:
+        max_attempts = self._max_attempts(request)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response, hedged, waited = await self._hedged(request)
+                return response, attempt, hedged, waited
+            except Exception as e:
+                if attempt >= max_attempts or not is_retryable(e) or not self.budget.try_withdraw():
+                    raise
+                await asyncio.sleep(self._backoff_seconds(attempt, e))
+
+    def _hedge_delay(self, request: AgentRunRequest) -> Optional[float]:
+        enabled = settings.HEDGE_ENABLED if request.hedge is None else request.hedge
+        if not enabled:
+            return None
+        return self.tracker.percentile(
+            f"{request.provider}:{request.model}", settings.HEDGE_PERCENTILE, settings.HEDGE_MIN_SAMPLES
+        )
+
+    async def _hedged(self, request: AgentRunRequest) -> Tuple[SuccessResponse, bool, float]:
+        delay = self._hedge_delay(request)
+        if delay is None:
+            response, waited = await self._single(request, hedge=False)
+            return response, False, waited
+
+        primary = asyncio.create_task(self._single(request, hedge=False))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self.budget.try_withdraw():
+                tasks.add(asyncio.create_task(self._single(request, hedge=True)))
+
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        response, waited = task.result()
+                        return response, task is not primary, waited
+                    if error is None or task is primary:
+                        error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _single(self, request: AgentRunRequest, hedge: bool) -> Tuple[SuccessResponse, float]:
+        """
+        One upstream call under its circuit breaker, provider/model admission slot and timeout.
+        Hedges never queue: if no slot is free right away, the hedge gives up.
+        """
+        provider = get_provider(request.provider)
+        breaker = circuit_breakers.get(request.provider, request.model, getattr(provider, "breaker_backend", "default"))
+        breaker.check()
+        limiter = admission.limiter(request.provider, request.model)
+        if hedge and not limiter.has_capacity():
+            raise RateLimitException("No capacity for a hedged request.")
+
+        timeout = request.timeout_seconds or settings.REQUEST_TIMEOUT_SECONDS
+        async with admission.upstream(request.provider, request.model) as waited:
+            start = time.monotonic()
+            with breaker.call():
+                try:
+                    response = await asyncio.wait_for(structured.invoke(provider, request), timeout)
+                except asyncio.TimeoutError as e:
+                    raise TimeoutException(f"{request.provider} did not answer within {timeout}s.") from e
+            self.tracker.record(f"{request.provider}:{request.model}", time.monotonic() - start)
+        return response, waited
+
+
+call_policy = CallPolicy()
@@ -0,0 +1,106 @@
+import time
+from contextlib import aclosing
+from typing import Optional
+
+from .base import BaseProvider
+from ..api.schemas import AgentRunRequest, SuccessResponse, Result, Usage, Billing, Timing, Warning
+from ..core.config import settings
+from ..core.errors import JsonInvalidException, ValidationException
+from ..utils.json_schema import Node, SchemaError, SchemaViolation, StreamValidator, compile_schema, repair_json
+
+
+def request_schema(request: AgentRunRequest) -> Optional[Node]:
+    """
+    The compiled json_schema of a JSON-format request, if it has one. Raises ValidationException
+    for schemas that don't compile, before anything is sent upstream.
+    """
+    if request.response_format != "json" or not request.json_schema:
+        return None
+    try:
+        return compile_schema(request.json_schema)
+    except SchemaError as e:
+        raise ValidationException(f"Invalid json_schema: {e}") from e
+
+
+async def invoke(provider: BaseProvider, request: AgentRunRequest) -> SuccessResponse:
+    """
+    Invokes the provider and, for response_format "json", enforces the result: it must parse
+    (after a local repair pass) and match json_schema. strict_json requests with a schema are
+    streamed so the call is cut off at the first token that makes a match impossible.
+    """
+    if request.response_format != "json":
+        return await provider.invoke(request)
+    schema = request_schema(request)
+    if schema is not None and request.strict_json and settings.JSON_STREAM_VALIDATION:
+        response = await _invoke_streaming(provider, request, schema)
+    else:
+        response = await provider.invoke(request)
+    return enforce_json(request, response, schema)
+
+
+async def _invoke_streaming(provider: BaseProvider, request: AgentRunRequest, schema: Node) -> SuccessResponse:
+    validator = StreamValidator(schema)
+    parts = []
+    usage = None
+    provider_start_time = time.time()
+    # Closing the stream early closes the upstream connection, which stops generation.
+    async with aclosing(provider.stream(request)) as stream:
+        async for chunk in stream:
+            if chunk.delta:
+                parts.append(chunk.delta)
+                try:
+                    validator.feed(chunk.delta)
+                except SchemaViolation as e:
+                    raise JsonInvalidException(
+                        "Output stopped matching json_schema; the upstream call was cut off.",
+                        details={"errors": [str(e)], "aborted_after_chars": validator.chars},
+                    ) from None
+            if chunk.usage is not None:
+                usage = chunk.usage
+
+    return SuccessResponse.model_construct(
+        trace_id=request.trace_id,
+        provider=request.provider,
+        model=request.model,
+        result=provider.json_result("".join(parts)),
+        usage=Usage.model_construct(**usage) if usage is not None else None,
+        billing=Billing.model_construct(pricing_source="unknown"),
+        timing=Timing.model_construct(
+            started_at="",
+            ended_at="",
+            duration_ms=0,
+            provider_duration_ms=int((time.time() - provider_start_time) * 1000),
+        ),
+    )
+
+
+def enforce_json(request: AgentRunRequest, response: SuccessResponse, schema: Optional[Node]) -> SuccessResponse:
+    """
+    Repairs unparsable output and checks it against the schema. With strict_json a failure raises
+    JsonInvalidException (which the call policy may retry); otherwise it is reported as a warning
+    and the result is returned as it is.
+    """
+    result = response.result
+    value, fixes = result.json, []
+    if value is None:
+        try:
+            value, fixes = repair_json(result.text or "")
+        except ValueError:
+            return _reject(request, response, "Output is not valid JSON.", [])
+        if not isinstance(value, dict):
+            return _reject(request, response, "Output is not a JSON object.", [])
+        response.result = Result.model_construct(type="json", json=value)
+        if fixes:
+            response.warnings.append(Warning(code="JSON_REPAIRED", message=f"Repaired model output: {', '.join(fixes)}."))
+
+    errors = schema.validate(value) if schema is not None else []
+    if errors:
+        return _reject(request, response, "Output does not match json_schema.", errors)
+    return response
+
+
+def _reject(request: AgentRunRequest, response: SuccessResponse, message: str, errors: list) -> SuccessResponse:
+    if request.strict_json:
+        raise JsonInvalidException(message, details={"errors": errors} if errors else None)
+    response.warnings.append(Warning(code="JSON_INVALID", message=" ".join([message, *errors[:3]])))
+    return response
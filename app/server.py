@@ -0,0 +1,50 @@
+"""
+Runs the gateway, with WORKERS preforked worker processes when it is more than one.
+
+    python -m app.server
+
+uvicorn picks uvloop and httptools when they are installed (they come with uvicorn[standard]).
+Workers share their admission state through a memory-mapped file (see SharedState), so
+MAX_CONCURRENCY and the provider limits hold for the whole server, not per worker. Prometheus
+metrics go to a shared multiprocess directory and /metrics aggregates them.
+"""
+import os
+import shutil
+import tempfile
+
+import uvicorn
+
+from .core.config import settings
+
+
+def worker_count() -> int:
+    return settings.WORKERS if settings.WORKERS > 0 else os.cpu_count() or 1
+
+
+def main():
+    workers = worker_count()
+    state_dir = None
+    if workers > 1:
+        # Workers are spawned, and read these from the environment before importing the app.
+        state_dir = tempfile.mkdtemp(prefix="gateway-")
+        os.environ["SHARED_STATE_PATH"] = os.path.join(state_dir, "shared_state")
+        if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+            os.makedirs(os.path.join(state_dir, "metrics"))
+            os.environ["PROMETHEUS_MULTIPROC_DIR"] = os.path.join(state_dir, "metrics")
+    try:
+        uvicorn.run(
+            "app.main:app",
+            host=settings.HOST,
+            port=settings.PORT,
+            workers=workers,
+            loop="auto",
+            http="auto",
+            log_level=settings.LOG_LEVEL.lower(),
+        )
+    finally:
+        if state_dir is not None:
+            shutil.rmtree(state_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
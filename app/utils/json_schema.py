@@ -0,0 +1,647 @@
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..core.config import settings
+from .json_tools import canonical_hash, loads
+
+TYPES = {"object", "array", "string", "number", "integer", "boolean", "null"}
+# The type a value starting with this character will have ("number" also covers "integer").
+START_TYPES = {"{": "object", "[": "array", '"': "string", "t": "boolean", "f": "boolean", "n": "null"}
+START_TYPES.update({c: "number" for c in "-0123456789"})
+MAX_ERRORS = 10
+MAX_PREAMBLE_CHARS = 256  # prose before the JSON that repair would still cut off
+
+
+class SchemaError(ValueError):
+    pass
+
+
+class SchemaViolation(ValueError):
+    def __init__(self, message: str, path: str):
+        super().__init__(f"{path}: {message}")
+        self.path = path
+
+
+def json_type(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, float):
+        return "integer" if value.is_integer() else "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, list):
+        return "array"
+    if isinstance(value, dict):
+        return "object"
+    return type(value).__name__
+
+
+class Node:
+    """
+    One compiled (sub)schema. Keywords are unpacked into attributes once, so validating is a few
+    attribute checks per value. Unknown keywords (format, title, ...) are ignored, as JSON Schema allows.
+    """
+
+    def __init__(self):
+        self.always_false = False
+        self.types: Optional[frozenset] = None
+        self.enum: Optional[list] = None
+        self.const: Any = None
+        self.has_const = False
+        self.properties: Dict[str, "Node"] = {}
+        self.pattern_properties: List[Tuple[re.Pattern, "Node"]] = []
+        self.additional: Optional["Node"] = None  # None: anything allowed
+        self.no_additional = False
+        self.required: Tuple[str, ...] = ()
+        self.min_properties: Optional[int] = None
+        self.max_properties: Optional[int] = None
+        self.items: Optional["Node"] = None
+        self.prefix_items: List["Node"] = []
+        self.min_items: Optional[int] = None
+        self.max_items: Optional[int] = None
+        self.unique_items = False
+        self.min_length: Optional[int] = None
+        self.max_length: Optional[int] = None
+        self.pattern: Optional[re.Pattern] = None
+        self.minimum = self.maximum = self.exclusive_minimum = self.exclusive_maximum = self.multiple_of = None
+        self.all_of: List["Node"] = []
+        self.any_of: List["Node"] = []
+        self.one_of: List["Node"] = []
+        self.not_: Optional["Node"] = None
+        self.ref: Optional[str] = None
+        self.refs: Dict[str, "Node"] = {}
+
+    @property
+    def target(self) -> "Node":
+        node = self
+        while node.ref is not None:
+            node = node.refs[node.ref]
+        return node
+
+    @property
+    def opaque(self) -> bool:
+        """
+        Whether the node's combinators need the whole value; streaming checks stop at such nodes.
+        """
+        node = self.target
+        return bool(node.all_of or node.any_of or node.one_of or node.not_ is not None)
+
+    def allows_type(self, kind: str) -> bool:
+        node = self.target
+        if node.always_false:
+            return False
+        if node.types is None:
+            return True
+        return kind in node.types or (kind == "number" and "integer" in node.types)
+
+    def child(self, key: str) -> Optional["Node"]:
+        """
+        The schema of property `key`, or None if the property is not allowed.
+        """
+        node = self.target
+        if key in node.properties:
+            return node.properties[key]
+        for pattern, child in node.pattern_properties:
+            if pattern.search(key):
+                return child
+        if node.no_additional:
+            return None
+        return node.additional or ANY
+
+    def item(self, index: int) -> "Node":
+        node = self.target
+        if index < len(node.prefix_items):
+            return node.prefix_items[index]
+        return node.items or ANY
+
+    def validate(self, value: Any, path: str = "$", errors: Optional[List[str]] = None) -> List[str]:
+        if errors is None:
+            errors = []
+        if len(errors) >= MAX_ERRORS:
+            return errors
+        node = self.target
+        if node.always_false:
+            errors.append(f"{path}: no value is allowed here")
+            return errors
+
+        kind = json_type(value)
+        if node.types is not None and not (kind in node.types or (kind == "integer" and "number" in node.types)):
+            errors.append(f"{path}: expected {' or '.join(sorted(node.types))}, got {kind}")
+            return errors
+        if node.enum is not None and not any(_equal(value, option) for option in node.enum):
+            errors.append(f"{path}: {value!r} is not one of {node.enum!r}")
+        if node.has_const and not _equal(value, node.const):
+            errors.append(f"{path}: expected {node.const!r}")
+
+        if kind == "object":
+            node._validate_object(value, path, errors)
+        elif kind == "array":
+            node._validate_array(value, path, errors)
+        elif kind == "string":
+            node._validate_string(value, path, errors)
+        elif kind in ("number", "integer"):
+            node._validate_number(value, path, errors)
+
+        for sub in node.all_of:
+            sub.validate(value, path, errors)
+        if node.any_of and not any(not sub.validate(value, path) for sub in node.any_of):
+            errors.append(f"{path}: matches none of anyOf")
+        if node.one_of:
+            matches = sum(1 for sub in node.one_of if not sub.validate(value, path))
+            if matches != 1:
+                errors.append(f"{path}: matches {matches} of oneOf, expected exactly 1")
+        if node.not_ is not None and not node.not_.validate(value, path):
+            errors.append(f"{path}: matches a schema it must not")
+        return errors
+
+    def _validate_object(self, value: dict, path: str, errors: List[str]):
+        for key in self.required:
+            if key not in value:
+                errors.append(f"{path}: missing required property {key!r}")
+        if self.min_properties is not None and len(value) < self.min_properties:
+            errors.append(f"{path}: expected at least {self.min_properties} properties")
+        if self.max_properties is not None and len(value) > self.max_properties:
+            errors.append(f"{path}: expected at most {self.max_properties} properties")
+        for key, item in value.items():
+            child = self.child(key)
+            if child is None:
+                errors.append(f"{path}: unexpected property {key!r}")
+            elif child is not ANY:
+                child.validate(item, f"{path}.{key}", errors)
+
+    def _validate_array(self, value: list, path: str, errors: List[str]):
+        if self.min_items is not None and len(value) < self.min_items:
+            errors.append(f"{path}: expected at least {self.min_items} items")
+        if self.max_items is not None and len(value) > self.max_items:
+            errors.append(f"{path}: expected at most {self.max_items} items")
+        if self.unique_items:
+            seen = []
+            for item in value:
+                if any(_equal(item, other) for other in seen):
+                    errors.append(f"{path}: items are not unique")
+                    break
+                seen.append(item)
+        for index, item in enumerate(value):
+            child = self.item(index)
+            if child is not ANY:
+                child.validate(item, f"{path}[{index}]", errors)
+
+    def _validate_string(self, value: str, path: str, errors: List[str]):
+        if self.min_length is not None and len(value) < self.min_length:
+            errors.append(f"{path}: shorter than {self.min_length} characters")
+        if self.max_length is not None and len(value) > self.max_length:
+            errors.append(f"{path}: longer than {self.max_length} characters")
+        if self.pattern is not None and not self.pattern.search(value):
+            errors.append(f"{path}: does not match {self.pattern.pattern!r}")
+
+    def _validate_number(self, value, path: str, errors: List[str]):
+        if self.minimum is not None and value < self.minimum:
+            errors.append(f"{path}: less than {self.minimum}")
+        if self.maximum is not None and value > self.maximum:
+            errors.append(f"{path}: greater than {self.maximum}")
+        if self.exclusive_minimum is not None and value <= self.exclusive_minimum:
+            errors.append(f"{path}: not greater than {self.exclusive_minimum}")
+        if self.exclusive_maximum is not None and value >= self.exclusive_maximum:
+            errors.append(f"{path}: not less than {self.exclusive_maximum}")
+        if self.multiple_of is not None and (value / self.multiple_of) % 1:
+            errors.append(f"{path}: not a multiple of {self.multiple_of}")
+
+
+ANY = Node()
+
+
+def _equal(a: Any, b: Any) -> bool:
+    # JSON equality: true is not 1.
+    return type(a) is type(b) and a == b if isinstance(a, bool) or isinstance(b, bool) else a == b
+
+
+def _compile(schema: Any, refs: Dict[str, Node], root: Any) -> Node:
+    if schema is True or schema == {}:
+        return ANY
+    node = Node()
+    node.refs = refs
+    if schema is False:
+        node.always_false = True
+        return node
+    if not isinstance(schema, dict):
+        raise SchemaError(f"A schema must be an object or a boolean, got {json_type(schema)}.")
+
+    def sub(value) -> Node:
+        return _compile(value, refs, root)
+
+    ref = schema.get("$ref")
+    if ref is not None:
+        if not isinstance(ref, str) or not ref.startswith("#"):
+            raise SchemaError(f"Only local $refs are supported, got {ref!r}.")
+        if ref not in refs:
+            refs[ref] = ANY  # placeholder while compiling, for recursive schemas
+            refs[ref] = sub(_resolve_pointer(root, ref))
+        node.ref = ref
+        return node
+
+    types = schema.get("type")
+    if types is not None:
+        types = [types] if isinstance(types, str) else types
+        unknown = set(types) - TYPES
+        if unknown:
+            raise SchemaError(f"Unknown type(s): {', '.join(sorted(map(str, unknown)))}.")
+        node.types = frozenset(types)
+    if "enum" in schema:
+        node.enum = list(schema["enum"])
+    if "const" in schema:
+        node.const, node.has_const = schema["const"], True
+
+    node.properties = {key: sub(value) for key, value in (schema.get("properties") or {}).items()}
+    try:
+        node.pattern_properties = [(re.compile(key), sub(value)) for key, value in (schema.get("patternProperties") or {}).items()]
+        node.pattern = re.compile(schema["pattern"]) if "pattern" in schema else None
+    except re.error as e:
+        raise SchemaError(f"Invalid pattern: {e}.") from e
+    additional = schema.get("additionalProperties")
+    if additional is False:
+        node.no_additional = True
+    elif additional not in (None, True):
+        node.additional = sub(additional)
+    node.required = tuple(schema.get("required") or ())
+    node.min_properties = schema.get("minProperties")
+    node.max_properties = schema.get("maxProperties")
+
+    items = schema.get("items")
+    if isinstance(items, list):  # draft 4-7 tuple form
+        node.prefix_items = [sub(item) for item in items]
+        extra = schema.get("additionalItems")
+        node.items = sub(extra) if extra is not None else None
+    else:
+        node.prefix_items = [sub(item) for item in schema.get("prefixItems") or ()]
+        node.items = sub(items) if items is not None else None
+    node.min_items = schema.get("minItems")
+    node.max_items = schema.get("maxItems")
+    node.unique_items = bool(schema.get("uniqueItems"))
+
+    node.min_length = schema.get("minLength")
+    node.max_length = schema.get("maxLength")
+    node.minimum = schema.get("minimum")
+    node.maximum = schema.get("maximum")
+    # Draft 4 spells exclusive bounds as booleans next to minimum/maximum.
+    for key, bound in (("exclusiveMinimum", "minimum"), ("exclusiveMaximum", "maximum")):
+        value = schema.get(key)
+        if value is True:
+            setattr(node, f"exclusive_{bound}", getattr(node, bound))
+            setattr(node, bound, None)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            setattr(node, f"exclusive_{bound}", value)
+    node.multiple_of = schema.get("multipleOf")
+
+    node.all_of = [sub(value) for value in schema.get("allOf") or ()]
+    node.any_of = [sub(value) for value in schema.get("anyOf") or ()]
+    node.one_of = [sub(value) for value in schema.get("oneOf") or ()]
+    node.not_ = sub(schema["not"]) if "not" in schema else None
+    return node
+
+
+def _resolve_pointer(root: Any, ref: str) -> Any:
+    target = root
+    for part in ref.lstrip("#").split("/")[1:] if ref != "#" else ():
+        part = part.replace("~1", "/").replace("~0", "~")
+        try:
+            target = target[int(part)] if isinstance(target, list) else target[part]
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise SchemaError(f"Unresolvable $ref {ref!r}.") from None
+    return target
+
+
+class SchemaCache:
+    """
+    Compiled schemas by content hash (LRU). Callers tend to send the same few schemas, so most
+    requests skip compiling.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Node]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, schema: Dict[str, Any]) -> Node:
+        key = canonical_hash(schema)
+        node = self._entries.get(key)
+        if node is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return node
+        self.misses += 1
+        node = _compile(schema, {}, schema)
+        self._entries[key] = node
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return node
+
+
+schema_cache = SchemaCache(settings.JSON_SCHEMA_CACHE_SIZE)
+
+
+def compile_schema(schema: Dict[str, Any]) -> Node:
+    return schema_cache.get(schema)
+
+
+# Incremental validation
+
+class _Frame:
+    __slots__ = ("kind", "node", "path", "state", "keys", "key", "count")
+
+    def __init__(self, kind: str, node: Optional[Node], path: str):
+        self.kind = kind
+        self.node = node  # None below an opaque node: syntax is still checked, the schema isn't
+        self.path = path
+        self.state = "first"  # first | key | colon | value | comma
+        self.keys = set()
+        self.key: Optional[str] = None
+        self.count = 0
+
+
+_STRING_RUN = re.compile(r'[^"\\]+')
+_SCALAR_RUN = re.compile(r"[0-9A-Za-z+\-.]+")
+
+
+class StreamValidator:
+    """
+    Validates JSON text against a compiled schema as it arrives, and raises SchemaViolation as soon
+    as no continuation could be valid: a value of the wrong type starts, a property the schema
+    forbids appears, an object closes without its required properties, a scalar breaks its
+    constraints, or the text stops being JSON.
+
+    It accepts what `repair_json` can fix (a code fence or short preamble before the value,
+    anything after it, trailing commas), so it never aborts output that repair would save.
+    Checks stop below anyOf/oneOf/allOf/not, which need the whole value; `close` is followed by a
+    full validation anyway.
+    """
+
+    def __init__(self, schema: Node):
+        self.schema = schema
+        self.chars = 0
+        self.done = False
+        self._stack: List[_Frame] = []
+        self._started = False
+        self._preamble = 0
+        self._in_fence_line = False
+        self._string: Optional[List[str]] = None  # pieces of the string being read
+        self._escape = False
+        self._scalar: Optional[List[str]] = None
+        self._value_node: Optional[Node] = None  # schema of the string/scalar being read
+        self._value_path = "$"
+        self._string_is_key = False
+
+    def feed(self, text: str):
+        self.chars += len(text)
+        i, n = 0, len(text)
+        while i < n and not self.done:
+            if self._string is not None:
+                i = self._read_string(text, i)
+                continue
+            if self._scalar is not None:
+                match = _SCALAR_RUN.match(text, i)
+                if match:
+                    self._scalar.append(match.group())
+                    i = match.end()
+                    continue
+                self._end_scalar()
+                continue
+            c = text[i]
+            i += 1
+            if not self._started:
+                self._before_root(c)
+            elif c in " \t\r\n":
+                continue
+            else:
+                self._structural(c)
+
+    def _fail(self, message: str, path: str):
+        raise SchemaViolation(message, path)
+
+    def _before_root(self, c: str):
+        if self._in_fence_line:
+            self._in_fence_line = c != "\n"
+            return
+        if c in " \t\r\n":
+            return
+        if c == "`":
+            self._in_fence_line = True
+            return
+        # Like repair_json, only an object or array is looked for past a preamble; a scalar root
+        # must come first, so the "t" of "the" or a digit in the prose doesn't start one.
+        if c in "{[" or (c in START_TYPES and not self._preamble and self.schema.allows_type(START_TYPES[c])):
+            self._started = True
+            self._begin_value(c, self.schema, "$")
+            return
+        self._preamble += 1
+        if self._preamble > MAX_PREAMBLE_CHARS or not (self.schema.allows_type("object") or self.schema.allows_type("array")):
+            self._fail("output does not start with JSON", "$")
+
+    def _begin_value(self, c: str, node: Optional[Node], path: str):
+        kind = START_TYPES.get(c)
+        if kind is None:
+            self._fail(f"unexpected character {c!r}", path)
+        if node is not None and not node.allows_type(kind):
+            self._fail(f"a {kind} is not allowed here", path)
+        if node is not None and node.opaque:
+            node = None
+        if kind in ("object", "array"):
+            self._stack.append(_Frame(kind, node, path))
+        elif kind == "string":
+            self._string, self._escape, self._string_is_key = [], False, False
+            self._value_node, self._value_path = node, path
+        else:
+            self._scalar = [c]
+            self._value_node, self._value_path = node, path
+
+    def _read_string(self, text: str, i: int) -> int:
+        if self._escape:
+            self._string.append(text[i])
+            self._escape = False
+            return i + 1
+        match = _STRING_RUN.match(text, i)
+        if match:
+            self._string.append(match.group())
+            return match.end()
+        c = text[i]
+        if c == "\\":
+            self._string.append(c)
+            self._escape = True
+            return i + 1
+        raw = "".join(self._string)
+        self._string = None
+        try:
+            value = loads(f'"{raw}"')
+        except ValueError:
+            self._fail("invalid string", self._value_path)
+        if self._string_is_key:
+            self._end_key(value)
+        else:
+            self._end_value(value)
+        return i + 1
+
+    def _end_scalar(self):
+        raw = "".join(self._scalar)
+        self._scalar = None
+        try:
+            value = loads(raw)
+        except ValueError:
+            self._fail(f"invalid literal {raw!r}", self._value_path)
+        if isinstance(value, (dict, list, str)):
+            self._fail(f"invalid literal {raw!r}", self._value_path)
+        self._end_value(value)
+
+    def _end_value(self, value: Any):
+        node = self._value_node
+        if node is not None and node is not ANY:
+            errors = node.validate(value, self._value_path)
+            if errors:
+                raise SchemaViolation(errors[0].split(": ", 1)[-1], self._value_path)
+        self._value_done()
+
+    def _value_done(self):
+        if not self._stack:
+            self.done = True
+            return
+        frame = self._stack[-1]
+        frame.state = "comma"
+        frame.count += frame.kind == "array"
+
+    def _end_key(self, key: str):
+        frame = self._stack[-1]
+        frame.key = key
+        frame.keys.add(key)
+        frame.state = "colon"
+        if frame.node is not None and frame.node.child(key) is None:
+            self._fail(f"unexpected property {key!r}", frame.path)
+        node = frame.node
+        max_properties = node.target.max_properties if node is not None else None
+        if max_properties is not None and len(frame.keys) > max_properties:
+            self._fail(f"expected at most {max_properties} properties", frame.path)
+
+    def _close(self, frame: _Frame):
+        self._stack.pop()
+        node = frame.node.target if frame.node is not None else None
+        if node is not None:
+            if frame.kind == "object":
+                missing = [key for key in node.required if key not in frame.keys]
+                if missing:
+                    self._fail(f"missing required property {missing[0]!r}", frame.path)
+                if node.min_properties is not None and len(frame.keys) < node.min_properties:
+                    self._fail(f"expected at least {node.min_properties} properties", frame.path)
+            elif node.min_items is not None and frame.count < node.min_items:
+                self._fail(f"expected at least {node.min_items} items", frame.path)
+        self._value_done()
+
+    def _structural(self, c: str):
+        frame = self._stack[-1]
+        if frame.kind == "object":
+            if frame.state in ("first", "key") and c == '"':
+                self._string, self._escape, self._string_is_key = [], False, True
+                self._value_path = frame.path
+            elif frame.state in ("first", "key") and c == "}":
+                # "key" here is a trailing comma, which repair removes
+                self._close(frame)
+            elif frame.state == "colon" and c == ":":
+                frame.state = "value"
+            elif frame.state == "value":
+                child = frame.node.child(frame.key) if frame.node is not None else None
+                self._begin_value(c, child, f"{frame.path}.{frame.key}")
+            elif frame.state == "comma" and c == ",":
+                frame.state = "key"
+            elif frame.state == "comma" and c == "}":
+                self._close(frame)
+            else:
+                self._fail(f"unexpected character {c!r}", frame.path)
+        else:
+            if frame.state in ("first", "value") and c == "]":
+                self._close(frame)
+            elif frame.state in ("first", "value"):
+                node = frame.node
+                if node is not None and node.target.max_items is not None and frame.count >= node.target.max_items:
+                    self._fail(f"expected at most {node.target.max_items} items", frame.path)
+                child = node.item(frame.count) if node is not None else None
+                self._begin_value(c, child, f"{frame.path}[{frame.count}]")
+            elif frame.state == "comma" and c == ",":
+                frame.state = "value"
+            elif frame.state == "comma" and c == "]":
+                self._close(frame)
+            else:
+                self._fail(f"unexpected character {c!r}", frame.path)
+
+    def close(self):
+        """
+        Ends the input; a number at the very end of the text is only complete now.
+        """
+        if self._scalar is not None and not self._stack:
+            self._end_scalar()
+
+
+# Repair
+
+_FENCE = re.compile(r"^\s*```[\w-]*[ \t]*\n?(.*?)\n?\s*```\s*$", re.DOTALL)
+
+
+def _strip_trailing_commas(text: str) -> str:
+    out = []
+    in_string = escape = False
+    pending_comma = -1
+    for c in text:
+        if in_string:
+            out.append(c)
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+            continue
+        if c in "}]" and pending_comma >= 0:
+            del out[pending_comma]
+        if not c.isspace():
+            pending_comma = -1
+        if c == ",":
+            pending_comma = len(out)
+        elif c == '"':
+            in_string = True
+        out.append(c)
+    return "".join(out)
+
+
+def repair_json(text: str) -> Tuple[Any, List[str]]:
+    """
+    Parses model output as JSON, fixing the defects models commonly produce: a markdown code
+    fence, prose around the JSON, and trailing commas. Returns the value and the fixes applied,
+    or raises ValueError if the text can't be saved.
+    """
+    fixes = []
+    text = text.strip().lstrip("﻿")
+    try:
+        return loads(text), fixes
+    except ValueError:
+        pass
+
+    fence = _FENCE.match(text)
+    if fence:
+        text = fence.group(1).strip()
+        fixes.append("code_fence")
+    else:
+        starts = [index for index in (text.find("{"), text.find("[")) if index >= 0]
+        end = max(text.rfind("}"), text.rfind("]"))
+        if starts and end > min(starts) and (min(starts) > 0 or end < len(text) - 1):
+            text = text[min(starts):end + 1]
+            fixes.append("surrounding_text")
+    try:
+        return loads(text), fixes
+    except ValueError:
+        pass
+
+    fixed = _strip_trailing_commas(text)
+    if fixed != text:
+        fixes.append("trailing_commas")
+    return loads(fixed), fixes
@@ -0,0 +1,69 @@
+import hashlib
+from typing import Any, Union
+
+import orjson
+from fastapi import Request
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+from starlette.responses import Response
+
+
+def dumps(data: Any) -> bytes:
+    """
+    Compact UTF-8 JSON. Anything orjson can't serialize natively falls back to `str`.
+    """
+    return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    return orjson.loads(data)
+
+
+def canonical_json(data: Any) -> bytes:
+    """
+    Serializes `data` deterministically (sorted keys, no whitespace) so equal values hash equally.
+    """
+    return orjson.dumps(data, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+
+
+def canonical_hash(data: Any) -> str:
+    return hashlib.sha256(canonical_json(data)).hexdigest()
+
+
+def model_json(model: BaseModel) -> bytes:
+    """
+    Serializes a model we built ourselves straight to JSON bytes, without validating it again.
+    """
+    return model.__pydantic_serializer__.to_json(model)
+
+
+class ModelResponse(Response):
+    """
+    A JSON response for a pydantic model. Routes return it instead of the model so FastAPI skips
+    re-validating the response against `response_model` and the `jsonable_encoder` pass.
+    """
+    media_type = "application/json"
+
+    def render(self, content: BaseModel) -> bytes:
+        return model_json(content)
+
+
+class FastJSONRequest(Request):
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = loads(await self.body())
+        return self._json
+
+
+class FastJSONRoute(APIRoute):
+    """
+    Parses JSON request bodies with orjson before FastAPI validates them into the body model.
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            return await handler(FastJSONRequest(request.scope, request.receive))
+
+        return route_handler
@@ -1,21 +1,132 @@
+import asyncio
 import json
+import os
+import tempfile
+from typing import Dict, Iterable, Optional, Tuple
 
-def estimate_tokens(data: any) -> int:
+# Starting chars-per-token ratios before any calibration. JSON and code tokenize denser than prose.
+DEFAULT_RATIOS = {"prose": 4.0, "json": 3.0, "code": 3.3}
+
+# Role markers and separators each message costs on top of its content.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def classify(text: str) -> str:
+    """
+    Cheap content-type guess from a short prefix: "json", "code" or "prose".
     """
-    A very rough heuristic to estimate the number of tokens.
-    A common rule of thumb is 1 token ~ 4 characters for English text.
-    For JSON, we can just count characters as a rough proxy.
+    head = text[:256].lstrip()
+    if not head:
+        return "prose"
+    if head[0] in "{[" or "```json" in head:
+        return "json"
+    if "```" in head:
+        return "code"
+    symbols = sum(1 for char in head if char in "{}[]();=<>")
+    return "code" if symbols * 12 > len(head) else "prose"
+
+
+class TokenEstimator:
     """
-    if not data:
-        return 0
-    
-    text = ""
-    if isinstance(data, dict):
-        text = json.dumps(data)
-    elif isinstance(data, str):
-        text = data
-    else:
-        text = str(data)
-
-    # 1 token ~= 4 chars
-    return len(text) // 4
+    Estimates token counts from character counts with chars-per-token ratios learned online per
+    provider/model and content type, from the exact counts providers report.
+
+    Ratios are looked up from the most specific level that has been calibrated:
+    (provider, model), then (provider, *), then (*, *), then DEFAULT_RATIOS.
+    """
+
+    def __init__(self, learning_rate: float = 0.1):
+        self.learning_rate = learning_rate
+        self._ratios: Dict[Tuple[str, str, str], float] = {}
+        self.observations = 0
+        self._dirty = False
+
+    def ratio(self, provider: str, model: str, content_type: str) -> float:
+        for key in ((provider, model, content_type), (provider, "*", content_type), ("*", "*", content_type)):
+            ratio = self._ratios.get(key)
+            if ratio is not None:
+                return ratio
+        return DEFAULT_RATIOS[content_type]
+
+    def estimate_text(self, text: str, provider: str = "*", model: str = "*", content_type: Optional[str] = None) -> int:
+        if not text:
+            return 0
+        return round(len(text) / self.ratio(provider, model, content_type or classify(text)))
+
+    def estimate_chars(self, chars: int, content_type: str, provider: str = "*", model: str = "*") -> int:
+        return round(chars / self.ratio(provider, model, content_type))
+
+    @staticmethod
+    def _chars_by_type(messages: Iterable) -> Tuple[Dict[str, int], int]:
+        chars = {content_type: 0 for content_type in DEFAULT_RATIOS}
+        count = 0
+        for message in messages:
+            content = message["content"] if isinstance(message, dict) else message.content
+            if content:
+                chars[classify(content)] += len(content)
+            count += 1
+        return chars, count
+
+    def estimate_messages(self, messages: Iterable, provider: str = "*", model: str = "*") -> int:
+        """
+        Estimates prompt tokens straight from message contents, without serializing anything.
+        """
+        chars, count = self._chars_by_type(messages)
+        return round(
+            sum(n / self.ratio(provider, model, content_type) for content_type, n in chars.items() if n)
+            + count * MESSAGE_OVERHEAD_TOKENS
+        )
+
+    def _learn(self, provider: str, model: str, chars: Dict[str, int], overhead_tokens: int, actual_tokens: int):
+        total_chars = sum(chars.values())
+        if total_chars < 32 or actual_tokens <= overhead_tokens:
+            return  # too little signal
+        predicted = sum(n / self.ratio(provider, model, content_type) for content_type, n in chars.items() if n)
+        # >1 means we over-estimated tokens, i.e. the ratios are too small.
+        factor = predicted / (actual_tokens - overhead_tokens)
+        for content_type, n in chars.items():
+            if not n:
+                continue
+            step = self.learning_rate * n / total_chars
+            for key in ((provider, model, content_type), (provider, "*", content_type), ("*", "*", content_type)):
+                current = self._ratios.get(key, self.ratio(*key))
+                self._ratios[key] = current + step * (current * factor - current)
+        self.observations += 1
+        self._dirty = True
+
+    def observe_messages(self, provider: str, model: str, messages: Iterable, input_tokens: int):
+        chars, count = self._chars_by_type(messages)
+        self._learn(provider, model, chars, count * MESSAGE_OVERHEAD_TOKENS, input_tokens)
+
+    def observe_output(self, provider: str, model: str, chars: int, content_type: str, output_tokens: int):
+        self._learn(provider, model, {content_type: chars}, 0, output_tokens)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"|".join(key): round(ratio, 4) for key, ratio in self._ratios.items()}
+
+    def load(self, path: str):
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        for key, ratio in data.items():
+            parts = tuple(key.split("|"))
+            if len(parts) == 3 and parts[2] in DEFAULT_RATIOS and ratio > 0:
+                self._ratios[parts] = float(ratio)
+
+    def save(self, path: str):
+        if not self._dirty:
+            return
+        directory = os.path.dirname(os.path.abspath(path))
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False, encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(f.name, path)
+        self._dirty = False
+
+    async def save_periodically(self, path: str, interval_seconds: float):
+        while True:
+            await asyncio.sleep(interval_seconds)
+            await asyncio.to_thread(self.save, path)
+
+
+token_estimator = TokenEstimator()
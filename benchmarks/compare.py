@@ -0,0 +1,57 @@
+"""
+Compares two benchmark result files scenario by scenario:
+
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import Optional
+
+# (label, path into a scenario result, True if higher is better)
+METRICS = [
+    ("rps", ("summary", "rps"), True),
+    ("overhead p50 ms", ("summary", "overhead_ms", "p50"), False),
+    ("overhead p99 ms", ("summary", "overhead_ms", "p99"), False),
+    ("latency p99 ms", ("summary", "latency_ms", "p99"), False),
+    ("rps per core", ("gateway", "rps_per_core"), True),
+    ("bytes per in-flight", ("gateway", "bytes_per_in_flight"), False),
+    ("import ms", ("summary", "import_ms", "p50"), False),
+    ("ready ms", ("summary", "ready_ms", "p50"), False),
+    ("rss ready MB", ("gateway", "rss_ready_mb"), False),
+]
+
+
+def lookup(result: dict, path) -> Optional[float]:
+    for key in path:
+        if not isinstance(result, dict):
+            return None
+        result = result.get(key)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args()
+
+    baseline = json.loads(Path(args.baseline).read_text())
+    candidate = json.loads(Path(args.candidate).read_text())
+    print(f"baseline {baseline.get('commit')}  ->  candidate {candidate.get('commit')}")
+
+    for name in sorted(set(baseline["scenarios"]) & set(candidate["scenarios"])):
+        print(f"\n{name}")
+        for label, path, higher_is_better in METRICS:
+            old = lookup(baseline["scenarios"][name], path)
+            new = lookup(candidate["scenarios"][name], path)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old * 100 if old else 0.0
+            better = change > 0 if higher_is_better else change < 0
+            verdict = "" if abs(change) < 5 else ("better" if better else "WORSE")
+            print(f"  {label:<22}{old:>12.2f}{new:>12.2f}{change:>+9.1f}%  {verdict}")
+
+
+if __name__ == "__main__":
+    main()
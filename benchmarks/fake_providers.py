@@ -0,0 +1,200 @@
+"""
+Local stand-ins for the OpenAI chat completions API and Ollama's /api/chat, for benchmarking the
+gateway without real providers.
+
+Each server takes a latency model, an error rate and a response size:
+
+    python -m benchmarks.fake_providers openai --port 9101 --latency lognormal:200:0.5 --error-rate 0.01
+    python -m benchmarks.fake_providers ollama --port 9102 --latency fixed:50
+
+Latency models: "fixed:MS", "uniform:MIN_MS:MAX_MS" and "lognormal:MEDIAN_MS:SIGMA". Streamed
+responses spread the latency over the chunks, with the first chunk after `--ttft` of it.
+Injected errors alternate between 500 and 429 (with Retry-After).
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from typing import AsyncIterator, Callable
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+
+def latency_model(spec: str) -> Callable[[], float]:
+    """
+    Parses a latency spec into a function returning a delay in seconds.
+    """
+    kind, *args = spec.split(":")
+    values = [float(arg) / 1000 for arg in args]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        median, sigma = values[0], float(args[1])
+        return lambda: random.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+    raise ValueError(f"Unknown latency model: {spec}")
+
+
+class FakeBehaviour:
+    def __init__(self, latency: str = "fixed:0", error_rate: float = 0.0, output_tokens: int = 32, ttft: float = 0.3):
+        self.delay = latency_model(latency)
+        self.error_rate = error_rate
+        self.output_tokens = output_tokens
+        self.ttft = ttft
+        self.requests = 0
+        self.errors = 0
+
+    def error(self) -> Response:
+        self.errors += 1
+        if self.errors % 2:
+            return JSONResponse({"error": {"message": "Injected failure.", "type": "server_error"}}, status_code=500)
+        return JSONResponse(
+            {"error": {"message": "Injected rate limit.", "type": "rate_limit_error"}}, status_code=429, headers={"Retry-After": "1"}
+        )
+
+    def should_fail(self) -> bool:
+        self.requests += 1
+        return random.random() < self.error_rate
+
+    def words(self) -> list:
+        return [f"tok{i} " for i in range(self.output_tokens)]
+
+    async def paced(self, pieces: list) -> AsyncIterator[str]:
+        """
+        Yields pieces with the first after `ttft` of the total delay and the rest spread evenly.
+        """
+        total = self.delay()
+        await asyncio.sleep(total * self.ttft)
+        step = total * (1 - self.ttft) / max(1, len(pieces) - 1)
+        for index, piece in enumerate(pieces):
+            if index:
+                await asyncio.sleep(step)
+            yield piece
+
+
+def prompt_tokens(messages: list) -> int:
+    return sum(len(message.get("content") or "") for message in messages) // 4 + 4 * len(messages)
+
+
+def create_openai_app(behaviour: FakeBehaviour) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if behaviour.should_fail():
+            await asyncio.sleep(behaviour.delay() * behaviour.ttft)
+            return behaviour.error()
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        usage = {
+            "prompt_tokens": prompt_tokens(body.get("messages", [])),
+            "completion_tokens": behaviour.output_tokens,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+
+        if not body.get("stream"):
+            await asyncio.sleep(behaviour.delay())
+            content = json.dumps({"answer": "".join(behaviour.words()).strip()}) if json_mode else "".join(behaviour.words())
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        def chunk(delta: dict, finish_reason=None, **extra) -> str:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": body["model"],
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+                **extra,
+            }
+            return f"data: {json.dumps(payload)}\n\n"
+
+        async def events():
+            async for word in behaviour.paced(behaviour.words()):
+                yield chunk({"content": word})
+            yield chunk({}, finish_reason="stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield chunk(None, usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": behaviour.requests, "errors": behaviour.errors}
+
+    return app
+
+
+def create_ollama_app(behaviour: FakeBehaviour) -> FastAPI:
+    app = FastAPI()
+    loaded = set()
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        body = await request.json()
+        if behaviour.should_fail():
+            await asyncio.sleep(behaviour.delay() * behaviour.ttft)
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+        loaded.add(body["model"] if ":" in body["model"] else f"{body['model']}:latest")
+
+        counts = {"prompt_eval_count": prompt_tokens(body.get("messages", [])), "eval_count": behaviour.output_tokens}
+        json_mode = body.get("format") == "json"
+
+        if not body.get("stream", True):
+            await asyncio.sleep(behaviour.delay())
+            content = json.dumps({"answer": "".join(behaviour.words()).strip()}) if json_mode else "".join(behaviour.words())
+            return {"model": body["model"], "message": {"role": "assistant", "content": content}, "done": True, **counts}
+
+        async def lines():
+            async for word in behaviour.paced(behaviour.words()):
+                yield json.dumps({"model": body["model"], "message": {"role": "assistant", "content": word}, "done": False}) + "\n"
+            yield json.dumps({"model": body["model"], "message": {"role": "assistant", "content": ""}, "done": True, **counts}) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    @app.get("/api/ps")
+    async def ps():
+        return {"models": [{"name": name, "model": name} for name in sorted(loaded)]}
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": behaviour.requests, "errors": behaviour.errors}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=["openai", "ollama"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--latency", default="fixed:0")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--output-tokens", type=int, default=32)
+    parser.add_argument("--ttft", type=float, default=0.3, help="share of the latency before the first streamed chunk")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    behaviour = FakeBehaviour(args.latency, args.error_rate, args.output_tokens, args.ttft)
+    app = create_openai_app(behaviour) if args.kind == "openai" else create_ollama_app(behaviour)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Load generator for the gateway's /v1/agent:run.
+
+Closed loop (`concurrency`): N workers send requests back to back. Open loop (`rps`): requests
+start on a fixed schedule whatever the response times. Open-loop latency is measured from each
+request's scheduled start, so a stalled gateway can't hide its queueing (coordinated omission).
+
+Gateway overhead per request is the client-observed latency minus the provider time the gateway
+reports in `timing.provider_duration_ms`.
+"""
+import asyncio
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import httpx
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+class LoadResult:
+    def __init__(self):
+        self.latencies_ms: List[float] = []
+        self.overheads_ms: List[float] = []
+        self.statuses: Counter = Counter()
+        self.started = 0.0
+        self.ended = 0.0
+
+    def record(self, latency_ms: float, status: str, provider_ms: Optional[float] = None):
+        self.statuses[status] += 1
+        self.latencies_ms.append(latency_ms)
+        if provider_ms is not None:
+            self.overheads_ms.append(max(0.0, latency_ms - provider_ms))
+
+    def summary(self) -> Dict:
+        elapsed = max(self.ended - self.started, 1e-9)
+        return {
+            "requests": sum(self.statuses.values()),
+            "statuses": dict(self.statuses),
+            "duration_s": round(elapsed, 3),
+            "rps": round(self.statuses.get("200", 0) / elapsed, 2),
+            "latency_ms": {f"p{q}": _round(percentile(self.latencies_ms, q)) for q in (50, 90, 99)},
+            "overhead_ms": {f"p{q}": _round(percentile(self.overheads_ms, q)) for q in (50, 90, 99)},
+        }
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 3)
+
+
+async def _send(client: httpx.AsyncClient, path: str, body: dict, result: LoadResult, scheduled: Optional[float] = None):
+    start = scheduled if scheduled is not None else time.perf_counter()
+    try:
+        res = await client.post(path, json=body)
+        latency_ms = (time.perf_counter() - start) * 1000
+        provider_ms = res.json().get("timing", {}).get("provider_duration_ms") if res.status_code == 200 else None
+        result.record(latency_ms, str(res.status_code), provider_ms)
+    except httpx.HTTPError as e:
+        result.record((time.perf_counter() - start) * 1000, type(e).__name__)
+
+
+async def run_load(base_url: str, body: dict, duration_s: float, concurrency: Optional[int] = None,
+                   rps: Optional[float] = None, warmup_s: float = 1.0, path: str = "/v1/agent:run",
+                   max_outstanding: int = 10000) -> LoadResult:
+    """
+    Drives `path` for `duration_s` after `warmup_s` of unrecorded load. Exactly one of
+    `concurrency` and `rps` must be given.
+    """
+    if (concurrency is None) == (rps is None):
+        raise ValueError("Give either concurrency or rps.")
+
+    connections = concurrency or max_outstanding
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        if warmup_s > 0:
+            await _drive(client, path, body, warmup_s, concurrency, rps, max_outstanding, LoadResult())
+        result = LoadResult()
+        await _drive(client, path, body, duration_s, concurrency, rps, max_outstanding, result)
+        return result
+
+
+async def _drive(client, path, body, duration_s, concurrency, rps, max_outstanding, result: LoadResult):
+    result.started = time.perf_counter()
+    deadline = result.started + duration_s
+
+    if concurrency is not None:
+        async def worker():
+            while time.perf_counter() < deadline:
+                await _send(client, path, body, result)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    else:
+        tasks = set()
+        interval = 1 / rps
+        sent = 0
+        while True:
+            scheduled = result.started + sent * interval
+            if scheduled >= deadline:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(tasks) >= max_outstanding:
+                result.record((time.perf_counter() - scheduled) * 1000, "dropped")
+            else:
+                task = asyncio.create_task(_send(client, path, body, result, scheduled))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            sent += 1
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    result.ended = time.perf_counter()
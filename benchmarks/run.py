@@ -0,0 +1,267 @@
+"""
+Runs gateway benchmark scenarios against local fake providers and saves the results as JSON.
+
+    python -m benchmarks.run                      # every scenario
+    python -m benchmarks.run overhead max_rps     # some of them
+    python -m benchmarks.run --duration 30 --out results.json
+    python -m benchmarks.compare old.json new.json
+
+Each load scenario starts a fake provider and a fresh single-worker gateway (uvicorn) in subprocesses.
+It then drives /v1/agent:run and records the following:
+- latency and gateway overhead percentiles;
+- throughput;
+- requests per gateway CPU-second ("max RPS per core" when the provider answers instantly);
+- the gateway's RSS growth per in-flight request.
+Process figures come from /proc and are only reported on Linux.
+
+Startup scenarios import the app in fresh interpreters, then load every enabled provider, and
+record how long that takes and the peak RSS.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import httpx
+
+from .loadgen import percentile, run_load
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+SCENARIOS: Dict[str, dict] = {
+    # Gateway overhead on top of a steady 50 ms provider.
+    "overhead": {"provider": "openai", "latency": "fixed:50", "concurrency": 32},
+    # Throughput ceiling: the provider answers immediately, so the gateway is the bottleneck.
+    "max_rps": {"provider": "openai", "latency": "fixed:0", "concurrency": 64},
+    "ollama": {"provider": "ollama", "latency": "fixed:50", "concurrency": 32},
+    # Open loop with a long-tailed provider and 5% injected failures.
+    "errors": {"provider": "openai", "latency": "lognormal:100:0.5", "error_rate": 0.05, "rps": 200},
+    # Many slow requests held open at once, to measure memory per in-flight request.
+    "memory": {"provider": "openai", "latency": "fixed:4000", "concurrency": 500, "duration": 8},
+    # Cold start with every provider, and for an Ollama-only deployment.
+    "startup": {"kind": "startup", "providers": "", "runs": 5},
+    "startup_ollama": {"kind": "startup", "providers": "ollama", "runs": 5},
+}
+
+GATEWAY_ENV = {
+    # Measure the request path itself: nothing shared between identical benchmark requests.
+    "CACHE_ENABLED": "false",
+    "COALESCE_ENABLED": "false",
+    "RETRY_MAX_RETRIES": "0",
+    "MAX_CONCURRENCY": "10000",
+    "MAX_QUEUE_DEPTH": "10000",
+    "PROVIDER_MAX_CONCURRENCY": "10000",
+    "ADAPTIVE_CONCURRENCY_ENABLED": "false",
+    "HTTP_MAX_CONNECTIONS": "2000",
+    "HTTP_MAX_KEEPALIVE_CONNECTIONS": "2000",
+    "OLLAMA_HEALTH_CHECK_INTERVAL_SECONDS": "0",
+}
+
+STARTUP_PROBE = """
+import json, resource, time
+start = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+from app.providers.factory import provider_registry
+for name in provider_registry.names():
+    provider_registry.get(name)
+ready = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "ready_ms": (ready - start) * 1000,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def proc_cpu_seconds(pid: int) -> Optional[float]:
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def proc_rss_bytes(pid: int) -> Optional[int]:
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def git_revision() -> Dict:
+    def git(*args) -> str:
+        try:
+            return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ""
+    return {"commit": git("rev-parse", "--short", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+async def wait_until_up(url: str, timeout: float = 20):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def request_body(provider: str) -> dict:
+    return {
+        "provider": provider,
+        "model": "gpt-4o-mini" if provider == "openai" else "llama3.1",
+        "auth": {"type": "api_key", "key": "sk-benchmark"},
+        "input": {
+            "instruction": "Classify the sentiment of the review.",
+            "data": {"review": "The battery lasts all week and the screen is great. " * 8},
+        },
+    }
+
+
+async def run_scenario(name: str, scenario: dict, duration: float, warmup: float) -> dict:
+    provider_port, gateway_port = free_port(), free_port()
+    provider_url = f"http://127.0.0.1:{provider_port}"
+    gateway_url = f"http://127.0.0.1:{gateway_port}"
+
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_providers", scenario["provider"], "--port", str(provider_port),
+         "--latency", scenario["latency"], "--error-rate", str(scenario.get("error_rate", 0))],
+        cwd=ROOT,
+    )
+    env = {**os.environ, **GATEWAY_ENV, "OPENAI_BASE_URL": f"{provider_url}/v1", "OLLAMA_HOSTS": provider_url}
+    gateway = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(gateway_port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=ROOT, env=env,
+    )
+    try:
+        await wait_until_up(f"{provider_url}/stats")
+        await wait_until_up(f"{gateway_url}/health")
+
+        rss_idle = proc_rss_bytes(gateway.pid)
+        rss_peak = rss_idle
+        cpu_before = proc_cpu_seconds(gateway.pid)
+
+        async def sample_rss():
+            nonlocal rss_peak
+            while True:
+                rss = proc_rss_bytes(gateway.pid)
+                if rss is not None and (rss_peak is None or rss > rss_peak):
+                    rss_peak = rss
+                await asyncio.sleep(0.1)
+
+        sampler = asyncio.create_task(sample_rss())
+        result = await run_load(
+            gateway_url,
+            request_body(scenario["provider"]),
+            duration_s=scenario.get("duration", duration),
+            concurrency=scenario.get("concurrency"),
+            rps=scenario.get("rps"),
+            warmup_s=warmup,
+        )
+        sampler.cancel()
+        cpu_after = proc_cpu_seconds(gateway.pid)
+    finally:
+        for process in (gateway, fake):
+            process.terminate()
+        for process in (gateway, fake):
+            process.wait(timeout=10)
+
+    summary = result.summary()
+    gateway_stats = {}
+    if cpu_before is not None and cpu_after is not None:
+        cpu_seconds = cpu_after - cpu_before
+        gateway_stats["cpu_seconds"] = round(cpu_seconds, 3)
+        # Includes the warmup's CPU, so slightly pessimistic.
+        gateway_stats["rps_per_core"] = round(summary["statuses"].get("200", 0) / cpu_seconds, 1) if cpu_seconds else None
+    if rss_idle is not None and rss_peak is not None:
+        in_flight = scenario.get("concurrency") or scenario.get("rps", 0)
+        gateway_stats["rss_idle_mb"] = round(rss_idle / 2**20, 1)
+        gateway_stats["rss_peak_mb"] = round(rss_peak / 2**20, 1)
+        gateway_stats["bytes_per_in_flight"] = round((rss_peak - rss_idle) / in_flight) if in_flight else None
+
+    print(f"{name}: {json.dumps({**summary, 'gateway': gateway_stats})}", file=sys.stderr)
+    return {"config": scenario, "summary": summary, "gateway": gateway_stats}
+
+
+def run_startup(name: str, scenario: dict) -> dict:
+    env = {**os.environ, "ENABLED_PROVIDERS": scenario["providers"], "PYTHONDONTWRITEBYTECODE": "1"}
+    samples = []
+    for _ in range(scenario["runs"]):
+        out = subprocess.run([sys.executable, "-c", STARTUP_PROBE], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    def stats(key: str) -> dict:
+        values = [sample[key] for sample in samples]
+        return {"p50": round(percentile(values, 50), 1), "max": round(max(values), 1)}
+
+    summary = {"import_ms": stats("import_ms"), "ready_ms": stats("ready_ms")}
+    # ru_maxrss is in KiB on Linux.
+    gateway_stats = {"rss_ready_mb": round(percentile([sample["max_rss_kb"] for sample in samples], 50) / 1024, 1)}
+    print(f"{name}: {json.dumps({**summary, 'gateway': gateway_stats})}", file=sys.stderr)
+    return {"config": scenario, "summary": summary, "gateway": gateway_stats}
+
+
+async def run(names, duration: float, warmup: float) -> dict:
+    results = {}
+    for name in names:
+        scenario = SCENARIOS[name]
+        if scenario.get("kind") == "startup":
+            results[name] = run_startup(name, scenario)
+        else:
+            results[name] = await run_scenario(name, scenario, duration, warmup)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenarios", nargs="*", help=f"any of: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--duration", type=float, default=15, help="seconds of measured load per scenario")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds of unmeasured load first")
+    parser.add_argument("--out", help=f"result file (default: {RESULTS_DIR.relative_to(ROOT)}/<time>-<commit>.json)")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    started_at = datetime.datetime.utcnow()
+    report = {
+        **git_revision(),
+        "started_at": started_at.isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "scenarios": asyncio.run(run(args.scenarios or list(SCENARIOS), args.duration, args.warmup)),
+    }
+
+    out = Path(args.out) if args.out else RESULTS_DIR / f"{started_at:%Y%m%dT%H%M%S}-{report['commit'] or 'unknown'}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(out)
+
+
+if __name__ == "__main__":
+    main()
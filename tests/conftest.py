@@ -0,0 +1,8 @@
+import pytest
+from app.core.circuit_breaker import circuit_breakers
+
+
+@pytest.fixture(autouse=True)
+def fresh_circuit_breakers(monkeypatch):
+    # Tests fail providers on purpose; breakers tripped by one test must not reject the next.
+    monkeypatch.setattr(circuit_breakers, "_breakers", {})
@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.core.adaptive import AdaptiveLimit
+from app.core.concurrency import AdmissionController
+from app.core.errors import UpstreamRateLimitException, ProviderException, ValidationException
+
+
+def test_drop_backs_off_multiplicatively():
+    limit = AdaptiveLimit(20, backoff_ratio=0.5)
+    assert limit.on_drop() == 10
+    assert limit.drops == 1
+
+def test_burst_of_drops_backs_off_once_per_window():
+    limit = AdaptiveLimit(20, backoff_ratio=0.5)
+    for _ in range(5):
+        limit.on_drop()
+    assert limit.limit == 10
+
+def test_limit_grows_only_while_utilized():
+    limit = AdaptiveLimit(4)
+    for _ in range(20):
+        limit.on_success(0.1, in_flight=1)
+    assert limit.limit == 4
+    for _ in range(20):
+        limit.on_success(0.1, in_flight=4)
+    assert limit.limit > 4
+
+def test_latency_growth_backs_off():
+    limit = AdaptiveLimit(20, backoff_ratio=0.5, latency_tolerance=2.0)
+    for _ in range(50):
+        limit.on_success(0.1, in_flight=20)
+    grown = limit.limit
+    for _ in range(10):
+        limit.on_success(2.0, in_flight=20)
+    assert limit.limit < grown
+
+def test_limits_stay_within_bounds():
+    limit = AdaptiveLimit(2, min_limit=1, max_limit=3, backoff_ratio=0.1)
+    for _ in range(100):
+        limit.on_success(0.1, in_flight=3)
+    assert limit.limit == 3
+    for _ in range(10):
+        for _ in range(3):
+            limit.on_success(0.1, in_flight=0)
+        limit.on_drop()
+    assert limit.limit == 1
+
+def test_upstream_throttling_lowers_provider_limit():
+    controller = AdmissionController()
+
+    async def call(exc):
+        async with controller.upstream("openai", "gpt-4o-mini"):
+            raise exc
+
+    async def main():
+        limiter = controller.limiter("openai", "gpt-4o-mini")
+        start = limiter.limit
+        with pytest.raises(ValidationException):
+            await call(ValidationException())
+        assert limiter.limit == start
+        with pytest.raises(UpstreamRateLimitException):
+            await call(UpstreamRateLimitException())
+        assert limiter.limit < start
+        assert limiter.in_flight == 0
+
+    asyncio.run(main())
+
+def test_overload_classification():
+    assert AdmissionController.is_overload(ProviderException(details={"upstream_status": 503}))
+    assert not AdmissionController.is_overload(ProviderException(details={"upstream_status": 401}))
+
+def test_limits_endpoint():
+    body = TestClient(app).get("/v1/limits").json()
+    assert set(body["global"]) >= {"limit", "in_flight", "queued", "rejected"}
+    assert isinstance(body["providers"], dict)
@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.core import concurrency
+from app.core.concurrency import Limiter, AdmissionController, KeyedLimiter
+from app.core.config import settings
+from app.core.errors import RateLimitException
+from app.core.shared_state import SharedState
+
+
+def test_acquire_without_contention_does_not_wait():
+    async def main():
+        limiter = Limiter("test", limit=2, max_queue=0, max_wait_seconds=1)
+        assert await limiter.acquire() == 0
+        assert await limiter.acquire() == 0
+        assert limiter.in_flight == 2
+
+    asyncio.run(main())
+
+def test_full_queue_is_rejected_immediately():
+    async def main():
+        limiter = Limiter("test", limit=1, max_queue=0, max_wait_seconds=1)
+        await limiter.acquire()
+        with pytest.raises(RateLimitException) as exc_info:
+            await limiter.acquire()
+        assert exc_info.value.status_code == 429
+        assert exc_info.value.headers["Retry-After"] == "1"
+        assert limiter.rejected == 1
+
+    asyncio.run(main())
+
+def test_queue_wait_timeout_is_rejected():
+    async def main():
+        limiter = Limiter("test", limit=1, max_queue=5, max_wait_seconds=0.01)
+        await limiter.acquire()
+        with pytest.raises(RateLimitException):
+            await limiter.acquire()
+        assert limiter.queued == 0
+        assert limiter.in_flight == 1
+
+    asyncio.run(main())
+
+def test_waiters_are_served_in_order():
+    async def main():
+        limiter = Limiter("test", limit=1, max_queue=5, max_wait_seconds=1)
+        order = []
+
+        async def worker(name):
+            async with limiter.slot():
+                order.append(name)
+                await asyncio.sleep(0.001)
+
+        await asyncio.gather(*(worker(i) for i in range(4)))
+        assert order == [0, 1, 2, 3]
+        assert limiter.in_flight == 0
+
+    asyncio.run(main())
+
+def test_raising_the_limit_admits_waiters():
+    async def main():
+        limiter = Limiter("test", limit=1, max_queue=5, max_wait_seconds=1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.queued == 1
+        limiter.set_limit(2)
+        assert await waiter >= 0
+        assert limiter.in_flight == 2
+
+    asyncio.run(main())
+
+def test_provider_limits_lookup(monkeypatch):
+    controller = AdmissionController()
+    monkeypatch.setattr(controller, "provider_limits", {"ollama": 2, "openai:gpt-4o": 5})
+    assert controller.limiter("ollama", "llama3.1").limit == 2
+    assert controller.limiter("openai", "gpt-4o").limit == 5
+    assert controller.limiter("ollama", "llama3.1") is not controller.limiter("openai", "gpt-4o")
+
+def test_idle_model_limiters_are_evicted_with_their_shared_slots(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "MAX_TRACKED_MODELS", 3)
+    monkeypatch.setattr(concurrency, "shared_state", SharedState(str(tmp_path / "state"), slots=16))
+    controller = AdmissionController()
+
+    async def main():
+        async with controller.upstream("openai", "busy"):
+            for i in range(40):  # 80 slot names without eviction
+                async with controller.upstream("openai", f"made-up-{i}"):
+                    pass
+            assert "openai:busy" in controller._limiters
+            assert len(controller._limiters) <= 3
+
+    asyncio.run(main())
+
+def test_keyed_limiter_drops_idle_semaphores(monkeypatch):
+    monkeypatch.setattr(settings, "MAX_TRACKED_MODELS", 2)
+    limiter = KeyedLimiter(4)
+
+    async def main():
+        async with limiter.get("ollama", "busy"):
+            for i in range(10):
+                async with limiter.get("ollama", f"m{i}"):
+                    pass
+            assert list(limiter._semaphores) == ["ollama:busy", "ollama:m9"]
+
+    asyncio.run(main())
+
+def test_overload_returns_429_with_retry_after(monkeypatch):
+    monkeypatch.setattr(concurrency.admission, "global_limiter", Limiter("global", 0, 0, 0.01))
+    res = TestClient(app).get("/health")
+    assert res.status_code == 429
+    assert res.headers["Retry-After"] == "1"
+    assert res.json()["error"]["code"] == "RATE_LIMIT"
@@ -0,0 +1,84 @@
+import asyncio
+import json
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.agents import agent_service as agent_service_module
+from app.providers import policy as policy_module
+from app.api.schemas import SuccessResponse, Result, Usage, Billing, Timing
+from app.core.concurrency import KeyedLimiter
+from app.core import concurrency
+
+
+class SlowProvider:
+    def __init__(self):
+        self.in_flight = 0
+        self.peak = 0
+
+    async def invoke(self, request):
+        if request.input.messages[-1].content == "fail":
+            raise RuntimeError("upstream exploded")
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return SuccessResponse(
+            trace_id=request.trace_id,
+            provider=request.provider,
+            model=request.model,
+            result=Result(type="text", text=request.input.messages[-1].content.upper()),
+            usage=Usage(input_tokens=5, output_tokens=1, total_tokens=6),
+            billing=Billing(pricing_source="unknown"),
+            timing=Timing(started_at="", ended_at="", duration_ms=0, provider_duration_ms=10),
+        )
+
+@pytest.fixture
+def provider(monkeypatch):
+    provider = SlowProvider()
+    monkeypatch.setattr(agent_service_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(policy_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(concurrency.batch_limiter, "_semaphores", {})
+    monkeypatch.setattr(concurrency.batch_limiter, "limits", {"ollama": 2})
+    return provider
+
+def item(content: str) -> dict:
+    return {
+        "provider": "ollama",
+        "model": "llama3.1",
+        "auth": {"type": "none"},
+        "input": {"messages": [{"role": "user", "content": content}]},
+        "cache": False,
+    }
+
+def test_batch_returns_results_in_order_with_isolated_errors(provider):
+    res = TestClient(app).post("/v1/agent:batch", json={"items": [item("a"), item("fail"), item("c")]})
+    assert res.status_code == 200
+    body = res.json()
+    assert [r["index"] for r in body["results"]] == [0, 1, 2]
+    assert body["results"][0]["response"]["result"]["text"] == "A"
+    assert body["results"][1]["ok"] is False
+    assert body["results"][1]["error"]["code"] == "PROVIDER_ERROR"
+    assert body["results"][2]["response"]["trace_id"] == f"{body['trace_id']}-2"
+    assert body["summary"]["succeeded"] == 2
+    assert body["summary"]["usage"]["total_tokens"] == 12
+
+def test_batch_respects_per_provider_cap(provider):
+    TestClient(app).post("/v1/agent:batch", json={"items": [item(str(i)) for i in range(10)]})
+    assert provider.peak == 2
+
+def test_batch_streams_ndjson(provider):
+    res = TestClient(app).post("/v1/agent:batch", json={"items": [item("a"), item("b")], "stream": True})
+    assert res.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in res.text.splitlines()]
+    assert sorted(line["index"] for line in lines[:-1]) == [0, 1]
+    assert lines[-1]["summary"]["total"] == 2
+
+def test_batch_rejects_empty():
+    res = TestClient(app).post("/v1/agent:batch", json={"items": []})
+    assert res.status_code == 422
+
+def test_keyed_limiter_lookup_order():
+    limiter = KeyedLimiter(8, {"openai": 4, "openai:gpt-4o": 2})
+    assert limiter.limit_for("openai", "gpt-4o") == 2
+    assert limiter.limit_for("openai", "gpt-4o-mini") == 4
+    assert limiter.limit_for("ollama", "llama3.1") == 8
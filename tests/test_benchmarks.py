@@ -0,0 +1,58 @@
+import asyncio
+import httpx
+import pytest
+from openai import AsyncOpenAI
+from benchmarks.fake_providers import FakeBehaviour, create_openai_app, create_ollama_app, latency_model
+from benchmarks.loadgen import LoadResult, percentile
+
+
+def openai_client(behaviour):
+    http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_openai_app(behaviour)))
+    return AsyncOpenAI(api_key="sk-test", base_url="http://fake/v1", http_client=http_client, max_retries=0)
+
+MESSAGES = [{"role": "user", "content": "hello there"}]
+
+def test_fake_openai_speaks_the_sdk_protocol():
+    async def run():
+        client = openai_client(FakeBehaviour(output_tokens=5))
+        completion = await client.chat.completions.create(model="gpt-4o-mini", messages=MESSAGES)
+        stream = await client.chat.completions.create(
+            model="gpt-4o-mini", messages=MESSAGES, stream=True, stream_options={"include_usage": True}
+        )
+        chunks = [chunk async for chunk in stream]
+        return completion, chunks
+
+    completion, chunks = asyncio.run(run())
+    assert completion.usage.completion_tokens == 5
+    assert completion.choices[0].message.content.count("tok") == 5
+    assert "".join(chunk.choices[0].delta.content or "" for chunk in chunks if chunk.choices) == completion.choices[0].message.content
+    assert chunks[-1].usage.total_tokens == completion.usage.total_tokens
+
+def test_fake_providers_inject_errors():
+    async def run():
+        behaviour = FakeBehaviour(error_rate=1.0)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=create_openai_app(behaviour)), base_url="http://fake") as client:
+            statuses = [(await client.post("/v1/chat/completions", json={"model": "m", "messages": MESSAGES})).status_code for _ in range(2)]
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=create_ollama_app(behaviour)), base_url="http://fake") as client:
+            statuses.append((await client.post("/api/chat", json={"model": "m", "messages": MESSAGES})).status_code)
+        return statuses
+
+    assert asyncio.run(run()) == [500, 429, 500]
+
+def test_latency_models_and_percentiles():
+    assert latency_model("fixed:50")() == 0.05
+    assert 0.01 <= latency_model("uniform:10:20")() <= 0.02
+    assert latency_model("lognormal:0:0.5")() == 0.0
+    with pytest.raises(ValueError):
+        latency_model("normal:10")
+
+    assert percentile(list(range(1, 101)), 50) == 51
+    assert percentile(list(range(1, 101)), 99) == 100
+    assert percentile([], 50) is None
+
+    result = LoadResult()
+    result.record(120.0, "200", provider_ms=100.0)
+    result.record(30.0, "502")
+    summary = result.summary()
+    assert summary["statuses"] == {"200": 1, "502": 1}
+    assert summary["overhead_ms"]["p50"] == 20.0
@@ -1,5 +1,6 @@
 import pytest
 import json
+from decimal import Decimal
 from app.billing.pricing import PricingService
 from app.api.schemas import Usage
 from app.core.config import settings
@@ -21,7 +22,8 @@ def pricing_service(monkeypatch):
 def test_calculate_cost_openai(pricing_service):
     usage = Usage(input_tokens=1000, output_tokens=2000, total_tokens=3000, is_estimated=False)
     billing = pricing_service.calculate_cost("openai", "gpt-4o-mini", usage)
-    assert billing.estimated_cost == (1 * 0.15) + (2 * 0.60)
+    # Decimal rates: exactly 1.35, not the float sum 0.15 + 1.2 = 1.3499999999999999
+    assert billing.estimated_cost == 1.35
     assert billing.pricing_source == "config"
 
 def test_calculate_cost_unknown_model(pricing_service):
@@ -41,3 +43,102 @@ def test_calculate_cost_free_model(pricing_service):
     billing = pricing_service.calculate_cost("gemini", "gemini-1.5-pro", usage)
     assert billing.estimated_cost == 0
     assert billing.pricing_source == "config"
+
+def test_billing_records_pricing_version(pricing_service):
+    usage = Usage(input_tokens=1000, output_tokens=0, total_tokens=1000, is_estimated=False)
+    billing = pricing_service.calculate_cost("openai", "gpt-4o-mini", usage)
+    assert billing.pricing_version == pricing_service.table.version
+
+def test_pricing_is_compiled_once(pricing_service):
+    assert PricingService().table is pricing_service.table
+
+def test_snapshots_aliases_and_prefixes(monkeypatch):
+    pricing_data = {
+        "version": "v2",
+        "openai": {
+            "gpt-4o-mini": {"input_per_1k": 0.15, "output_per_1k": 0.60, "aliases": ["mini"]},
+            "o1*": {"input_per_1k": 15, "output_per_1k": 60},
+        },
+    }
+    monkeypatch.setattr(settings, 'PRICING_JSON', json.dumps(pricing_data))
+    service = PricingService()
+    usage = Usage(input_tokens=1000, output_tokens=0, total_tokens=1000, is_estimated=False)
+    assert service.calculate_cost("openai", "gpt-4o-mini-2024-07-18", usage).estimated_cost == 0.15
+    assert service.calculate_cost("openai", "mini", usage).estimated_cost == 0.15
+    assert service.calculate_cost("openai", "o1-preview", usage).estimated_cost == 15
+    assert service.calculate_cost("openai", "gpt-4o", usage).pricing_source == "unknown"
+    assert service.calculate_cost("openai", "mini", usage).pricing_version == "v2"
+
+def test_long_context_tier_and_cached_input(monkeypatch):
+    pricing_data = {
+        "gemini": {
+            "gemini-1.5-pro": {
+                "input_per_1k": 1.25, "output_per_1k": 5.0, "cached_input_per_1k": 0.3125,
+                "tiers": [{"above_input_tokens": 128000, "input_per_1k": 2.5, "output_per_1k": 10.0}],
+            }
+        }
+    }
+    monkeypatch.setattr(settings, 'PRICING_JSON', json.dumps(pricing_data))
+    service = PricingService()
+
+    short = Usage(input_tokens=2000, output_tokens=1000, total_tokens=3000, cached_input_tokens=1000)
+    assert service.calculate_cost("gemini", "gemini-1.5-pro", short).estimated_cost == 1.25 + 0.3125 + 5.0
+
+    long = Usage(input_tokens=200000, output_tokens=1000, total_tokens=201000)
+    # The tier inherits the cached-input rate it doesn't override.
+    assert service.calculate_cost("gemini", "gemini-1.5-pro", long).estimated_cost == 200 * 2.5 + 10.0
+
+def test_pricing_file_hot_reload_keeps_last_good_table(tmp_path, monkeypatch):
+    import os
+    from app.billing.pricing import PricingRegistry
+    path = tmp_path / "pricing.json"
+    path.write_text(json.dumps({"openai": {"gpt-4o-mini": {"input_per_1k": 0.15, "output_per_1k": 0.60}}}))
+    monkeypatch.setattr(settings, 'PRICING_FILE', str(path))
+    registry = PricingRegistry()
+    first = registry.reload()
+
+    path.write_text(json.dumps({"openai": {"gpt-4o-mini": {"input_per_1k": 0.10, "output_per_1k": 0.40}}}))
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+    second = registry.reload()
+    assert second is not first
+    assert second.lookup("openai", "gpt-4o-mini").base.input * 1000 == Decimal("0.10")
+
+    path.write_text("{not json")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+    assert registry.reload() is second
+
+def test_pricing_json_is_compared_by_value(monkeypatch):
+    from app.billing.pricing import PricingRegistry
+    source = json.dumps({"openai": {"gpt-4o-mini": {"input_per_1k": 0.15, "output_per_1k": 0.60}}})
+    monkeypatch.setattr(settings, 'PRICING_JSON', source)
+    registry = PricingRegistry()
+    first = registry.current()
+    monkeypatch.setattr(settings, 'PRICING_JSON', "".join(list(source)))  # equal, but another object
+    assert registry.current() is first
+    monkeypatch.setattr(settings, 'PRICING_JSON', source.replace("0.15", "0.20"))
+    assert registry.current().lookup("openai", "gpt-4o-mini").base.input * 1000 == Decimal("0.20")
+
+def test_pricing_file_changes_are_loaded_in_the_background(tmp_path, monkeypatch):
+    import asyncio
+    import os
+    from app.billing.pricing import PricingRegistry
+    path = tmp_path / "pricing.json"
+    path.write_text(json.dumps({"openai": {"gpt-4o-mini": {"input_per_1k": 0.15, "output_per_1k": 0.60}}}))
+    monkeypatch.setattr(settings, 'PRICING_FILE', str(path))
+    monkeypatch.setattr(settings, 'PRICING_RELOAD_INTERVAL_SECONDS', 0.01)
+    registry = PricingRegistry()
+
+    async def main():
+        await registry.start()
+        first = registry.current()
+        path.write_text(json.dumps({"openai": {"gpt-4o-mini": {"input_per_1k": 0.10, "output_per_1k": 0.40}}}))
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+        assert registry.current() is first  # not read on the request path
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if registry.current() is not first:
+                break
+        await registry.aclose()
+        return registry.current()
+
+    assert asyncio.run(main()).lookup("openai", "gpt-4o-mini").base.input * 1000 == Decimal("0.10")
@@ -0,0 +1,137 @@
+import asyncio
+import pytest
+from app.api.schemas import AgentRunRequest, SuccessResponse, Result, Usage, Billing, Timing
+from app.core.config import settings
+from app.core.errors import ProviderException, TimeoutException, UpstreamRateLimitException, ValidationException
+from app.providers import policy as policy_module
+from app.providers.policy import CallPolicy, LatencyTracker, RetryBudget
+
+
+class ScriptedProvider:
+    """
+    Plays back a script of outcomes: an exception to raise or a delay in seconds before answering.
+    """
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+        self.cancelled = 0
+
+    async def invoke(self, request):
+        self.calls += 1
+        step = self.script.pop(0) if self.script else 0
+        if isinstance(step, Exception):
+            raise step
+        try:
+            await asyncio.sleep(step)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return SuccessResponse(
+            trace_id="t",
+            provider=request.provider,
+            model=request.model,
+            result=Result(type="text", text=f"answer {self.calls}"),
+            usage=Usage(input_tokens=1, output_tokens=1, total_tokens=2),
+            billing=Billing(pricing_source="unknown"),
+            timing=Timing(started_at="", ended_at="", duration_ms=0, provider_duration_ms=0),
+        )
+
+@pytest.fixture
+def providers(monkeypatch):
+    providers = {}
+    monkeypatch.setattr(policy_module, "get_provider", lambda name: providers[name])
+    monkeypatch.setattr(settings, "RETRY_BACKOFF_BASE_MS", 1)
+    monkeypatch.setattr(settings, "RETRY_MAX_RETRIES", 2)
+    return providers
+
+def make_request(**overrides) -> AgentRunRequest:
+    body = {
+        "provider": "openai",
+        "model": "gpt-4o-mini",
+        "auth": {"type": "api_key", "key": "key"},
+        "input": {"instruction": "hi"},
+    }
+    body.update(overrides)
+    return AgentRunRequest(**body)
+
+def run(policy, request):
+    return asyncio.run(policy.invoke(request))
+
+def test_retryable_errors_are_retried(providers):
+    providers["openai"] = ScriptedProvider(ProviderException(details={"upstream_status": 503}), UpstreamRateLimitException(), 0)
+    response = run(CallPolicy(budget=RetryBudget(0.2, 10)), make_request())
+    assert providers["openai"].calls == 3
+    assert [w.code for w in response.warnings] == ["RETRIED"]
+
+def test_non_retryable_errors_are_not_retried(providers):
+    providers["openai"] = ScriptedProvider(ProviderException(details={"upstream_status": 401}))
+    with pytest.raises(ProviderException):
+        run(CallPolicy(budget=RetryBudget(0.2, 10)), make_request())
+    assert providers["openai"].calls == 1
+
+def test_max_retries_per_request(providers):
+    providers["openai"] = ScriptedProvider(TimeoutException(), 0)
+    with pytest.raises(TimeoutException):
+        run(CallPolicy(budget=RetryBudget(0.2, 10)), make_request(max_retries=0))
+    assert providers["openai"].calls == 1
+
+def test_retry_budget_caps_extra_calls(providers):
+    providers["openai"] = ScriptedProvider(*[TimeoutException()] * 10)
+    with pytest.raises(TimeoutException):
+        run(CallPolicy(budget=RetryBudget(0.2, 1)), make_request())
+    assert providers["openai"].calls == 2
+
+def test_fallback_chain(providers):
+    providers["openai"] = ScriptedProvider(*[UpstreamRateLimitException()] * 3)
+    providers["ollama"] = ScriptedProvider(0)
+    request = make_request(fallbacks=[{"provider": "ollama", "model": "llama3.1"}])
+    response = run(CallPolicy(budget=RetryBudget(0.2, 10)), request)
+    assert (response.provider, response.model) == ("ollama", "llama3.1")
+    assert [w.code for w in response.warnings] == ["FALLBACK"]
+    assert request.provider == "openai"
+
+def test_fallback_not_used_for_client_errors(providers):
+    providers["openai"] = ScriptedProvider(ValidationException())
+    providers["ollama"] = ScriptedProvider(0)
+    with pytest.raises(ValidationException):
+        run(CallPolicy(), make_request(fallbacks=[{"provider": "ollama", "model": "llama3.1"}]))
+    assert providers["ollama"].calls == 0
+
+def test_slow_attempt_is_hedged(providers):
+    providers["openai"] = ScriptedProvider(0.5, 0)
+    tracker = LatencyTracker()
+    for _ in range(20):
+        tracker.record("openai:gpt-4o-mini", 0.01)
+    policy = CallPolicy(tracker=tracker, budget=RetryBudget(0.2, 10))
+    response = run(policy, make_request(hedge=True))
+    assert response.result.text == "answer 2"
+    assert [w.code for w in response.warnings] == ["HEDGED"]
+    assert providers["openai"].cancelled == 1
+
+def test_no_hedge_without_latency_history(providers):
+    providers["openai"] = ScriptedProvider(0.05)
+    response = run(CallPolicy(budget=RetryBudget(0.2, 10)), make_request(hedge=True))
+    assert providers["openai"].calls == 1
+    assert response.warnings == []
+
+def test_attempt_timeout(providers, monkeypatch):
+    monkeypatch.setattr(settings, "REQUEST_TIMEOUT_SECONDS", 0.01)
+    providers["openai"] = ScriptedProvider(1)
+    with pytest.raises(TimeoutException):
+        run(CallPolicy(budget=RetryBudget(0.2, 10)), make_request(max_retries=0))
+
+def test_latency_tracker_percentile():
+    tracker = LatencyTracker(window=100)
+    for i in range(100):
+        tracker.record("k", i)
+    assert tracker.percentile("k", 95) == 95
+    assert tracker.percentile("k", 95, min_samples=200) is None
+
+def test_latency_tracker_keeps_the_most_recently_recorded_keys():
+    tracker = LatencyTracker(max_keys=2)
+    tracker.record("a", 1)
+    tracker.record("b", 2)
+    tracker.record("a", 3)
+    tracker.record("c", 4)
+    assert tracker.percentile("b", 50) is None
+    assert tracker.percentile("a", 50) == 3 and tracker.percentile("c", 50) == 4
@@ -0,0 +1,157 @@
+import json
+import re
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.agents import agent_service as agent_service_module
+from app.agents import chunking
+from app.providers import policy as policy_module
+from app.providers.base import StreamChunk
+from app.api.schemas import SuccessResponse, Result, Usage, Billing, Timing
+from app.core import concurrency
+from app.utils.json_tools import dumps
+
+
+class CountingProvider:
+    """
+    Answers with the ids of the records it was given, or "summary" for a summarizing reduce.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def answer(self, request) -> str:
+        prompt = "\n".join(message.content for message in request.input.messages)
+        self.calls.append(prompt)
+        if "partial results" in prompt:
+            return "summary"
+        if "fail" in prompt:
+            raise RuntimeError("upstream exploded")
+        return ",".join(re.findall(r'"id":(\d+)', prompt))
+
+    async def invoke(self, request):
+        text = self.answer(request)
+        result = Result(type="text", text=text)
+        if request.response_format == "json":
+            result = Result(type="json", json={"ids": [int(i) for i in text.split(",")]})
+        return SuccessResponse(
+            trace_id=request.trace_id,
+            provider=request.provider,
+            model=request.model,
+            result=result,
+            usage=Usage(input_tokens=100, output_tokens=10, total_tokens=110),
+            billing=Billing(pricing_source="unknown"),
+            timing=Timing(started_at="", ended_at="", duration_ms=0, provider_duration_ms=5),
+        )
+
+    async def stream(self, request):
+        for word in self.answer(request).split(","):
+            yield StreamChunk(delta=word)
+        yield StreamChunk(usage={"input_tokens": 100, "output_tokens": 10, "total_tokens": 110})
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    provider = CountingProvider()
+    monkeypatch.setattr(agent_service_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(policy_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(concurrency.chunk_limiter, "_semaphores", {})
+    return provider
+
+def records(n: int, text: str = "lorem ipsum dolor sit amet") -> dict:
+    return {"title": "report", "records": [{"id": i, "text": text} for i in range(n)]}
+
+def body(data, **chunking) -> dict:
+    return {
+        "provider": "ollama",
+        "model": "llama3.1",
+        "auth": {"type": "none"},
+        "input": {"instruction": "List the ids.", "data": data, "data_encoding": "minified"},
+        "cache": False,
+        "chunking": {"max_chunk_tokens": 100, **chunking},
+    }
+
+def test_split_keeps_envelope_and_fits_budget():
+    data = records(40)
+    pieces = chunking.split(data, 400)
+    assert len(pieces) > 1
+    assert all(piece["title"] == "report" for piece in pieces)
+    assert all(len(dumps(piece)) <= 400 for piece in pieces)
+    assert [r["id"] for piece in pieces for r in piece["records"]] == list(range(40))
+
+def test_split_text_prefers_paragraphs():
+    text = "\n\n".join(f"Paragraph {i}. " + "word " * 20 for i in range(10))
+    pieces = chunking.split(text, 300)
+    assert all(len(piece) <= 300 for piece in pieces)
+    assert all(piece.startswith("Paragraph") for piece in pieces)
+    assert "\n\n".join(pieces) == text
+
+def test_split_oversized_scalar_is_cut():
+    assert chunking.split("x" * 25, 10) == ["x" * 10, "x" * 10, "x" * 5]
+
+def test_combine_merge_arrays():
+    results = [Result(type="json", json={"ids": [1, 2], "title": "a"}), Result(type="json", json={"ids": [3], "title": "b"})]
+    assert chunking.combine(results, "merge_arrays").json == {"ids": [1, 2, 3], "title": "a"}
+    assert chunking.combine(results, "concat").json == {"results": [r.json for r in results]}
+
+def test_small_data_is_not_chunked(provider):
+    res = TestClient(app).post("/v1/agent:run", json=body(records(2)))
+    assert res.status_code == 200
+    assert res.json()["chunks"] is None
+    assert len(provider.calls) == 1
+
+def test_run_concatenates_chunks_with_per_chunk_usage(provider):
+    res = TestClient(app).post("/v1/agent:run", json=body(records(30)))
+    assert res.status_code == 200
+    out = res.json()
+    chunks = out["chunks"]
+    assert len(chunks) == len(provider.calls) > 1
+    assert [chunk["index"] for chunk in chunks] == list(range(len(chunks)))
+    ids = [int(i) for part in out["result"]["text"].split("\n\n") for i in part.split(",")]
+    assert ids == list(range(30))
+    assert out["usage"]["total_tokens"] == 110 * len(chunks)
+    assert out["warnings"][0]["code"] == "CHUNKED"
+    assert all("part" in call and '"title":"report"' in call for call in provider.calls)
+
+def test_run_merges_json_arrays(provider):
+    request = body(records(30), reduce="merge_arrays")
+    request["response_format"] = "json"
+    res = TestClient(app).post("/v1/agent:run", json=request)
+    assert res.json()["result"]["json"] == {"ids": list(range(30))}
+
+def test_summarize_reduce_is_billed_as_its_own_chunk(provider):
+    res = TestClient(app).post("/v1/agent:run", json=body(records(30), reduce="summarize"))
+    out = res.json()
+    assert out["result"]["text"] == "summary"
+    assert out["chunks"][-1]["stage"] == "reduce"
+    assert out["usage"]["total_tokens"] == 110 * len(out["chunks"])
+
+def test_failed_chunk_fails_request_unless_partial_allowed(provider):
+    data = records(30)
+    data["records"][0]["text"] = "fail"
+    res = TestClient(app).post("/v1/agent:run", json=body(data))
+    assert res.status_code == 502
+    assert res.json()["error"]["details"]["chunk"] == 0
+
+    res = TestClient(app).post("/v1/agent:run", json=body(data, allow_partial=True))
+    out = res.json()
+    assert res.status_code == 200
+    assert out["chunks"][0]["ok"] is False
+    assert "failed" in out["warnings"][0]["message"]
+
+def test_too_many_chunks_is_rejected(provider, monkeypatch):
+    monkeypatch.setattr(agent_service_module.chunking.settings, "CHUNK_MAX_CHUNKS", 2)
+    res = TestClient(app).post("/v1/agent:run", json=body(records(30)))
+    assert res.status_code == 400
+
+def test_stream_reports_progress_then_result(provider):
+    res = TestClient(app).post("/v1/agent:stream", json=body(records(30), reduce="summarize"))
+    events = [
+        (block.split("\n")[0][len("event: "):], json.loads(block.split("\n")[1][len("data: "):]))
+        for block in res.text.strip().split("\n\n")
+    ]
+    names = [name for name, _ in events]
+    total = events[0][1]["total"]
+    assert names == ["progress"] * total + ["delta", "done"]
+    assert [payload["completed"] for _, payload in events[:total]] == list(range(1, total + 1))
+    assert events[-2][1]["delta"] == "summary"
+    assert events[-1][1]["chunks"][-1]["stage"] == "reduce"
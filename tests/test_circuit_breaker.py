@@ -0,0 +1,169 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.api.schemas import AgentRunRequest, SuccessResponse, Result, Usage, Billing, Timing
+from app.core import circuit_breaker
+from app.core.circuit_breaker import CircuitBreaker, circuit_breakers
+from app.core.config import settings
+from app.core.errors import CircuitOpenException, ProviderException, ValidationException
+from app.providers import policy as policy_module
+from app.providers.ollama_pool import OllamaBackendPool
+from app.providers.policy import CallPolicy, RetryBudget
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(settings, "CIRCUIT_MIN_CALLS", 4)
+    monkeypatch.setattr(settings, "CIRCUIT_FAILURE_RATE", 0.5)
+    monkeypatch.setattr(settings, "CIRCUIT_OPEN_SECONDS", 10)
+    return clock
+
+def fail(breaker, error=None):
+    with pytest.raises(type(error) if error else ProviderException):
+        with breaker.call():
+            raise error or ProviderException(details={"upstream_status": 502})
+
+def succeed(breaker):
+    with breaker.call():
+        pass
+
+def test_opens_on_failure_rate_then_half_open_probe_closes(clock):
+    breaker = CircuitBreaker("openai:gpt-4o-mini@default")
+    succeed(breaker)
+    succeed(breaker)
+    fail(breaker)
+    assert breaker.state == "closed"  # 1 in 3: not enough calls to judge yet
+    fail(breaker)
+    assert breaker.state == "open"
+
+    with pytest.raises(CircuitOpenException) as e:
+        succeed(breaker)
+    assert e.value.code == "CIRCUIT_OPEN" and e.value.headers["Retry-After"] == "10"
+
+    clock.now += 10
+    with breaker.call():
+        assert breaker.state == "half_open"
+        with pytest.raises(CircuitOpenException):
+            succeed(breaker)  # only one probe at a time
+    assert breaker.state == "closed"
+
+def test_failed_probe_reopens(clock):
+    breaker = CircuitBreaker("b")
+    for _ in range(4):
+        fail(breaker)
+    clock.now += 10
+    fail(breaker)
+    assert breaker.state == "open" and breaker.retry_after() == 10
+
+def test_client_errors_dont_count_and_old_calls_expire(clock, monkeypatch):
+    monkeypatch.setattr(settings, "CIRCUIT_WINDOW_SECONDS", 30)
+    breaker = CircuitBreaker("b")
+    for _ in range(4):
+        fail(breaker, ValidationException("bad request"))
+    assert breaker.state == "closed"
+    fail(breaker)
+    fail(breaker)
+    clock.now += 31
+    fail(breaker)
+    assert breaker.state == "closed" and breaker.stats()["failures"] == 1
+
+def test_opens_on_slow_call_rate(clock, monkeypatch):
+    monkeypatch.setattr(settings, "CIRCUIT_SLOW_CALL_SECONDS", 5)
+    monkeypatch.setattr(settings, "CIRCUIT_SLOW_CALL_RATE", 0.75)
+    breaker = CircuitBreaker("b")
+    for _ in range(4):
+        with breaker.call():
+            clock.now += 6
+    assert breaker.state == "open"
+
+def test_cancelled_probe_frees_its_slot(clock):
+    breaker = CircuitBreaker("b")
+    for _ in range(4):
+        fail(breaker)
+    clock.now += 10
+    with pytest.raises(asyncio.CancelledError):
+        with breaker.call():
+            raise asyncio.CancelledError()
+    assert breaker.state == "half_open"
+    succeed(breaker)
+    assert breaker.state == "closed"
+
+
+class Provider:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    async def invoke(self, request):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return SuccessResponse(
+            trace_id="t",
+            provider=request.provider,
+            model=request.model,
+            result=Result(type="text", text="ok"),
+            usage=Usage(input_tokens=1, output_tokens=1, total_tokens=2),
+            billing=Billing(pricing_source="unknown"),
+            timing=Timing(started_at="", ended_at="", duration_ms=0, provider_duration_ms=0),
+        )
+
+def test_open_breaker_fails_fast_to_the_fallback(clock, monkeypatch):
+    providers = {"openai": Provider(ProviderException(details={"upstream_status": 500})), "gemini": Provider()}
+    monkeypatch.setattr(policy_module, "get_provider", lambda name: providers[name])
+    monkeypatch.setattr(settings, "RETRY_MAX_RETRIES", 0)
+    request = AgentRunRequest(
+        provider="openai",
+        model="gpt-4o-mini",
+        auth={"type": "none"},
+        input={"instruction": "hi"},
+        fallbacks=[{"provider": "gemini", "model": "gemini-1.5-flash"}],
+    )
+    policy = CallPolicy(budget=RetryBudget(0.2, 10))
+    for _ in range(4):
+        asyncio.run(policy.invoke(request))
+    assert providers["openai"].calls == 4
+    response = asyncio.run(policy.invoke(request))
+    assert providers["openai"].calls == 4  # not called: the breaker is open
+    assert "CIRCUIT_OPEN" in response.warnings[0].message
+
+def test_ollama_pool_routes_around_a_backend_whose_breaker_is_open(clock):
+    pool = OllamaBackendPool(["http://gpu1:11434", "http://gpu2:11434"])
+    for _ in range(4):
+        fail(circuit_breakers.get("ollama", "llama3", "http://gpu1:11434"))
+    assert {pool.pick("llama3").url for _ in range(20)} == {"http://gpu2:11434"}
+    assert {pool.pick("mistral").url for _ in range(40)} == {"http://gpu1:11434", "http://gpu2:11434"}
+    for _ in range(4):
+        fail(circuit_breakers.get("ollama", "llama3", "http://gpu2:11434"))
+    with pytest.raises(CircuitOpenException):
+        pool.pick("llama3")
+
+def test_breakers_are_reported_by_ready_and_providers(clock):
+    for _ in range(4):
+        fail(circuit_breakers.get("gemini", "gemini-1.5-flash"))
+    client = TestClient(app)
+    ready = client.get("/ready").json()
+    assert ready["circuit_breakers"]["gemini:gemini-1.5-flash@default"]["state"] == "open"
+    providers = {p["name"]: p for p in client.get("/v1/providers").json()["providers"]}
+    assert providers["gemini"]["circuit_breakers"]["gemini:gemini-1.5-flash@default"]["failures"] == 0
+    assert providers["openai"]["circuit_breakers"] == {}
+
+def test_closed_breakers_are_evicted_past_the_model_cap(clock, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_TRACKED_MODELS", 3)
+    for _ in range(4):
+        fail(circuit_breakers.get("openai", "gpt-4o"))
+    for i in range(20):
+        succeed(circuit_breakers.get("openai", f"made-up-{i}"))
+    assert len(circuit_breakers.stats()) <= 3
+    assert circuit_breakers.stats()["openai:gpt-4o@default"]["state"] == "open"
@@ -0,0 +1,53 @@
+import asyncio
+from app.providers.client_pool import ClientPool, credential_fingerprint
+
+
+def make_client(http_client):
+    return {"http_client": http_client}
+
+def test_same_credential_reuses_client():
+    pool = ClientPool(max_clients=4, idle_seconds=60)
+    first = pool.get_client("openai", "https://api.example.com", "key-a", make_client)
+    second = pool.get_client("openai", "https://api.example.com", "key-a", make_client)
+    assert first is second
+    asyncio.run(pool.aclose())
+
+def test_credentials_share_connection_pool():
+    pool = ClientPool(max_clients=4, idle_seconds=60)
+    a = pool.get_client("openai", "https://api.example.com", "key-a", make_client)
+    b = pool.get_client("openai", "https://api.example.com", "key-b", make_client)
+    assert a is not b
+    assert a["http_client"] is b["http_client"]
+    assert pool.stats() == {"upstreams": 1, "clients": 2}
+    asyncio.run(pool.aclose())
+
+def test_lru_eviction():
+    pool = ClientPool(max_clients=2, idle_seconds=60)
+    a = pool.get_client("openai", "https://api.example.com", "key-a", make_client)
+    pool.get_client("openai", "https://api.example.com", "key-b", make_client)
+    pool.get_client("openai", "https://api.example.com", "key-a", make_client)
+    pool.get_client("openai", "https://api.example.com", "key-c", make_client)
+    # key-b was least recently used
+    assert pool.stats()["clients"] == 2
+    assert pool.get_client("openai", "https://api.example.com", "key-a", make_client) is a
+    asyncio.run(pool.aclose())
+
+def test_idle_eviction():
+    pool = ClientPool(max_clients=4, idle_seconds=10)
+    pool.get_client("openai", "https://api.example.com", "key-a", make_client)
+    assert pool.evict_idle() == 0
+    assert pool.evict_idle(now=float("inf")) == 1
+    assert pool.stats()["clients"] == 0
+    asyncio.run(pool.aclose())
+
+def test_aclose_closes_http_clients():
+    pool = ClientPool(max_clients=4, idle_seconds=60)
+    http_client = pool.http_client("http://localhost:11434")
+    asyncio.run(pool.aclose())
+    assert http_client.is_closed
+    assert pool.http_client("http://localhost:11434") is not http_client
+
+def test_credential_fingerprint_hides_key():
+    fingerprint = credential_fingerprint("sk-secret")
+    assert "sk-secret" not in fingerprint
+    assert credential_fingerprint(None) == ""
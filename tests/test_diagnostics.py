@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import time
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.agents import agent_service as agent_service_module
+from app.providers import policy as policy_module
+from app.agents.cache import ResponseCache
+from app.api.schemas import SuccessResponse, Result, Usage, Billing, Timing
+from app.core.config import settings
+from app.core.diagnostics import LoopLagMonitor
+
+
+def blocking_json_dump():
+    time.sleep(0.3)
+
+def test_stalled_loop_logs_the_blocking_stack(monkeypatch, caplog):
+    monkeypatch.setattr(settings, "LOOP_LAG_SAMPLE_INTERVAL_MS", 10)
+    monkeypatch.setattr(settings, "LOOP_STALL_THRESHOLD_MS", 50)
+
+    async def run():
+        monitor = LoopLagMonitor()
+        await monitor.start()
+        await asyncio.sleep(0.05)
+        blocking_json_dump()
+        await asyncio.sleep(0.05)
+        await monitor.aclose()
+        return monitor
+
+    with caplog.at_level(logging.WARNING, logger="app.core.diagnostics"):
+        monitor = asyncio.run(run())
+    assert monitor.stalls == 1
+    assert monitor.stats()["max_lag_ms"] >= 250
+    assert "blocking_json_dump" in caplog.text
+
+
+class SlowProvider:
+    async def invoke(self, request):
+        await asyncio.sleep(0.05)
+        time.sleep(0.05)  # synchronous work on the event loop
+        return SuccessResponse(
+            trace_id=request.trace_id,
+            provider=request.provider,
+            model=request.model,
+            result=Result(type="text", text="ok"),
+            usage=Usage(input_tokens=10, output_tokens=2, total_tokens=12),
+            billing=Billing(pricing_source="unknown"),
+            timing=Timing(started_at="", ended_at="", duration_ms=0, provider_duration_ms=100),
+        )
+
+@pytest.fixture
+def client(monkeypatch):
+    provider = SlowProvider()
+    monkeypatch.setattr(agent_service_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(policy_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(agent_service_module, "response_cache", ResponseCache(max_entries=8, ttl_seconds=60, sqlite_path=""))
+    monkeypatch.setattr(settings, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(settings, "GATEWAY_API_KEY", "admin-secret")
+    return TestClient(app)
+
+BODY = {
+    "provider": "openai",
+    "model": "gpt-4o-mini",
+    "auth": {"type": "api_key", "key": "sk-test"},
+    "input": {"messages": [{"role": "user", "content": "hi"}]},
+}
+
+def test_admin_request_profile_covers_running_and_waiting_time(client):
+    admin = {"Authorization": "Bearer admin-secret"}
+    res = client.post("/v1/agent:run", json=BODY, headers={"X-Profile": "true", "X-Trace-ID": "prof-1", **admin})
+    assert res.status_code == 200
+    assert res.headers["X-Profile-Id"] == "prof-1"
+
+    profile = client.get("/v1/profiles/prof-1", headers=admin).json()["profile"]
+    assert profile["running_samples"] > 0 and profile["waiting_samples"] > 0
+    running = [stack for stack in profile["stacks"] if stack.startswith("running;")]
+    assert any("invoke" in stack and "run_agent" in stack for stack in running)
+
+def test_profiling_is_admin_only(client):
+    res = client.post("/v1/agent:run", json=BODY, headers={"X-Profile": "true", "X-Trace-ID": "prof-2"})
+    assert res.status_code == 200
+    assert "X-Profile-Id" not in res.headers
+    assert client.get("/v1/profiles/prof-2").status_code == 401
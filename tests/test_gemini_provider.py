@@ -0,0 +1,96 @@
+import asyncio
+import json
+import httpx
+import pytest
+from app.api.schemas import AgentRunRequest
+from app.core.config import settings
+from app.core.errors import UpstreamRateLimitException
+from app.providers.client_pool import client_pool
+from app.providers.gemini_provider import GeminiProvider
+
+USAGE = {"promptTokenCount": 21, "candidatesTokenCount": 4, "totalTokenCount": 25, "cachedContentTokenCount": 16}
+
+def candidate(text):
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+
+@pytest.fixture
+def gemini_upstream():
+    calls = []
+    state = {"status": 200}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        if state["status"] != 200:
+            return httpx.Response(state["status"], json={"error": {"message": "Quota exceeded."}}, headers={"Retry-After": "3"})
+        if request.url.path.endswith(":streamGenerateContent"):
+            events = [candidate('{"answer"'), {**candidate(': 42}'), "usageMetadata": USAGE}]
+            return httpx.Response(200, content="".join(f"data: {json.dumps(event)}\r\n\r\n" for event in events).encode())
+        return httpx.Response(200, json={**candidate('{"answer": 42}'), "usageMetadata": USAGE})
+
+    client_pool._http_clients[settings.GEMINI_BASE_URL] = httpx.AsyncClient(
+        base_url=settings.GEMINI_BASE_URL, transport=httpx.MockTransport(handler)
+    )
+    yield calls, state
+    client_pool._http_clients.pop(settings.GEMINI_BASE_URL, None)
+    client_pool._clients.clear()
+
+def make_request(key="key-a", **overrides):
+    return AgentRunRequest(**{
+        "provider": "gemini",
+        "model": "gemini-1.5-flash",
+        "auth": {"type": "api_key", "key": key},
+        "response_format": "json",
+        "input": {"messages": [
+            {"role": "system", "content": "Answer in JSON."},
+            {"role": "user", "content": "What is 6 x 7?"},
+            {"role": "assistant", "content": "Let me think."},
+            {"role": "user", "content": "Go on."},
+            {"role": "user", "content": "Only the number."},
+        ]},
+        **overrides,
+    })
+
+def test_invoke_maps_roles_json_mode_and_usage(gemini_upstream):
+    calls, _ = gemini_upstream
+    response = asyncio.run(GeminiProvider().invoke(make_request(seed=7)))
+
+    body = json.loads(calls[0].content)
+    assert calls[0].url.path == "/v1beta/models/gemini-1.5-flash:generateContent"
+    assert body["systemInstruction"] == {"parts": [{"text": "Answer in JSON."}]}
+    assert [(content["role"], len(content["parts"])) for content in body["contents"]] == [("user", 1), ("model", 1), ("user", 2)]
+    assert body["generationConfig"] == {"temperature": 0.2, "seed": 7, "responseMimeType": "application/json"}
+
+    assert response.result.json == {"answer": 42}
+    assert (response.usage.input_tokens, response.usage.output_tokens, response.usage.cached_input_tokens) == (21, 4, 16)
+    assert response.usage.is_estimated is False
+
+def test_credentials_are_per_request_not_global(gemini_upstream):
+    calls, _ = gemini_upstream
+    provider = GeminiProvider()
+
+    async def run():
+        await asyncio.gather(provider.invoke(make_request("key-a")), provider.invoke(make_request("key-b")))
+        await provider.invoke(make_request("key-a"))
+
+    asyncio.run(run())
+    assert sorted(call.headers["x-goog-api-key"] for call in calls) == ["key-a", "key-a", "key-b"]
+    assert len(client_pool._clients) == 2
+    client = provider._client(make_request("key-a"))
+    assert client.model("gemini-1.5-flash") is client.model("gemini-1.5-flash")
+
+def test_stream_yields_deltas_then_usage(gemini_upstream):
+    async def run():
+        return [chunk async for chunk in GeminiProvider().stream(make_request())]
+
+    chunks = asyncio.run(run())
+    assert "".join(chunk.delta for chunk in chunks) == '{"answer": 42}'
+    assert chunks[-1].usage["total_tokens"] == 25
+    assert gemini_upstream[0][0].url.params["alt"] == "sse"
+
+def test_rate_limits_are_translated(gemini_upstream):
+    _, state = gemini_upstream
+    state["status"] = 429
+    with pytest.raises(UpstreamRateLimitException) as info:
+        asyncio.run(GeminiProvider().invoke(make_request()))
+    assert info.value.message == "Quota exceeded."
+    assert info.value.headers["Retry-After"] == "3"
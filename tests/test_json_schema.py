@@ -0,0 +1,155 @@
+import json
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.core.config import settings
+from app.providers.client_pool import client_pool
+from app.utils.json_schema import SchemaCache, SchemaError, SchemaViolation, StreamValidator, compile_schema, repair_json
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "sentiment": {"enum": ["positive", "negative", "neutral"]},
+        "score": {"type": "number", "minimum": 0, "maximum": 1},
+        "tags": {"type": "array", "items": {"type": "string"}, "maxItems": 3},
+        "author": {"$ref": "#/$defs/person"},
+    },
+    "required": ["sentiment", "score"],
+    "additionalProperties": False,
+    "$defs": {"person": {"type": "object", "properties": {"name": {"type": "string"}, "friend": {"$ref": "#/$defs/person"}}, "required": ["name"]}},
+}
+
+def test_validate_reports_violations():
+    node = compile_schema(SCHEMA)
+    assert node.validate({"sentiment": "positive", "score": 0.9, "tags": ["a"], "author": {"name": "x", "friend": {"name": "y"}}}) == []
+    errors = node.validate({"sentiment": "meh", "score": 2, "extra": 1, "author": {"friend": {}}})
+    assert "$: unexpected property 'extra'" in errors
+    assert any(e.startswith("$.sentiment:") for e in errors)
+    assert "$.score: greater than 1" in errors
+    assert "$.author.friend: missing required property 'name'" in errors
+    assert compile_schema({"type": "integer"}).validate(True) != []
+    with pytest.raises(SchemaError):
+        compile_schema({"type": "strnig"})
+
+def test_schemas_are_compiled_once_per_content():
+    cache = SchemaCache(max_entries=2)
+    first = cache.get({"type": "object", "required": ["a"]})
+    assert cache.get({"required": ["a"], "type": "object"}) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def feed_chars(text: str, schema=SCHEMA) -> StreamValidator:
+    validator = StreamValidator(compile_schema(schema))
+    for c in text:
+        validator.feed(c)
+    validator.close()
+    return validator
+
+@pytest.mark.parametrize("text", [
+    '{"sentiment": "positive", "score": 0.5, "tags": ["a", "b"]}',
+    '```json\n{"sentiment": "neutral", "score": 1,}\n```',
+    'Here you go: {"sentiment": "negative", "score": 0, "tags": [],} Hope it helps!',
+    '{"sentiment": "positive", "score": 0.5, "author": {"name": "a\\"b", "friend": {"name": "c"}}}',
+])
+def test_stream_validator_accepts_what_repair_can_fix(text):
+    assert feed_chars(text).done
+
+@pytest.mark.parametrize("text", [
+    'Here is the JSON you asked for: {"a": 1}',
+    'the 2 fields, no nulls: {"a": 1}',
+    '-> {"a": 1}',
+])
+def test_preamble_letters_and_digits_dont_start_the_root(text):
+    assert repair_json(text) == ({"a": 1}, ["surrounding_text"])
+    assert feed_chars(text, {"type": "object"}).done
+
+def test_scalar_root_is_read_when_it_comes_first():
+    assert feed_chars("true", {"type": "boolean"}).done
+    with pytest.raises(SchemaViolation):
+        feed_chars("42", {"type": "string"})
+
+@pytest.mark.parametrize("text, prefix", [
+    ('{"sentiment": "positive", "mood": "happy", "score": 1}', '{"sentiment": "positive", "mood"'),
+    ('{"score": "high"}', '{"score": "'),
+    ('{"sentiment": "great", "score": 1}', '{"sentiment": "great"'),
+    ('{"tags": ["a", "b", "c", "d"]}', '{"tags": ["a", "b", "c", "'),
+    ('{"sentiment": "positive"}', '{"sentiment": "positive"}'),
+    ('{"sentiment": "positive", "score": 1 "x"}', '{"sentiment": "positive", "score": 1 "'),
+])
+def test_stream_validator_fails_at_the_first_violating_character(text, prefix):
+    validator = StreamValidator(compile_schema(SCHEMA))
+    with pytest.raises(SchemaViolation):
+        for c in text:
+            validator.feed(c)
+    assert validator.chars == len(prefix)
+
+def test_repair_json():
+    assert repair_json('{"a": 1}') == ({"a": 1}, [])
+    assert repair_json('```json\n{"a": [1, 2,],}\n```') == ({"a": [1, 2]}, ["code_fence", "trailing_commas"])
+    assert repair_json('Sure! {"a": "x, }"} Done.') == ({"a": "x, }"}, ["surrounding_text"])
+    with pytest.raises(ValueError):
+        repair_json("I can't do that.")
+
+
+@pytest.fixture
+def ollama_stream():
+    state = {"lines": [], "requests": []}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        state["requests"].append(payload)
+        if not payload["stream"]:
+            content = "".join(line["message"]["content"] for line in state["lines"])
+            return httpx.Response(200, json={**state["lines"][-1], "message": {"role": "assistant", "content": content}})
+        return httpx.Response(200, content=("\n".join(json.dumps(line) for line in state["lines"]) + "\n").encode())
+
+    client_pool._http_clients[settings.OLLAMA_BASE_URL] = httpx.AsyncClient(
+        base_url=settings.OLLAMA_BASE_URL, transport=httpx.MockTransport(handler)
+    )
+    yield state
+    client_pool._http_clients.pop(settings.OLLAMA_BASE_URL, None)
+
+def chunks(*pieces, done=True):
+    lines = [{"message": {"role": "assistant", "content": piece}, "done": False} for piece in pieces]
+    if done:
+        lines.append({"message": {"role": "assistant", "content": ""}, "done": True, "prompt_eval_count": 10, "eval_count": 5})
+    return lines
+
+BODY = {
+    "provider": "ollama",
+    "model": "llama3.1",
+    "auth": {"type": "none"},
+    "response_format": "json",
+    "json_schema": SCHEMA,
+    "max_retries": 0,
+    "cache": False,
+    "input": {"messages": [{"role": "user", "content": "Rate: great phone"}]},
+}
+
+def test_schema_requests_are_streamed_and_repaired(ollama_stream):
+    ollama_stream["lines"] = chunks("```json\n", '{"sentiment": "positive",', ' "score": 0.9,}', "\n```")
+    res = TestClient(app).post("/v1/agent:run", json=BODY)
+    assert res.status_code == 200
+    body = res.json()
+    assert body["result"] == {"type": "json", "text": None, "json": {"sentiment": "positive", "score": 0.9}}
+    assert [w["code"] for w in body["warnings"]] == ["JSON_REPAIRED"]
+    assert body["usage"]["is_estimated"] is False
+    assert ollama_stream["requests"][0]["stream"] is True
+
+def test_violation_cuts_the_call_off(ollama_stream):
+    ollama_stream["lines"] = chunks('{"sentiment": "positive", "verdict": ', '"' + "x" * 5000 + '"}')
+    res = TestClient(app).post("/v1/agent:run", json=BODY)
+    assert res.status_code == 422
+    error = res.json()["error"]
+    assert error["code"] == "JSON_INVALID"
+    assert error["details"]["aborted_after_chars"] < 100
+
+def test_invalid_schema_and_lenient_mode(ollama_stream):
+    client = TestClient(app)
+    assert client.post("/v1/agent:run", json={**BODY, "json_schema": {"type": "nope"}}).status_code == 400
+
+    ollama_stream["lines"] = chunks('{"sentiment": "positive"}')
+    res = client.post("/v1/agent:run", json={**BODY, "strict_json": False})
+    assert res.status_code == 200
+    assert res.json()["warnings"][0]["code"] == "JSON_INVALID"
+    assert ollama_stream["requests"][-1]["stream"] is False
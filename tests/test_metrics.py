@@ -0,0 +1,82 @@
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import CollectorRegistry
+from app.main import app
+from app.agents import agent_service as agent_service_module
+from app.providers import policy as policy_module
+from app.agents.cache import ResponseCache
+from app.api.schemas import SuccessResponse, Result, Usage, Billing, Timing
+from app.core.config import settings
+from app.core.metrics import GatewayMetrics
+
+
+@pytest.fixture(autouse=True)
+def priced(monkeypatch):
+    monkeypatch.setattr(settings, "PRICING_JSON", '{"openai": {"gpt-4o-mini": {"input_per_1k": 0.15, "output_per_1k": 0.6}, "o1*": {}}}')
+
+def test_overhead_is_what_remains_after_queue_and_provider():
+    registry = CollectorRegistry()
+    metrics = GatewayMetrics(registry=registry)
+    metrics.observe_request("openai", "gpt-4o-mini", "ok", duration_ms=1250, provider_duration_ms=1000, queue_wait_ms=200)
+    labels = {"provider": "openai", "model": "gpt-4o-mini", "status": "ok"}
+    assert registry.get_sample_value("gateway_overhead_seconds_sum", labels) == pytest.approx(0.05)
+    assert registry.get_sample_value("gateway_provider_duration_seconds_sum", labels) == pytest.approx(1.0)
+    assert registry.get_sample_value("gateway_request_duration_seconds_count", labels) == 1
+
+def test_usage_counters_and_limiter_gauges():
+    registry = CollectorRegistry()
+    metrics = GatewayMetrics(registry=registry)
+    metrics.observe_usage("openai", "gpt-4o-mini", 100, 20, 0.25)
+    metrics.observe_cache(hit=True)
+    metrics.sample_limiters({
+        "global": {"limit": 10, "in_flight": 3, "queued": 1},
+        "providers": {"openai:gpt-4o-mini": {"limit": 5, "in_flight": 2, "queued": 0}},
+    })
+    assert registry.get_sample_value("gateway_tokens_total", {"provider": "openai", "model": "gpt-4o-mini", "direction": "input"}) == 100
+    assert registry.get_sample_value("gateway_cost_usd_total", {"provider": "openai", "model": "gpt-4o-mini"}) == 0.25
+    assert registry.get_sample_value("gateway_response_cache_total", {"result": "hit"}) == 1
+    assert registry.get_sample_value("gateway_in_flight", {"limiter": "openai:gpt-4o-mini"}) == 2
+
+def test_model_label_is_bounded_to_priced_and_configured_models(monkeypatch):
+    monkeypatch.setattr(settings, "CONTEXT_WINDOWS_JSON", '{"ollama:llama3.1": 8192}')
+    registry = CollectorRegistry()
+    metrics = GatewayMetrics(registry=registry)
+    for model in ("gpt-4o-mini-2024-07-18", "o1-preview", "llama3.1", *(f"made-up-{i}" for i in range(50))):
+        metrics.observe_usage("ollama" if model == "llama3.1" else "openai", model, 1, 1, None)
+    models = {sample.labels["model"] for metric in registry.collect() if metric.name == "gateway_tokens" for sample in metric.samples}
+    assert models == {"gpt-4o-mini", "o1*", "llama3.1", "other"}
+    assert registry.get_sample_value("gateway_tokens_total", {"provider": "openai", "model": "other", "direction": "input"}) == 50
+
+
+class FakeProvider:
+    async def invoke(self, request):
+        return SuccessResponse(
+            trace_id=request.trace_id,
+            provider=request.provider,
+            model=request.model,
+            result=Result(type="text", text="ok"),
+            usage=Usage(input_tokens=10, output_tokens=2, total_tokens=12),
+            billing=Billing(pricing_source="unknown"),
+            timing=Timing(started_at="", ended_at="", duration_ms=0, provider_duration_ms=5),
+        )
+
+def test_metrics_endpoint_exposes_request_histograms(monkeypatch):
+    monkeypatch.setattr(settings, "CONTEXT_WINDOWS_JSON", '{"ollama:metrics-test": 8192}')
+    provider = FakeProvider()
+    monkeypatch.setattr(agent_service_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(policy_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(agent_service_module, "response_cache", ResponseCache(max_entries=8, ttl_seconds=60, sqlite_path=""))
+    client = TestClient(app)
+    body = {
+        "provider": "ollama",
+        "model": "metrics-test",
+        "auth": {"type": "none"},
+        "input": {"messages": [{"role": "user", "content": "hi"}]},
+    }
+    assert client.post("/v1/agent:run", json=body).status_code == 200
+
+    res = client.get("/metrics")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain")
+    assert 'gateway_request_duration_seconds_count{model="metrics-test",provider="ollama",status="ok"} 1.0' in res.text
+    assert 'gateway_tokens_total{direction="output",model="metrics-test",provider="ollama"} 2.0' in res.text
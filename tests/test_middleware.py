@@ -0,0 +1,167 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from starlette.background import BackgroundTask
+from starlette.responses import Response
+from app.main import app
+from app.api.middleware import GatewayMiddleware
+from app.core.concurrency import Limiter, admission
+from app.core.config import settings
+
+SCOPE = {"type": "http", "method": "POST", "path": "/", "headers": [(b"x-trace-id", b"t-1")]}
+
+
+@pytest.fixture
+def small_limit(monkeypatch):
+    monkeypatch.setattr(settings, "MAX_REQUEST_BYTES", 100)
+
+def test_chunked_body_over_limit_is_rejected_while_streaming_in(small_limit):
+    def body():
+        for _ in range(10):
+            yield b'{"padding": "' + b"x" * 20 + b'"}'
+
+    res = TestClient(app).post("/v1/agent:run", content=body(), headers={"Content-Type": "application/json", "X-Trace-ID": "big-1"})
+    assert res.status_code == 413
+    assert res.json()["error"]["code"] == "PAYLOAD_TOO_LARGE"
+    assert res.json()["trace_id"] == "big-1"
+    assert res.headers["X-Trace-ID"] == "big-1"
+
+def test_declared_length_over_limit_is_rejected_upfront(small_limit):
+    res = TestClient(app).post("/v1/agent:run", content=b"x" * 101)
+    assert res.status_code == 413
+    assert "X-Process-Time-Ms" in res.headers
+
+def test_admission_rejection_carries_trace_id(monkeypatch):
+    monkeypatch.setattr(admission, "global_limiter", Limiter("global", 0, 0, 1))
+    res = TestClient(app).get("/health", headers={"X-Trace-ID": "busy-1"})
+    assert res.status_code == 429
+    assert res.json()["trace_id"] == "busy-1"
+    assert "Retry-After" in res.headers
+
+def test_response_is_forwarded_without_buffering():
+    release = asyncio.Event()
+    sent = []
+
+    async def inner(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"first", "more_body": True})
+        await release.wait()
+        await send({"type": "http.response.body", "body": b"second"})
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    async def main():
+        task = asyncio.create_task(GatewayMiddleware(inner)(dict(SCOPE), receive, send))
+        await asyncio.sleep(0.01)
+        assert [message.get("body") for message in sent] == [None, b"first"]
+        assert (b"x-trace-id", b"t-1") in sent[0]["headers"]
+        release.set()
+        await task
+
+    asyncio.run(main())
+    assert sent[-1]["body"] == b"second"
+
+def test_client_disconnect_cancels_the_request_and_frees_its_slot(monkeypatch):
+    monkeypatch.setattr(admission, "global_limiter", Limiter("global", 1, 0, 1))
+    outcome = {}
+
+    async def inner(scope, receive, send):
+        await receive()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            outcome["cancelled"] = True
+            raise
+
+    async def main():
+        messages = asyncio.Queue()
+        messages.put_nowait({"type": "http.request", "body": b"{}"})
+
+        async def send(message):
+            pass
+
+        task = asyncio.create_task(GatewayMiddleware(inner)(dict(SCOPE), messages.get, send))
+        await asyncio.sleep(0.01)
+        assert admission.global_limiter.in_flight == 1
+        messages.put_nowait({"type": "http.disconnect"})
+        await asyncio.wait_for(task, 1)
+
+    asyncio.run(main())
+    assert outcome == {"cancelled": True}
+    assert admission.global_limiter.in_flight == 0
+
+def test_bodyless_request_is_watched_without_reading_the_body(monkeypatch):
+    monkeypatch.setattr(admission, "global_limiter", Limiter("global", 1, 0, 1))
+    outcome = {}
+
+    async def inner(scope, receive, send):
+        # A GET endpoint never calls receive(); a disconnect must still cancel it.
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            outcome["cancelled"] = True
+            raise
+
+    async def main():
+        messages = asyncio.Queue()
+        messages.put_nowait({"type": "http.request", "body": b""})
+
+        async def send(message):
+            pass
+
+        task = asyncio.create_task(GatewayMiddleware(inner)({**SCOPE, "method": "GET"}, messages.get, send))
+        await asyncio.sleep(0.01)
+        messages.put_nowait({"type": "http.disconnect"})
+        await asyncio.wait_for(task, 1)
+
+    asyncio.run(main())
+    assert outcome == {"cancelled": True}
+    assert admission.global_limiter.in_flight == 0
+
+def test_bodyless_request_still_reads_an_empty_body():
+    bodies = []
+
+    async def inner(scope, receive, send):
+        bodies.append(await receive())
+        await Response(b"ok")(scope, receive, send)
+
+    async def main():
+        messages = asyncio.Queue()
+        messages.put_nowait({"type": "http.request", "body": b""})
+
+        async def send(message):
+            pass
+
+        await asyncio.wait_for(GatewayMiddleware(inner)({**SCOPE, "method": "GET"}, messages.get, send), 1)
+
+    asyncio.run(main())
+    assert bodies == [{"type": "http.request", "body": b"", "more_body": False}]
+
+def test_disconnect_after_the_response_leaves_background_tasks_running():
+    ran = []
+
+    async def background():
+        await asyncio.sleep(0.01)
+        ran.append(True)
+
+    async def inner(scope, receive, send):
+        await receive()  # read the body, as endpoints do
+        await Response(b"ok", background=BackgroundTask(background))(scope, receive, send)
+
+    async def main():
+        messages = asyncio.Queue()
+        messages.put_nowait({"type": "http.request", "body": b""})
+
+        async def send(message):
+            # Like uvicorn: the disconnect arrives as soon as the response is complete.
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                messages.put_nowait({"type": "http.disconnect"})
+
+        await asyncio.wait_for(GatewayMiddleware(inner)(dict(SCOPE), messages.get, send), 1)
+
+    asyncio.run(main())
+    assert ran == [True]
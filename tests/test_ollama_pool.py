@@ -0,0 +1,121 @@
+import asyncio
+import json
+import httpx
+import pytest
+from app.api.schemas import AgentRunRequest
+from app.core.config import settings
+from app.core.errors import ProviderException
+from app.providers import ollama_provider as ollama_provider_module
+from app.providers.client_pool import client_pool
+from app.providers.ollama_pool import OllamaBackendPool
+from app.providers.ollama_provider import OllamaProvider
+
+URLS = ["http://gpu1:11434", "http://gpu2:11434", "http://gpu3:11434"]
+
+
+class FakeOllama:
+    """
+    A stand-in Ollama server: answers /api/chat and /api/ps, or fails with `status`.
+    """
+    def __init__(self, url, loaded=(), status=200):
+        self.url = url
+        self.loaded = list(loaded)
+        self.status = status
+        self.chats = 0
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        if self.status != 200:
+            return httpx.Response(self.status)
+        if request.url.path == "/api/ps":
+            return httpx.Response(200, json={"models": [{"name": name} for name in self.loaded]})
+        self.chats += 1
+        model = json.loads(request.content)["model"]
+        return httpx.Response(200, json={"message": {"content": self.url}, "prompt_eval_count": 1, "eval_count": 1, "model": model})
+
+@pytest.fixture
+def servers(monkeypatch):
+    servers = {url: FakeOllama(url) for url in URLS}
+    for url, server in servers.items():
+        client_pool._http_clients[url] = httpx.AsyncClient(base_url=url, transport=httpx.MockTransport(server.handler))
+    yield servers
+    for url in URLS:
+        client_pool._http_clients.pop(url, None)
+
+def use_pool(monkeypatch, pool):
+    monkeypatch.setattr(ollama_provider_module, "ollama_pool", pool)
+
+def make_request(model="llama3.1") -> AgentRunRequest:
+    return AgentRunRequest(
+        provider="ollama",
+        trace_id="trace",
+        model=model,
+        auth={"type": "none"},
+        input={"messages": [{"role": "user", "content": "hi"}]},
+    )
+
+def test_backend_urls_from_settings(monkeypatch):
+    monkeypatch.setattr(settings, "OLLAMA_HOSTS", "http://a:11434/, http://b:11434")
+    assert settings.OLLAMA_BACKEND_URLS == ["http://a:11434", "http://b:11434"]
+    monkeypatch.setattr(settings, "OLLAMA_HOSTS", "")
+    assert settings.OLLAMA_BACKEND_URLS == [settings.OLLAMA_BASE_URL]
+
+def test_least_outstanding_routing():
+    pool = OllamaBackendPool(URLS, routing="least_outstanding")
+    pool.backends[0].outstanding = 3
+    pool.backends[1].outstanding = 1
+    pool.backends[2].outstanding = 2
+    assert pool.pick("llama3.1").url == URLS[1]
+
+def test_p2c_never_picks_the_busiest_of_its_pair():
+    pool = OllamaBackendPool(URLS, routing="p2c")
+    pool.backends[0].outstanding = 10
+    picks = {pool.pick("llama3.1").url for _ in range(50)}
+    assert URLS[0] not in picks
+
+def test_prefers_backends_with_model_loaded(servers, monkeypatch):
+    servers[URLS[2]].loaded = ["llama3.1:latest"]
+    pool = OllamaBackendPool(URLS, routing="least_outstanding")
+    asyncio.run(pool.check_all())
+    pool.backends[2].outstanding = 5
+    assert pool.pick("llama3.1").url == URLS[2]
+    assert pool.pick("mistral").url != URLS[2]
+
+def test_failing_backend_is_ejected_and_recovers(servers, monkeypatch):
+    monkeypatch.setattr(settings, "OLLAMA_EJECT_AFTER_FAILURES", 2)
+    servers[URLS[0]].status = 503
+    pool = OllamaBackendPool(URLS[:2], routing="least_outstanding")
+    # The warm backend gets traffic first, until it is ejected.
+    pool.backends[0].loaded_models = {"llama3.1:latest"}
+    use_pool(monkeypatch, pool)
+    provider = OllamaProvider()
+
+    async def main():
+        for _ in range(6):
+            try:
+                await provider.invoke(make_request())
+            except ProviderException:
+                pass
+
+    asyncio.run(main())
+    assert not pool.backends[0].available
+    assert pool.backends[1].available
+    assert servers[URLS[1]].chats >= 4
+
+    servers[URLS[0]].status = 200
+    asyncio.run(pool.check_all())
+    assert pool.backends[0].available
+
+def test_no_available_backends(monkeypatch):
+    monkeypatch.setattr(settings, "OLLAMA_EJECT_AFTER_FAILURES", 1)
+    pool = OllamaBackendPool(URLS[:1])
+    pool.record_failure(pool.backends[0])
+    with pytest.raises(ProviderException):
+        pool.pick("llama3.1")
+
+def test_successful_call_marks_model_loaded(servers, monkeypatch):
+    pool = OllamaBackendPool(URLS[:1])
+    use_pool(monkeypatch, pool)
+    response = asyncio.run(OllamaProvider().invoke(make_request()))
+    assert response.result.text == URLS[0]
+    assert pool.backends[0].loaded_models == {"llama3.1:latest"}
+    assert pool.backends[0].outstanding == 0
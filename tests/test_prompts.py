@@ -0,0 +1,86 @@
+import json
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.agents.prompts import TABLE_HINT, construct_prompt, encode_data, line_breaks, system_prompt
+from app.core.config import settings
+from app.providers.client_pool import client_pool
+
+ORDERS = {"customer": "ACME", "orders": [{"id": i, "sku": f"SKU-{i}", "qty": i % 3, "note": "ok"} for i in range(20)]}
+
+def test_system_prompt_is_byte_identical_for_equal_schemas():
+    a = system_prompt("json", {"type": "object", "properties": {"b": {"type": "string"}, "a": {"type": "number"}}})
+    b = system_prompt("json", {"properties": {"a": {"type": "number"}, "b": {"type": "string"}}, "type": "object"})
+    assert a is b
+    assert '{"properties":{"a":{"type":"number"},"b":{"type":"string"}},"type":"object"}' in a
+    assert system_prompt("text", {"type": "object"}) == system_prompt("text")
+
+def test_auto_encoding_tabulates_uniform_lists():
+    text, stats = encode_data(ORDERS, "auto", 0)
+    assert stats.data_encoding == "table"
+    assert text.startswith(TABLE_HINT)
+    table = json.loads(text.split("\n", 1)[1])
+    assert table["orders"]["columns"] == ["id", "sku", "qty", "note"]
+    assert table["orders"]["rows"][3] == [3, "SKU-3", 0, "ok"]
+    assert set(stats.estimates) == {"pretty", "minified", "table"}
+    assert stats.estimates["table"] < stats.estimates["minified"] < stats.estimates["pretty"]
+    assert stats.saved_tokens == stats.baseline_tokens - stats.data_tokens > 0
+
+@pytest.mark.parametrize("data, encoding, expected", [
+    ({"a": [1, 2], "b": {"c": "d"}}, "auto", "minified"),
+    ({"rows": [{"a": 1}, {"b": 2}]}, "auto", "minified"),
+    (ORDERS, "minified", "minified"),
+    (ORDERS, "pretty", "pretty"),
+])
+def test_encodings_round_trip(data, encoding, expected):
+    text, stats = encode_data(data, encoding, 0)
+    assert stats.data_encoding == expected
+    assert json.loads(text) == data
+
+@pytest.mark.parametrize("data", [ORDERS, {"a": [1, [2, {}]], "b": {"c": [], "d": None}}])
+def test_pretty_baseline_is_estimated_without_indenting(data):
+    minified = json.dumps(data, separators=(",", ":")).encode()
+    assert line_breaks(minified) == json.dumps(data, indent=2).count("\n")
+    _, stats = encode_data(data, "minified", 0)
+    assert stats.baseline_tokens == stats.estimates["minified"] + line_breaks(minified)
+
+def test_long_fields_are_truncated():
+    text, stats = encode_data({"title": "short", "body": "x" * 500}, "minified", 100)
+    assert stats.truncated_fields == 1
+    assert json.loads(text)["body"] == "x" * 100 + "…[400 more chars]"
+
+def test_layout_puts_stable_parts_first():
+    messages, stats = construct_prompt("Summarize.", ORDERS, "openai", "json", {"type": "object"})
+    assert [message["role"] for message in messages] == ["system", "user", "user"]
+    assert messages[1]["content"] == "Summarize."
+    assert stats.data_encoding == "table"
+    assert construct_prompt("Hi", "plain text", "openai", "text")[1] is None
+
+
+@pytest.fixture
+def ollama_upstream(monkeypatch):
+    monkeypatch.setattr(settings, "CACHE_ENABLED", False)
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(json.loads(request.content))
+        return httpx.Response(200, json={"message": {"role": "assistant", "content": "fine"}, "done": True, "prompt_eval_count": 50, "eval_count": 1})
+
+    client_pool._http_clients[settings.OLLAMA_BASE_URL] = httpx.AsyncClient(
+        base_url=settings.OLLAMA_BASE_URL, transport=httpx.MockTransport(handler)
+    )
+    yield requests
+    client_pool._http_clients.pop(settings.OLLAMA_BASE_URL, None)
+
+def test_response_reports_encoding_savings(ollama_upstream):
+    res = TestClient(app).post("/v1/agent:run", json={
+        "provider": "ollama",
+        "model": "llama3.1",
+        "auth": {"type": "none"},
+        "input": {"instruction": "Check the orders", "data": ORDERS, "data_encoding": "minified"},
+    })
+    assert res.status_code == 200
+    prompt = res.json()["prompt"]
+    assert prompt["data_encoding"] == "minified" and prompt["saved_tokens"] > 0
+    assert json.dumps(ORDERS, separators=(",", ":")) in ollama_upstream[0]["messages"][-1]["content"]
@@ -1,5 +1,13 @@
+import os
+import subprocess
+import sys
+from importlib import metadata
 import pytest
-from app.providers.factory import get_provider
+from pydantic import ValidationError
+from app.api.schemas import AgentRunRequest
+from app.core.config import settings
+from app.providers import factory
+from app.providers.factory import ENTRY_POINT_GROUP, ProviderRegistry, get_provider, provider_registry
 from app.providers.openai_provider import OpenAIProvider
 from app.providers.gemini_provider import GeminiProvider
 from app.providers.ollama_provider import OllamaProvider
@@ -23,3 +31,57 @@ def test_get_provider_case_insensitive():
 def test_get_unknown_provider():
     with pytest.raises(ValueError):
         get_provider("unknown-provider")
+
+def test_get_provider_returns_shared_instance():
+    assert get_provider("ollama") is get_provider("OLLAMA")
+
+def test_disabled_providers_are_rejected(monkeypatch):
+    monkeypatch.setattr(settings, "ENABLED_PROVIDERS", "ollama")
+    assert provider_registry.names() == ["ollama"]
+    with pytest.raises(ValueError):
+        get_provider("openai")
+    with pytest.raises(ValidationError):
+        AgentRunRequest(provider="openai", model="m", auth={"type": "none"}, input={"instruction": "hi"})
+    request = AgentRunRequest(provider="Ollama", model="m", auth={"type": "none"}, input={"instruction": "hi"})
+    assert request.provider == "ollama"
+
+def test_declared_capabilities_are_listed_without_importing():
+    registry = ProviderRegistry()
+    registry.register("lazy", "no_such_module:Provider", ["chat_completions"])
+    assert registry.spec("lazy").capabilities == ["chat_completions"]
+    assert registry.loaded() == []
+
+
+class AcmeProvider(OllamaProvider):
+    capabilities = ("chat_completions", "vision")
+
+def test_entry_point_providers_are_registered(monkeypatch):
+    entry_points = {ENTRY_POINT_GROUP: [
+        metadata.EntryPoint("acme", f"{__name__}:AcmeProvider", ENTRY_POINT_GROUP),
+        metadata.EntryPoint("openai", "no_such_module:Provider", ENTRY_POINT_GROUP),
+    ]}
+    monkeypatch.setattr(factory.metadata, "entry_points", lambda group: entry_points.get(group, []))
+    registry = ProviderRegistry()
+    registry.register("openai", "app.providers.openai_provider:OpenAIProvider")
+    assert registry.names() == ["openai", "acme"]
+    assert registry.spec("acme").capabilities == ["chat_completions", "vision"]
+    assert isinstance(registry.get("ACME"), AcmeProvider)
+    assert registry.spec("openai").target == "app.providers.openai_provider:OpenAIProvider"
+
+def test_app_import_does_not_load_provider_sdks():
+    code = "import sys, app.main; print(sorted(m for m in ('openai', 'app.providers.openai_provider') if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "[]"
+
+def test_ollama_pool_is_not_started_when_ollama_is_disabled():
+    code = (
+        "import sys\n"
+        "from fastapi.testclient import TestClient\n"
+        "from app.main import app\n"
+        "with TestClient(app) as client:\n"
+        "    backends = client.get('/v1/backends').json()\n"
+        "print(backends, 'app.providers.ollama_pool' in sys.modules)"
+    )
+    env = {**os.environ, "ENABLED_PROVIDERS": "openai"}
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, env=env)
+    assert out.stdout.strip() == "{} False"
@@ -0,0 +1,219 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.agents import agent_service as agent_service_module
+from app.agents.agent_service import AgentService
+from app.api.schemas import AgentRunRequest, SuccessResponse, Result, Usage, Billing, Timing
+from app.core import rate_limit
+from app.core.config import settings
+from app.core.errors import TenantRateLimitException
+from app.core.rate_limit import TenantRateLimiter
+from app.core.shared_state import SharedState
+from app.providers import policy as policy_module
+from app.providers.base import StreamChunk
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "time", clock.time)
+    return clock
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(settings, "TENANT_REQUESTS_PER_MINUTE", 2)
+    monkeypatch.setattr(settings, "TENANT_TOKENS_PER_MINUTE", 1000)
+
+def test_requests_bucket_rejects_with_retry_after_and_refills(clock, limits):
+    limiter = TenantRateLimiter()
+    limiter.admit("a", lambda: 10)
+    limiter.admit("a", lambda: 10)
+    with pytest.raises(TenantRateLimitException) as e:
+        limiter.admit("a", lambda: 10)
+    assert e.value.headers["Retry-After"] == "30"
+    assert e.value.details["limit"] == "requests_per_minute"
+    limiter.admit("b", lambda: 10)  # other tenants are unaffected
+    clock.now += 30
+    limiter.admit("a", lambda: 10)
+
+def test_tokens_are_trued_up_after_the_call(clock, limits):
+    limiter = TenantRateLimiter()
+    charged = limiter.admit("a", lambda: 100)
+    assert charged == 100
+    # The call used far more than estimated: the bucket goes into debt.
+    limiter.true_up("a", charged, 1500)
+    clock.now += 30
+    with pytest.raises(TenantRateLimitException) as e:
+        limiter.admit("a", lambda: 100)
+    assert e.value.details["limit"] == "tokens_per_minute"
+    assert e.value.retry_after == 6  # 1000 - 100 - 1400 = -500, back to 0 after 30s, 100 more takes 6s
+
+def test_unlimited_tenants_skip_the_estimate(clock):
+    def estimate():
+        raise AssertionError("estimated without a tokens limit")
+    assert TenantRateLimiter().admit("a", estimate) == 0
+
+def test_idle_buckets_are_evicted(clock, limits):
+    limiter = TenantRateLimiter()
+    limiter.admit("a", lambda: 10)
+    clock.now += 60
+    limiter.admit("b", lambda: 10)
+    assert len(limiter._buckets) == 4
+    clock.now += rate_limit.IDLE_SECONDS - 30
+    limiter.admit("b", lambda: 10)
+    assert sorted(limiter._buckets) == ["bucket:rpm:b", "bucket:tpm:b"]
+
+def test_per_tenant_overrides(clock, limits, monkeypatch):
+    monkeypatch.setattr(settings, "TENANT_RATE_LIMITS_JSON", '{"big": {"requests_per_minute": 100}}')
+    limiter = TenantRateLimiter()
+    for _ in range(10):
+        limiter.admit("big", lambda: 10)
+
+def test_new_tenants_share_an_overflow_bucket_once_the_table_is_full(clock, limits, monkeypatch):
+    monkeypatch.setattr(settings, "TENANT_MAX_BUCKETS", 2)
+    limiter = TenantRateLimiter()
+    limiter.admit("a", lambda: 10)
+    limiter.admit("b", lambda: 10)
+    with pytest.raises(TenantRateLimitException):
+        for tenant in ("c", "d", "e"):
+            limiter.admit(tenant, lambda: 10)
+    assert sorted(limiter._buckets) == ["bucket:rpm:*overflow", "bucket:rpm:a", "bucket:tpm:*overflow", "bucket:tpm:a"]
+
+def test_full_shared_state_falls_back_to_the_overflow_bucket(clock, limits, tmp_path):
+    limiter = TenantRateLimiter(SharedState(str(tmp_path / "state"), slots=8))
+    for tenant in ("a", "b"):
+        limiter.admit(tenant, lambda: 10)  # a and b fill the four slots buckets may take
+    limiter.admit("c", lambda: 10)
+    limiter.admit("d", lambda: 10)
+    with pytest.raises(TenantRateLimitException):
+        limiter.admit("e", lambda: 10)
+    assert limiter.shared.acquire("slots:global", 10)  # the rest of the table is still usable
+
+def test_buckets_are_shared_between_workers(clock, limits, tmp_path):
+    path = str(tmp_path / "state")
+    first, second = TenantRateLimiter(SharedState(path, slots=16)), TenantRateLimiter(SharedState(path, slots=16))
+    first.admit("a", lambda: 10)
+    second.admit("a", lambda: 10)
+    with pytest.raises(TenantRateLimitException):
+        first.admit("a", lambda: 10)
+
+
+class EchoProvider:
+    async def invoke(self, request):
+        return SuccessResponse(
+            trace_id=request.trace_id,
+            provider=request.provider,
+            model=request.model,
+            result=Result(type="text", text="ok"),
+            usage=Usage(input_tokens=5, output_tokens=1, total_tokens=6),
+            billing=Billing(pricing_source="unknown"),
+            timing=Timing(started_at="", ended_at="", duration_ms=0, provider_duration_ms=1),
+        )
+
+def test_run_endpoint_returns_429_per_tenant(limits, monkeypatch):
+    monkeypatch.setattr(settings, "GATEWAY_API_KEY", "front-end-key")
+    provider = EchoProvider()
+    monkeypatch.setattr(agent_service_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(policy_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(agent_service_module, "rate_limiter", TenantRateLimiter())
+    body = {
+        "provider": "openai",
+        "model": "gpt-4o-mini",
+        "auth": {"type": "none"},
+        "input": {"instruction": "hi"},
+        "cache": False,
+    }
+    client = TestClient(app)
+    trusted = {"Authorization": "Bearer front-end-key"}
+    for _ in range(2):
+        assert client.post("/v1/agent:run", json=body, headers={**trusted, "X-Tenant-ID": "noisy"}).status_code == 200
+    res = client.post("/v1/agent:run", json=body, headers={**trusted, "X-Tenant-ID": "noisy"})
+    assert res.status_code == 429
+    assert res.json()["error"]["code"] == "TENANT_RATE_LIMIT"
+    assert int(res.headers["Retry-After"]) > 0
+    assert client.post("/v1/agent:run", json=body, headers={**trusted, "X-Tenant-ID": "quiet"}).status_code == 200
+
+    # Without the gateway key the header is ignored: rotating it doesn't reset the caller's limit.
+    for tenant in ("x", "y"):
+        assert client.post("/v1/agent:run", json=body, headers={"X-Tenant-ID": tenant}).status_code == 200
+    assert client.post("/v1/agent:run", json=body, headers={"X-Tenant-ID": "z"}).status_code == 429
+
+def test_batch_items_are_charged_to_their_own_tenants(limits, monkeypatch):
+    provider = EchoProvider()
+    monkeypatch.setattr(agent_service_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(policy_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(agent_service_module, "rate_limiter", TenantRateLimiter())
+
+    def item(key):
+        return {
+            "provider": "openai",
+            "model": "gpt-4o-mini",
+            "auth": {"type": "api_key", "key": key},
+            "input": {"instruction": "hi"},
+            "cache": False,
+        }
+
+    client = TestClient(app)
+    res = client.post("/v1/agent:batch", json={"items": [item("sk-quiet"), item("sk-noisy"), item("sk-noisy"), item("sk-noisy")]})
+    assert res.status_code == 200
+    results = res.json()["results"]
+    assert results[0]["ok"]
+    assert [result["ok"] for result in results[1:]].count(False) == 1
+    assert [result["error"]["code"] for result in results if not result["ok"]] == ["TENANT_RATE_LIMIT"]
+
+def test_ollama_credentials_dont_make_new_tenants(limits, monkeypatch):
+    provider = EchoProvider()
+    monkeypatch.setattr(agent_service_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(policy_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(agent_service_module, "rate_limiter", TenantRateLimiter())
+    client = TestClient(app)
+    statuses = [
+        client.post("/v1/agent:run", json={
+            "provider": "ollama",
+            "model": "llama3",
+            "auth": {"type": "api_key", "key": f"made-up-{n}"},
+            "input": {"instruction": "hi"},
+            "cache": False,
+        }).status_code
+        for n in range(3)
+    ]
+    assert statuses == [200, 200, 429]
+
+class SettlementRecorder:
+    def __init__(self):
+        self.settled = []
+
+    def admit(self, tenant, estimate_tokens):
+        return 50
+
+    def true_up(self, tenant, charged, actual_tokens):
+        self.settled.append((charged, actual_tokens))
+
+class EndlessStream:
+    async def stream(self, request):
+        yield StreamChunk(delta="hello " * 10)
+        await asyncio.sleep(10)
+
+def test_stream_abandoned_by_the_client_is_settled(monkeypatch):
+    recorder = SettlementRecorder()
+    monkeypatch.setattr(agent_service_module, "get_provider", lambda name: EndlessStream())
+    monkeypatch.setattr(agent_service_module, "rate_limiter", recorder)
+    request = AgentRunRequest(provider="openai", model="gpt-4o-mini", auth={"type": "none"}, input={"instruction": "hi"})
+
+    async def main():
+        events = AgentService.stream_agent(request, "t")
+        await events.__anext__()
+        await events.aclose()  # what a disconnect does to the response's generator
+
+    asyncio.run(main())
+    [(charged, used)] = recorder.settled
+    assert charged == 50 and used > 0
@@ -0,0 +1,101 @@
+import asyncio
+import pytest
+from app.agents import agent_service as agent_service_module
+from app.providers import policy as policy_module
+from app.agents.agent_service import AgentService
+from app.agents.cache import ResponseCache, MemoryCache, request_cache_key
+from app.api.schemas import AgentRunRequest, SuccessResponse, Result, Usage, Billing, Timing
+from app.core.config import settings
+
+
+def make_request(**overrides) -> AgentRunRequest:
+    body = {
+        "provider": "openai",
+        "model": "gpt-4o-mini",
+        "auth": {"type": "api_key", "key": "key-a"},
+        "input": {"messages": [{"role": "user", "content": "Classify: great product"}]},
+        "temperature": 0,
+    }
+    body.update(overrides)
+    return AgentRunRequest(**body)
+
+def make_response(request: AgentRunRequest) -> SuccessResponse:
+    return SuccessResponse(
+        trace_id=request.trace_id or "trace",
+        provider=request.provider,
+        model=request.model,
+        result=Result(type="text", text="positive"),
+        usage=Usage(input_tokens=10, output_tokens=1, total_tokens=11),
+        billing=Billing(pricing_source="unknown"),
+        timing=Timing(started_at="", ended_at="", duration_ms=0, provider_duration_ms=120),
+    )
+
+class CountingProvider:
+    def __init__(self):
+        self.calls = 0
+
+    async def invoke(self, request):
+        self.calls += 1
+        return make_response(request)
+
+@pytest.fixture
+def provider(monkeypatch):
+    provider = CountingProvider()
+    monkeypatch.setattr(agent_service_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(policy_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(agent_service_module, "response_cache", ResponseCache(max_entries=8, ttl_seconds=60, sqlite_path=""))
+    return provider
+
+def test_cache_key_ignores_auth_and_trace():
+    a = make_request(trace_id="t1")
+    b = make_request(auth={"type": "api_key", "key": "key-b"}, trace_id="t2")
+    assert request_cache_key(a) == request_cache_key(b)
+
+def test_cache_key_depends_on_sampling_params():
+    assert request_cache_key(make_request()) != request_cache_key(make_request(temperature=0.5))
+    assert request_cache_key(make_request()) != request_cache_key(make_request(response_format="json"))
+
+def test_memory_cache_lru_and_ttl():
+    cache = MemoryCache(max_entries=2, ttl_seconds=60)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    cache.set("d", "4", expires_at=0)
+    assert cache.get("d") is None
+
+def test_run_agent_serves_identical_request_from_cache(provider):
+    first = asyncio.run(AgentService.run_agent(make_request()))
+    second = asyncio.run(AgentService.run_agent(make_request(auth={"type": "api_key", "key": "key-b"})))
+    assert provider.calls == 1
+    assert not first.usage.cached
+    assert second.usage.cached
+    assert second.billing.estimated_cost == 0
+    assert [w.code for w in second.warnings] == ["CACHE_HIT"]
+    assert second.trace_id != first.trace_id
+
+def test_run_agent_cache_bypass(provider):
+    asyncio.run(AgentService.run_agent(make_request()))
+    response = asyncio.run(AgentService.run_agent(make_request(cache=False)))
+    assert provider.calls == 2
+    assert not response.usage.cached
+
+def test_non_deterministic_requests_are_not_cached(provider):
+    asyncio.run(AgentService.run_agent(make_request(temperature=0.7)))
+    asyncio.run(AgentService.run_agent(make_request(temperature=0.7)))
+    assert provider.calls == 2
+
+def test_sqlite_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "cache.db")
+    request = make_request(trace_id="t1")
+    first = ResponseCache(max_entries=8, ttl_seconds=60, sqlite_path=path)
+    asyncio.run(first.set("key", make_response(request)))
+    first.close()
+
+    second = ResponseCache(max_entries=8, ttl_seconds=60, sqlite_path=path)
+    cached = asyncio.run(second.get("key"))
+    assert cached.result.text == "positive"
+    assert second.stats()["entries"] == 1
+    second.close()
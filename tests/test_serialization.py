@@ -0,0 +1,62 @@
+import json
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.api.schemas import SuccessResponse
+from app.core.config import settings
+from app.providers.client_pool import client_pool
+from app.utils.json_tools import canonical_hash, dumps, loads
+
+BIG_RESULT = {"rows": [{"id": i, "name": f"row {i}", "tags": ["a", "b"], "score": i / 7} for i in range(5000)]}
+
+@pytest.fixture
+def ollama_upstream(monkeypatch):
+    monkeypatch.setattr(settings, "CACHE_ENABLED", False)
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        content = json.dumps(BIG_RESULT)
+        return httpx.Response(200, json={
+            "message": {"role": "assistant", "content": content}, "done": True, "prompt_eval_count": 10, "eval_count": 900,
+        })
+
+    client_pool._http_clients[settings.OLLAMA_BASE_URL] = httpx.AsyncClient(
+        base_url=settings.OLLAMA_BASE_URL, transport=httpx.MockTransport(handler)
+    )
+    yield requests
+    client_pool._http_clients.pop(settings.OLLAMA_BASE_URL, None)
+
+BODY = {
+    "provider": "ollama",
+    "model": "llama3.1",
+    "auth": {"type": "none"},
+    "response_format": "json",
+    "input": {"messages": [{"role": "user", "content": "List the rows of tést ✓"}]},
+}
+
+def test_large_json_result_round_trips(ollama_upstream):
+    res = TestClient(app).post("/v1/agent:run", json=BODY)
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "application/json"
+    body = res.json()
+    assert body["result"]["json"] == BIG_RESULT
+    SuccessResponse.model_validate(body)
+
+    sent = ollama_upstream[0]
+    assert sent.headers["content-type"] == "application/json"
+    assert "tést ✓".encode() in sent.content
+    assert loads(sent.content)["messages"] == BODY["input"]["messages"]
+
+def test_request_body_errors_still_reported():
+    client = TestClient(app)
+    res = client.post("/v1/agent:run", content=b'{"provider": "ollama",', headers={"Content-Type": "application/json"})
+    assert res.status_code in (400, 422)
+    res = client.post("/v1/agent:run", json={**BODY, "provider": "nope"})
+    assert res.status_code in (400, 422)
+
+def test_canonical_hash_ignores_key_order():
+    assert canonical_hash({"b": 1, "a": [1, {"y": 2, "x": 1}]}) == canonical_hash({"a": [1, {"x": 1, "y": 2}], "b": 1})
+    assert canonical_hash({"a": 1}) != canonical_hash({"a": 2})
+    assert loads(dumps({1: "x"})) == {"1": "x"}
@@ -0,0 +1,50 @@
+import asyncio
+import subprocess
+import sys
+import pytest
+from app.core.concurrency import Limiter
+from app.core.shared_state import SharedState
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "state")
+
+def test_counter_limit_is_shared_between_handles(path):
+    # Two handles on one file stand in for two workers.
+    a, b = SharedState(path, slots=16), SharedState(path, slots=16)
+    assert a.acquire("slots:global", 2)
+    assert b.acquire("slots:global", 2)
+    assert not a.acquire("slots:global", 2)
+    b.release("slots:global")
+    assert a.acquire("slots:global", 2)
+    assert b.held("slots:global") == 2
+
+def test_update_and_long_names(path):
+    state = SharedState(path, slots=16)
+    name = "bucket:" + "x" * 200
+    assert state.update(name, lambda a, b: (a + 5, 42.0, a + 5)) == 5
+    assert SharedState(path, slots=16).read(name) == (5.0, 42.0)
+
+def test_slots_of_dead_workers_are_reclaimed(path):
+    code = f"from app.core.shared_state import SharedState; SharedState({path!r}, slots=16).acquire('slots:global', 10)"
+    subprocess.run([sys.executable, "-c", code], check=True)
+    state = SharedState(path, slots=16)
+    assert state.acquire("slots:global", 10)
+    assert state.held("slots:global") == 2
+    assert state.reclaim_dead_workers() == 1
+    assert state.held("slots:global") == 1
+
+def test_limiter_waits_for_a_slot_freed_by_another_worker(path):
+    async def main():
+        first = Limiter("global", 1, 10, 1, SharedState(path, slots=16))
+        second = Limiter("global", 1, 10, 1, SharedState(path, slots=16))
+        await first.acquire()
+        waiting = asyncio.create_task(second.acquire())
+        await asyncio.sleep(0.02)
+        assert not waiting.done() and second.queued == 1
+        first.release()
+        await asyncio.wait_for(waiting, 0.5)
+        assert second.in_flight == 1 and first.in_flight == 0
+
+    asyncio.run(main())
@@ -0,0 +1,164 @@
+import asyncio
+import pytest
+from app.agents import agent_service as agent_service_module
+from app.providers import policy as policy_module
+from app.agents.agent_service import AgentService
+from app.agents.cache import ResponseCache
+from app.api.schemas import AgentRunRequest, SuccessResponse, Result, Usage, Billing, Timing
+from app.billing.ledger import UsageLedger
+from app.core.config import settings
+from app.core.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    executions = []
+
+    async def work():
+        executions.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert len(executions) == 1
+    assert [result for result, _ in results] == ["result"] * 5
+    assert [shared for _, shared in results] == [False, True, True, True, True]
+    assert flight.stats() == {"executions": 1, "coalesced": 4, "in_flight": 0}
+
+def test_exception_is_delivered_to_every_waiter():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", work) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+
+def test_call_continues_while_any_waiter_remains():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def main():
+        leader = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(main()) == ("done", True)
+
+def test_call_is_cancelled_when_last_waiter_leaves():
+    flight = SingleFlight()
+    cancelled = []
+
+    async def work():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def main():
+        waiter = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.sleep(0.01)
+        assert flight.in_flight() == 0
+
+    asyncio.run(main())
+    assert cancelled == [True]
+
+
+class CountingProvider:
+    def __init__(self):
+        self.calls = 0
+
+    async def invoke(self, request):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return SuccessResponse(
+            trace_id=request.trace_id,
+            provider=request.provider,
+            model=request.model,
+            result=Result(type="text", text="ok"),
+            usage=Usage(input_tokens=5, output_tokens=1, total_tokens=6),
+            billing=Billing(pricing_source="unknown"),
+            timing=Timing(started_at="", ended_at="", duration_ms=0, provider_duration_ms=10),
+        )
+
+@pytest.fixture
+def provider(monkeypatch):
+    provider = CountingProvider()
+    monkeypatch.setattr(agent_service_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(policy_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(agent_service_module, "singleflight", SingleFlight())
+    monkeypatch.setattr(agent_service_module, "response_cache", ResponseCache(max_entries=8, ttl_seconds=60, sqlite_path=""))
+    return provider
+
+def make_request(**overrides) -> AgentRunRequest:
+    body = {
+        "provider": "openai",
+        "model": "gpt-4o-mini",
+        "auth": {"type": "api_key", "key": "key-a"},
+        "input": {"instruction": "Summarize the dashboard"},
+        "temperature": 0.7,
+    }
+    body.update(overrides)
+    return AgentRunRequest(**body)
+
+def test_run_agent_coalesces_identical_requests(provider):
+    async def main():
+        return await asyncio.gather(*(AgentService.run_agent(make_request(trace_id=f"t{i}")) for i in range(4)))
+
+    responses = asyncio.run(main())
+    assert provider.calls == 1
+    assert [r.trace_id for r in responses] == ["t0", "t1", "t2", "t3"]
+    assert sum(1 for r in responses if [w.code for w in r.warnings] == ["COALESCED"]) == 3
+
+def test_run_agent_does_not_coalesce_across_credentials(provider):
+    async def main():
+        return await asyncio.gather(
+            AgentService.run_agent(make_request()),
+            AgentService.run_agent(make_request(auth={"type": "api_key", "key": "key-b"})),
+        )
+
+    asyncio.run(main())
+    assert provider.calls == 2
+
+def test_run_agent_coalesce_opt_out(provider):
+    async def main():
+        return await asyncio.gather(*(AgentService.run_agent(make_request(coalesce=False)) for _ in range(3)))
+
+    asyncio.run(main())
+    assert provider.calls == 3
+
+def test_coalesced_followers_are_not_billed_in_the_response_or_the_ledger(provider, monkeypatch):
+    monkeypatch.setattr(settings, "PRICING_JSON", '{"openai": {"gpt-4o-mini": {"input_per_1k": 1, "output_per_1k": 2}}}')
+    ledger = UsageLedger(path=":memory:")
+    monkeypatch.setattr(agent_service_module, "usage_ledger", ledger)
+
+    async def main():
+        responses = await asyncio.gather(*(AgentService.run_agent(make_request(), tenant_id="acme") for _ in range(3)))
+        await ledger.flush()
+        return responses, await ledger.query(granularity="total")
+
+    responses, rows = asyncio.run(main())
+    leader = [r for r in responses if not r.warnings]
+    followers = [r for r in responses if r.warnings]
+    assert len(leader) == 1 and leader[0].billing.estimated_cost == pytest.approx(0.007)
+    assert not leader[0].usage.cached
+    assert len(followers) == 2
+    assert all(r.usage.cached and r.billing.estimated_cost == 0 for r in followers)
+    assert [(row["requests"], row["upstream_requests"]) for row in rows] == [(3, 1)]
+    assert rows[0]["cost"] == pytest.approx(sum(r.billing.estimated_cost for r in responses))
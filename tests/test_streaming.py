@@ -0,0 +1,135 @@
+import json
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.core.circuit_breaker import circuit_breakers
+from app.core.config import settings
+from app.core.errors import ProviderException
+from app.providers.client_pool import client_pool
+
+OLLAMA_LINES = [
+    {"message": {"role": "assistant", "content": "Hel"}, "done": False},
+    {"message": {"role": "assistant", "content": "lo"}, "done": False},
+    {"message": {"role": "assistant", "content": ""}, "done": True, "prompt_eval_count": 12, "eval_count": 2},
+]
+
+@pytest.fixture
+def ollama_upstream():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        requests.append(payload)
+        body = "\n".join(json.dumps(line) for line in OLLAMA_LINES) + "\n"
+        return httpx.Response(200, content=body.encode())
+
+    client_pool._http_clients[settings.OLLAMA_BASE_URL] = httpx.AsyncClient(
+        base_url=settings.OLLAMA_BASE_URL, transport=httpx.MockTransport(handler)
+    )
+    yield requests
+    client_pool._http_clients.pop(settings.OLLAMA_BASE_URL, None)
+
+def parse_sse(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+def test_agent_stream_emits_deltas_then_done(ollama_upstream):
+    client = TestClient(app)
+    res = client.post("/v1/agent:stream", json={
+        "provider": "ollama",
+        "model": "llama3.1",
+        "auth": {"type": "none"},
+        "input": {"instruction": "Say hello"},
+    })
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(res.text)
+    assert [name for name, _ in events] == ["delta", "delta", "done"]
+    assert "".join(data["delta"] for name, data in events if name == "delta") == "Hello"
+
+    done = events[-1][1]
+    assert done["usage"] == {"input_tokens": 12, "output_tokens": 2, "total_tokens": 14, "is_estimated": False, "cached": False, "cached_input_tokens": 0}
+    assert done["timing"]["time_to_first_token_ms"] is not None
+    assert done["trace_id"] == res.headers["X-Trace-ID"]
+    assert ollama_upstream[0]["stream"] is True
+
+def test_agent_stream_failing_before_the_first_event_gets_an_error_status():
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(500)
+
+    client_pool._http_clients[settings.OLLAMA_BASE_URL] = httpx.AsyncClient(
+        base_url=settings.OLLAMA_BASE_URL, transport=httpx.MockTransport(handler)
+    )
+    try:
+        res = TestClient(app).post("/v1/agent:stream", json={
+            "provider": "ollama",
+            "model": "llama3.1",
+            "auth": {"type": "none"},
+            "input": {"instruction": "Say hello"},
+        })
+    finally:
+        client_pool._http_clients.pop(settings.OLLAMA_BASE_URL, None)
+    assert res.status_code == 502
+    assert res.json()["error"]["code"] == "PROVIDER_ERROR"
+
+def test_open_breaker_rejects_the_stream_with_retry_after(monkeypatch):
+    monkeypatch.setattr(settings, "CIRCUIT_MIN_CALLS", 1)
+    breaker = circuit_breakers.get("openai", "gpt-4o-mini")
+    with pytest.raises(ProviderException):
+        with breaker.call():
+            raise ProviderException(details={"upstream_status": 500})
+    res = TestClient(app).post("/v1/agent:stream", json={
+        "provider": "openai",
+        "model": "gpt-4o-mini",
+        "auth": {"type": "api_key", "key": "sk-test"},
+        "input": {"instruction": "Say hello"},
+    })
+    assert res.status_code == 503
+    assert res.json()["error"]["code"] == "CIRCUIT_OPEN"
+    assert int(res.headers["Retry-After"]) >= 1
+
+def test_agent_stream_validates_input():
+    res = TestClient(app).post("/v1/agent:stream", json={
+        "provider": "ollama",
+        "model": "llama3.1",
+        "auth": {"type": "none"},
+        "input": {},
+    })
+    assert res.status_code == 400
+    assert res.json()["error"]["code"] == "VALIDATION_ERROR"
+
+def test_agent_stream_rejects_incomplete_json():
+    lines = [
+        {"message": {"role": "assistant", "content": '{"name": "x", '}, "done": False},
+        {"message": {"role": "assistant", "content": '"age"'}, "done": False},
+        {"message": {"role": "assistant", "content": ""}, "done": True, "prompt_eval_count": 12, "eval_count": 6},
+    ]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=("\n".join(json.dumps(line) for line in lines) + "\n").encode())
+
+    client_pool._http_clients[settings.OLLAMA_BASE_URL] = httpx.AsyncClient(
+        base_url=settings.OLLAMA_BASE_URL, transport=httpx.MockTransport(handler)
+    )
+    try:
+        res = TestClient(app).post("/v1/agent:stream", json={
+            "provider": "ollama",
+            "model": "llama3.1",
+            "auth": {"type": "none"},
+            "input": {"instruction": "Describe the person"},
+            "response_format": "json",
+            "json_schema": {
+                "type": "object",
+                "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
+                "required": ["name", "age"],
+            },
+        })
+    finally:
+        client_pool._http_clients.pop(settings.OLLAMA_BASE_URL, None)
+    events = parse_sse(res.text)
+    assert [name for name, _ in events] == ["delta", "delta", "error"]
+    assert events[-1][1]["error"]["code"] == "JSON_INVALID"
@@ -0,0 +1,51 @@
+import pytest
+from app.api.schemas import Message
+from app.utils.token_estimator import DEFAULT_RATIOS, MESSAGE_OVERHEAD_TOKENS, TokenEstimator, classify
+
+PROSE = "The quick brown fox jumps over the lazy dog while the farmer watches quietly. " * 4
+
+
+def test_classify():
+    assert classify('{"a": 1, "b": [1, 2]}') == "json"
+    assert classify("def f(x):\n    return {x: g(x)} if (x > 0) else [x]; y = (a < b)") == "code"
+    assert classify(PROSE) == "prose"
+
+def test_uncalibrated_estimate_uses_defaults():
+    estimator = TokenEstimator()
+    messages = [Message(role="user", content=PROSE)]
+    expected = round(len(PROSE) / DEFAULT_RATIOS["prose"] + MESSAGE_OVERHEAD_TOKENS)
+    assert estimator.estimate_messages(messages, "gemini", "gemini-1.5-pro") == expected
+
+def test_learns_from_exact_counts():
+    estimator = TokenEstimator(learning_rate=0.5)
+    messages = [{"role": "user", "content": PROSE}]
+    # The provider's tokenizer packs 6 chars per token.
+    actual = round(len(PROSE) / 6) + MESSAGE_OVERHEAD_TOKENS
+    for _ in range(30):
+        estimator.observe_messages("openai", "gpt-4o-mini", messages, actual)
+    assert estimator.ratio("openai", "gpt-4o-mini", "prose") == pytest.approx(6, rel=0.02)
+    assert estimator.estimate_messages(messages, "openai", "gpt-4o-mini") == pytest.approx(actual, abs=1)
+
+def test_uncalibrated_models_fall_back_to_broader_levels():
+    estimator = TokenEstimator(learning_rate=0.5)
+    for _ in range(30):
+        estimator.observe_output("openai", "gpt-4o-mini", 600, "json", 100)
+    assert estimator.ratio("openai", "gpt-4o", "json") == pytest.approx(6, rel=0.02)
+    assert estimator.ratio("gemini", "gemini-1.5-pro", "json") == pytest.approx(6, rel=0.02)
+    assert estimator.ratio("gemini", "gemini-1.5-pro", "prose") == DEFAULT_RATIOS["prose"]
+
+def test_ignores_observations_without_signal():
+    estimator = TokenEstimator()
+    # Ollama reports prompt_eval_count 0 when the prompt was served from its KV cache.
+    estimator.observe_messages("ollama", "llama3.1", [{"role": "user", "content": PROSE}], 0)
+    assert estimator.observations == 0
+
+def test_calibration_persists(tmp_path):
+    path = str(tmp_path / "calibration.json")
+    estimator = TokenEstimator(learning_rate=0.5)
+    estimator.observe_output("ollama", "llama3.1", 500, "code", 100)
+    estimator.save(path)
+
+    restored = TokenEstimator()
+    restored.load(path)
+    assert restored.ratio("ollama", "llama3.1", "code") == pytest.approx(estimator.ratio("ollama", "llama3.1", "code"), rel=1e-3)
@@ -0,0 +1,129 @@
+import asyncio
+import sqlite3
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.agents import agent_service as agent_service_module
+from app.providers import policy as policy_module
+from app.api import routes as routes_module
+from app.agents.cache import ResponseCache
+from app.api.schemas import SuccessResponse, Result, Usage, Billing, Timing
+from app.billing.ledger import UsageLedger
+from app.billing.models import UsageEvent
+from app.core.config import settings
+
+HOUR = 3600 * 480000  # some whole hour
+
+
+def make_event(tenant="acme", ts=HOUR + 10, cost=0.5, upstream=True) -> UsageEvent:
+    return UsageEvent(
+        ts=ts, tenant=tenant, provider="openai", model="gpt-4o-mini", trace_id="t",
+        input_tokens=100, output_tokens=20, cached_input_tokens=0, cost=cost,
+        is_estimated=False, upstream=upstream, pricing_version="v1",
+    )
+
+def test_rollups_by_tenant_and_hour(tmp_path):
+    async def run():
+        ledger = UsageLedger(path=str(tmp_path / "usage.db"))
+        ledger.record(make_event())
+        ledger.record(make_event(ts=HOUR + 20, upstream=False, cost=None))
+        ledger.record(make_event(ts=HOUR + 3600))
+        ledger.record(make_event(tenant="other"))
+        hourly = await ledger.query(tenant="acme")
+        total = await ledger.query(granularity="total")
+        await ledger.aclose()
+        return hourly, total
+
+    hourly, total = asyncio.run(run())
+    assert [(row["period_start"], row["requests"], row["upstream_requests"]) for row in hourly] == [(HOUR, 2, 1), (HOUR + 3600, 1, 1)]
+    assert hourly[0]["input_tokens"] == 200
+    assert hourly[0]["cost"] == 0.5
+    assert {row["tenant"]: row["requests"] for row in total} == {"acme": 3, "other": 1}
+
+def test_full_buffer_keeps_totals_but_bounds_memory(tmp_path):
+    path = str(tmp_path / "usage.db")
+
+    async def run():
+        ledger = UsageLedger(path=path, max_pending=2)
+        for _ in range(5):
+            ledger.record(make_event())
+        assert ledger.stats()["pending"] == 2
+        assert ledger.overflowed == 3
+        rows = await ledger.query(granularity="total")
+        await ledger.aclose()
+        return rows
+
+    rows = asyncio.run(run())
+    assert rows[0]["requests"] == 5
+    assert rows[0]["cost"] == 2.5
+    assert sqlite3.connect(path).execute("SELECT COUNT(*) FROM usage_events").fetchone()[0] == 2
+
+def test_failed_write_keeps_totals_for_next_flush(tmp_path):
+    async def run():
+        ledger = UsageLedger(path=str(tmp_path / "missing" / "usage.db"))
+        ledger.record(make_event())
+        await ledger.flush()
+        assert ledger.write_errors == 1
+        ledger.path = str(tmp_path / "usage.db")
+        rows = await ledger.query(granularity="total")
+        await ledger.aclose()
+        return rows
+
+    assert asyncio.run(run())[0]["requests"] == 1
+
+
+class FakeProvider:
+    async def invoke(self, request):
+        return SuccessResponse(
+            trace_id=request.trace_id,
+            provider=request.provider,
+            model=request.model,
+            result=Result(type="text", text="ok"),
+            usage=Usage(input_tokens=10, output_tokens=2, total_tokens=12),
+            billing=Billing(pricing_source="unknown"),
+            timing=Timing(started_at="", ended_at="", duration_ms=0, provider_duration_ms=5),
+        )
+
+@pytest.fixture
+def ledger(monkeypatch):
+    provider = FakeProvider()
+    ledger = UsageLedger(path=":memory:")
+    monkeypatch.setattr(agent_service_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(policy_module, "get_provider", lambda name: provider)
+    monkeypatch.setattr(agent_service_module, "response_cache", ResponseCache(max_entries=8, ttl_seconds=60, sqlite_path=""))
+    monkeypatch.setattr(agent_service_module, "usage_ledger", ledger)
+    monkeypatch.setattr(routes_module, "usage_ledger", ledger)
+    return ledger
+
+def test_usage_endpoint_reports_per_tenant(ledger, monkeypatch):
+    monkeypatch.setattr(settings, "GATEWAY_API_KEY", "admin-secret")
+    trusted = {"Authorization": "Bearer admin-secret"}
+    body = {
+        "provider": "openai",
+        "model": "gpt-4o-mini",
+        "auth": {"type": "api_key", "key": "sk-test"},
+        "input": {"messages": [{"role": "user", "content": "hi"}]},
+    }
+    client = TestClient(app)
+    for _ in range(2):
+        assert client.post("/v1/agent:run", json=body, headers={**trusted, "X-Tenant-ID": "acme"}).status_code == 200
+    assert client.post("/v1/agent:run", json=body).status_code == 200
+
+    res = client.get("/v1/usage", params={"granularity": "total"}, headers=trusted)
+    assert res.status_code == 200
+    rows = {row["tenant"]: row for row in res.json()["rows"]}
+    assert rows["acme"]["requests"] == 2
+    assert rows["acme"]["input_tokens"] == 20
+    assert any(tenant.startswith("key:") for tenant in rows)
+
+def test_usage_endpoint_requires_gateway_key(ledger, monkeypatch):
+    monkeypatch.setattr(settings, "GATEWAY_API_KEY", "admin-secret")
+    client = TestClient(app)
+    assert client.get("/v1/usage").status_code == 401
+    assert client.get("/v1/usage", headers={"Authorization": "Bearer admin-secret"}).status_code == 200
+
+def test_usage_endpoint_is_closed_without_a_gateway_key(ledger, monkeypatch):
+    monkeypatch.setattr(settings, "GATEWAY_API_KEY", None)
+    client = TestClient(app)
+    assert client.get("/v1/usage").status_code == 401
+    assert client.get("/v1/usage", headers={"Authorization": "Bearer "}).status_code == 401